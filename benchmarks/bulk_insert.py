@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""
+    Bulk insert benchmark
+    ~~~~~~~~~~~~~~~~~~~~~
+
+    Compares adding model instances to the session one by one and
+    committing with :meth:`SQLAlchemy.bulk_insert` and
+    :meth:`SQLAlchemy.bulk_upsert`, for dictionaries and for instances,
+    with modification tracking enabled.
+
+    Run with ``python benchmarks/bulk_insert.py`` after ``make develop``.
+"""
+from __future__ import print_function
+
+import os
+import shutil
+import tempfile
+import time
+
+import flask
+from flask_sqlalchemy import SQLAlchemy
+
+ROWS = 20000
+
+
+def main():
+    directory = tempfile.mkdtemp()
+    try:
+        app = flask.Flask(__name__)
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + \
+            os.path.join(directory, 'bulk.db')
+        app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = True
+        db = SQLAlchemy(app)
+
+        class Item(db.Model):
+            id = db.Column(db.Integer, primary_key=True)
+            name = db.Column(db.String(40))
+            score = db.Column(db.Integer, default=0)
+
+        def rows():
+            return [{'id': i, 'name': 'item %d' % i, 'score': i}
+                    for i in range(1, ROWS + 1)]
+
+        def session_add():
+            for row in rows():
+                db.session.add(Item(**row))
+            db.session.commit()
+
+        def bulk_insert_dicts():
+            db.bulk_insert(Item, rows())
+
+        def bulk_insert_instances():
+            db.bulk_insert(Item, [Item(**row) for row in rows()])
+
+        def bulk_upsert():
+            db.bulk_upsert(Item, rows())
+
+        print('%d rows, seconds' % ROWS)
+        with app.app_context():
+            for label, func, fresh in [
+                    ('session.add + commit', session_add, True),
+                    ('bulk_insert, dicts', bulk_insert_dicts, True),
+                    ('bulk_insert, instances', bulk_insert_instances, True),
+                    ('bulk_upsert, new rows', bulk_upsert, True),
+                    ('bulk_upsert, existing rows', bulk_upsert, False)]:
+                if fresh:
+                    db.drop_all()
+                    db.create_all()
+                start = time.time()
+                func()
+                print('%-28s %8.3f' % (label, time.time() - start))
+                db.session.remove()
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""
+    Concurrent DDL benchmark
+    ~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Times :meth:`SQLAlchemy.create_all`, :meth:`~SQLAlchemy.reflect` and
+    :meth:`~SQLAlchemy.drop_all` on several binds that are SQLite database
+    files, one bind after the other and with ``SQLALCHEMY_DDL_WORKERS``.
+    Local SQLite files answer faster than a database server, so the runs
+    are repeated with a delay before every statement that stands in for
+    the round trip over the network.
+
+    Run with ``python benchmarks/concurrent_ddl.py`` after ``make develop``.
+"""
+from __future__ import print_function
+
+import os
+import shutil
+import tempfile
+import time
+
+import flask
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+BINDS = 8
+TABLES = 40
+ROUND_TRIP = 0.002
+latency = [0.0]
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def round_trip(*args):
+    if latency[0]:
+        time.sleep(latency[0])
+
+
+def make_app(path, workers):
+    app = flask.Flask(__name__)
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['SQLALCHEMY_DATABASE_URI'] = \
+        'sqlite:///' + os.path.join(path, 'default.db')
+    app.config['SQLALCHEMY_BINDS'] = dict(
+        ('bind%d' % i, 'sqlite:///' + os.path.join(path, 'bind%d.db' % i))
+        for i in range(BINDS))
+    app.config['SQLALCHEMY_DDL_WORKERS'] = workers
+    return app
+
+
+def run(workers):
+    path = tempfile.mkdtemp()
+    try:
+        app = make_app(path, workers)
+        db = SQLAlchemy(app)
+        for key in [None] + list(app.config['SQLALCHEMY_BINDS']):
+            previous = None
+            for i in range(TABLES):
+                d = {'__bind_key__': key,
+                     '__tablename__': '%s_table%d' % (key, i),
+                     'id': db.Column(db.Integer, primary_key=True),
+                     'name': db.Column(db.String(40), index=True)}
+                if previous is not None:
+                    d['parent_id'] = db.Column(db.ForeignKey(previous.id))
+                previous = type('Model%s%d' % (key, i), (db.Model,), d)
+
+        timings = []
+        start = time.time()
+        db.create_all()
+        timings.append(time.time() - start)
+
+        reflecting = SQLAlchemy(make_app(path, workers))
+        start = time.time()
+        reflecting.reflect()
+        timings.append(time.time() - start)
+
+        start = time.time()
+        db.drop_all()
+        timings.append(time.time() - start)
+        return timings
+    finally:
+        shutil.rmtree(path)
+
+
+def main():
+    print('%d SQLite files with %d tables each' % (BINDS + 1, TABLES))
+    for latency[0] in 0.0, ROUND_TRIP:
+        print()
+        print('%.1f ms round trip' % (latency[0] * 1000))
+        print('%-20s %10s %10s %10s' % ('workers', 'create', 'reflect',
+                                        'drop'))
+        for workers in None, 2, 4, BINDS + 1:
+            print('%-20s %10.3f %10.3f %10.3f' % (
+                (workers or 'one after another',) + tuple(run(workers))))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""
+    Construction benchmark
+    ~~~~~~~~~~~~~~~~~~~~~~
+
+    Measures what creating :class:`SQLAlchemy` objects costs, as test
+    fixtures and application factories do many times, and the time to
+    import the extension in a fresh interpreter as every worker does on
+    boot.  The previous construction, which copied every name of
+    ``sqlalchemy`` and ``sqlalchemy.orm`` to each new object, is compared
+    with looking the names up on first use.
+
+    Run with ``python benchmarks/construction.py`` after ``make develop``.
+"""
+from __future__ import print_function
+
+import subprocess
+import sys
+import timeit
+
+import sqlalchemy
+from flask_sqlalchemy import SQLAlchemy, _make_table, \
+    _wrap_with_default_query_class, event
+
+
+def legacy_include_sqlalchemy(obj, cls):
+    """The names as they were copied before they were looked up lazily."""
+    for module in sqlalchemy, sqlalchemy.orm:
+        for key in module.__all__:
+            if not hasattr(obj, key):
+                setattr(obj, key, getattr(module, key))
+    obj.Table = _make_table(obj)
+    obj.relationship = _wrap_with_default_query_class(obj.relationship, cls)
+    obj.relation = _wrap_with_default_query_class(obj.relation, cls)
+    obj.dynamic_loader = _wrap_with_default_query_class(obj.dynamic_loader,
+                                                        cls)
+    obj.event = event
+
+
+def construct():
+    db = SQLAlchemy()
+    db.Column, db.Integer, db.String, db.relationship, db.ForeignKey
+
+
+def construct_legacy():
+    db = SQLAlchemy()
+    legacy_include_sqlalchemy(db, db.Query)
+    db.Column, db.Integer, db.String, db.relationship, db.ForeignKey
+
+
+def import_time(number=10):
+    code = ('import time; start = time.time(); import flask_sqlalchemy; '
+            'print(time.time() - start)')
+    times = [float(subprocess.check_output([sys.executable, '-c', code]))
+             for _ in range(number)]
+    return min(times)
+
+
+def main(number=2000):
+    print('%d SQLAlchemy objects using five names each' % number)
+    print('%-24s %10s %12s' % ('construction', 'seconds', 'us per object'))
+    for label, fn in [('eager copy (previous)', construct_legacy),
+                      ('lazy lookup', construct)]:
+        elapsed = timeit.timeit(fn, number=number)
+        print('%-24s %10.3f %12.1f' % (label, elapsed,
+                                       elapsed / number * 1e6))
+    print('import flask_sqlalchemy: %.3f seconds (best of 10)'
+          % import_time())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+    Engine lookup contention benchmark
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Measures the throughput of :meth:`SQLAlchemy.get_engine` with many
+    threads looking up engines at the same time, once with the lock-free
+    lookup and once with the previous implementation that takes two locks
+    and compares the configuration on every call.
+
+    Run with ``python benchmarks/engine_contention.py`` after
+    ``make develop``.
+"""
+from __future__ import print_function
+
+import threading
+import time
+
+import flask
+from flask_sqlalchemy import SQLAlchemy, _EngineConnector, get_state
+
+
+class LockingEngineConnector(_EngineConnector):
+    """The engine connector as it was before the lock-free lookup."""
+
+    def get_engine(self):
+        with self._lock:
+            uri = self.get_uri()
+            echo = self._app.config['SQLALCHEMY_ECHO']
+            if (uri, echo) == self._connected_for:
+                return self._engine
+            self._connect()
+            return self._engine
+
+
+class LockingSQLAlchemy(SQLAlchemy):
+
+    def make_connector(self, app=None, bind=None):
+        return LockingEngineConnector(self, self.get_app(app), bind)
+
+    def get_engine(self, app=None, bind=None):
+        app = self.get_app(app)
+        state = get_state(app)
+
+        with self._engine_lock:
+            connector = state.connectors.get(bind)
+
+            if connector is None:
+                connector = self.make_connector(app, bind)
+                state.connectors[bind] = connector
+
+            return connector.get_engine()
+
+
+def run(db, app, thread_count, lookups=60000):
+    binds = [None, 'foo', 'bar']
+    per_thread = lookups // thread_count // len(binds)
+    start = threading.Event()
+
+    def worker():
+        get_engine = db.get_engine
+        start.wait()
+        for _ in range(per_thread):
+            for bind in binds:
+                get_engine(app, bind)
+
+    threads = [threading.Thread(target=worker) for _ in range(thread_count)]
+    for thread in threads:
+        thread.start()
+    started = time.time()
+    start.set()
+    for thread in threads:
+        thread.join()
+    return per_thread * len(binds) * thread_count / (time.time() - started)
+
+
+def main():
+    app = flask.Flask(__name__)
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['SQLALCHEMY_BINDS'] = {'foo': 'sqlite://', 'bar': 'sqlite://'}
+
+    print('%8s %18s %18s' % ('threads', 'locking (ops/s)',
+                             'lock-free (ops/s)'))
+    for thread_count in 1, 4, 16, 64:
+        results = []
+        for cls in LockingSQLAlchemy, SQLAlchemy:
+            db = cls(app)
+            run(db, app, 1, lookups=300)
+            results.append(run(db, app, thread_count))
+        print('%8d %18d %18d' % ((thread_count,) + tuple(results)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""
+    Bind routing benchmark
+    ~~~~~~~~~~~~~~~~~~~~~~
+
+    Compares the per statement cost of :meth:`SignallingSession.get_bind`
+    with the routing table compiled per mapper against the previous
+    implementation, which looked up the bind key, the application state,
+    the engine and the replica configuration for every statement.
+
+    Run with ``python benchmarks/get_bind.py`` after ``make develop``.
+"""
+from __future__ import print_function
+
+import random
+import timeit
+
+import flask
+from flask_sqlalchemy import SQLAlchemy, SignallingSession, get_state, \
+    _current_bind_mode_context, _SLAVE
+from sqlalchemy.orm.session import Session as SessionBase
+from sqlalchemy.sql.expression import Select
+
+
+class LegacySession(SignallingSession):
+    """The session with the routing it had before it was compiled."""
+
+    def get_bind(self, mapper=None, clause=None):
+        if mapper is not None:
+            info = getattr(mapper.mapped_table, 'info', {})
+            bind_key = info.get('bind_key')
+            if bind_key is not None:
+                state = get_state(self.app)
+                return state.db.get_engine(self.app, bind=bind_key)
+
+        bind_mode_context = _current_bind_mode_context()
+        current_mode = getattr(bind_mode_context, 'current_mode', None)
+
+        if ((current_mode is None and isinstance(clause, Select)) or
+                current_mode is _SLAVE):
+            state = get_state(self.app)
+            slaves = self.app.config['SQLALCHEMY_DATABASE_SLAVE_URIS']
+            if slaves:
+                random_index = random.randrange(len(slaves))
+                bind_key = 'slaves_{}'.format(random_index)
+            else:
+                bind_key = None
+            return state.db.get_engine(self.app, bind=bind_key)
+
+        return SessionBase.get_bind(self, mapper, clause)
+
+
+def main(number=100000):
+    app = flask.Flask(__name__)
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['SQLALCHEMY_BINDS'] = {'users': 'sqlite://'}
+    app.config['SQLALCHEMY_DATABASE_SLAVE_URIS'] = ['sqlite://'] * 3
+    db = SQLAlchemy(app)
+
+    class User(db.Model):
+        __bind_key__ = 'users'
+        id = db.Column(db.Integer, primary_key=True)
+
+    class Item(db.Model):
+        id = db.Column(db.Integer, primary_key=True)
+
+    cases = [
+        ('bound mapper', User.__mapper__, None),
+        ('read', Item.__mapper__, Item.__table__.select()),
+        ('write', Item.__mapper__, None),
+    ]
+
+    print('%-14s %14s %14s' % ('statement', 'legacy (ns)', 'compiled (ns)'))
+    with app.app_context():
+        sessions = [LegacySession(db), SignallingSession(db)]
+        for name, mapper, clause in cases:
+            results = []
+            for session in sessions:
+                get_bind = session.get_bind
+                get_bind(mapper, clause)
+                best = min(timeit.repeat(lambda: get_bind(mapper, clause),
+                                         number=number, repeat=3))
+                results.append(best / number * 1e9)
+            print('%-14s %14.0f %14.0f' % ((name,) + tuple(results)))
+
+
+if __name__ == '__main__':
+    main()
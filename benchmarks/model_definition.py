@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""
+    Model definition benchmark
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Measures the startup cost of defining thousands of models that share a
+    hierarchy of mixins, as a large application does on import.  The time
+    spent deciding whether to generate a tablename is shown on its own for
+    the previous implementation, which ran ``dir`` and ``getattr`` over
+    every base of every model, and for the scan of each base's MRO that is
+    done once per base.
+
+    Run with ``python benchmarks/model_definition.py`` after
+    ``make develop``.
+"""
+from __future__ import print_function
+
+import time
+
+import flask
+import flask_sqlalchemy
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import Column
+
+MODELS = 3000
+MIXIN_DEPTH = 8
+
+
+def legacy_should_set_tablename(bases, d):
+    """The check as it was before bases were scanned once."""
+    if '__tablename__' in d or '__table__' in d or '__abstract__' in d:
+        return False
+
+    if any(v.primary_key for v in d.values() if isinstance(v, Column)):
+        return True
+
+    for base in bases:
+        if hasattr(base, '__tablename__') or hasattr(base, '__table__'):
+            return False
+
+        for name in dir(base):
+            attr = getattr(base, name)
+
+            if isinstance(attr, Column) and attr.primary_key:
+                return True
+
+
+def run(should_set_tablename):
+    app = flask.Flask(__name__)
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db = SQLAlchemy(app)
+
+    mixin = type('IdMixin', (object,), {
+        'id': db.Column(db.Integer, primary_key=True)})
+    for i in range(MIXIN_DEPTH):
+        mixin = type('Mixin%d' % i, (mixin,), {
+            'field_%d' % i: db.Column(db.String(20))})
+
+    checking = [0.0]
+
+    def timed(bases, d):
+        start = time.time()
+        try:
+            return should_set_tablename(bases, d)
+        finally:
+            checking[0] += time.time() - start
+
+    original = flask_sqlalchemy._should_set_tablename
+    flask_sqlalchemy._should_set_tablename = timed
+    try:
+        start = time.time()
+        for i in range(MODELS):
+            type('SyntheticModel%d' % i, (mixin, db.Model), {
+                'value': db.Column(db.Integer)})
+        elapsed = time.time() - start
+    finally:
+        flask_sqlalchemy._should_set_tablename = original
+    return elapsed, checking[0]
+
+
+def main():
+    print('%d models with %d mixins each' % (MODELS, MIXIN_DEPTH + 1))
+    print('%-24s %10s %14s' % ('tablename check', 'seconds',
+                               'of it checking'))
+    for label, check in [('dir scan (previous)', legacy_should_set_tablename),
+                         ('memoized MRO scan',
+                          flask_sqlalchemy._should_set_tablename)]:
+        elapsed, checking = run(check)
+        print('%-24s %10.3f %14.3f' % (label, elapsed, checking))
+
+
+if __name__ == '__main__':
+    main()
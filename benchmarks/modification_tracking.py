@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""
+    Modification tracking benchmark
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Measures the flush overhead of ``SQLALCHEMY_TRACK_MODIFICATIONS`` for a
+    session that adds and changes instances and flushes in a loop.  The
+    previous implementation, which scanned ``session.new``,
+    ``session.dirty`` and ``session.deleted`` before every flush and
+    commit, is compared with the mapper events that record every written
+    instance once, and with tracking turned off.
+
+    Run with ``python benchmarks/modification_tracking.py`` after
+    ``make develop``.
+"""
+from __future__ import print_function
+
+import time
+
+import flask
+from flask_sqlalchemy import SQLAlchemy, models_committed
+from sqlalchemy import event, inspect
+
+ITERATIONS = 2000
+BATCH = 5
+
+
+class LegacySignalEvents(object):
+    """The session events as they were before tracking was incremental."""
+
+    @classmethod
+    def register(cls, session):
+        session._legacy_changes = {}
+        event.listen(session, 'before_flush', cls.record_ops)
+        event.listen(session, 'before_commit', cls.record_ops)
+        event.listen(session, 'after_commit', cls.after_commit)
+
+    @staticmethod
+    def record_ops(session, flush_context=None, instances=None):
+        d = session._legacy_changes
+        for targets, operation in ((session.new, 'insert'),
+                                   (session.dirty, 'update'),
+                                   (session.deleted, 'delete')):
+            for target in targets:
+                state = inspect(target)
+                key = state.identity_key if state.has_identity else id(target)
+                d[key] = (target, operation)
+
+    @staticmethod
+    def after_commit(session):
+        d = session._legacy_changes
+        if d:
+            models_committed.send(session.app, changes=list(d.values()))
+            d.clear()
+
+
+def run(track_modifications, legacy=False):
+    app = flask.Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = track_modifications
+    db = SQLAlchemy(app)
+
+    class Item(db.Model):
+        id = db.Column(db.Integer, primary_key=True)
+        name = db.Column(db.String(40))
+
+    db.create_all()
+    received = []
+
+    def committed(sender, changes):
+        received.append(len(changes))
+
+    with app.app_context(), \
+            models_committed.connected_to(committed, sender=app):
+        session = db.session()
+        if legacy:
+            LegacySignalEvents.register(session)
+        items = []
+        start = time.time()
+        for i in range(ITERATIONS):
+            for j in range(BATCH):
+                items.append(Item(name=str(j)))
+                session.add(items[-1])
+            items[i // 2].name = 'changed %d' % i
+            session.flush()
+        session.commit()
+        elapsed = time.time() - start
+        db.session.remove()
+    return elapsed, sum(received)
+
+
+def main():
+    print('%d flushes of %d new and one changed instance' % (ITERATIONS,
+                                                             BATCH))
+    print('%-24s %10s %10s' % ('tracking', 'seconds', 'changes'))
+    for label, args in [('off', (False,)),
+                        ('scanning (previous)', (False, True)),
+                        ('incremental', (True,))]:
+        elapsed, changes = run(*args)
+        print('%-24s %10.3f %10d' % (label, elapsed, changes))
+
+
+if __name__ == '__main__':
+    main()
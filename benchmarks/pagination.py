@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+    Pagination benchmark
+    ~~~~~~~~~~~~~~~~~~~~
+
+    Compares the latency of :meth:`BaseQuery.paginate`, which skips rows
+    with ``OFFSET`` and counts them, with :meth:`BaseQuery.seek_paginate`,
+    which starts right after the cursor, as the requested page gets deeper.
+
+    Run with ``python benchmarks/pagination.py`` after ``make develop``.
+"""
+from __future__ import print_function
+
+import os
+import shutil
+import tempfile
+import timeit
+
+import flask
+from flask_sqlalchemy import SQLAlchemy, _encode_cursor
+
+ROWS = 200000
+PER_PAGE = 20
+DEPTHS = [1, 10, 100, 1000, 5000, 9999]
+NUMBER = 20
+
+
+def main():
+    directory = tempfile.mkdtemp()
+    try:
+        app = flask.Flask(__name__)
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + \
+            os.path.join(directory, 'pagination.db')
+        app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+        db = SQLAlchemy(app)
+
+        class Item(db.Model):
+            id = db.Column(db.Integer, primary_key=True)
+            score = db.Column(db.Integer, nullable=False, index=True)
+
+        db.create_all()
+        db.engine.execute(Item.__table__.insert(), [
+            {'id': i, 'score': (i * 7919) % 1000} for i in range(1, ROWS + 1)])
+
+        with app.app_context():
+            ordered = Item.query.order_by(Item.score, Item.id)
+
+            print('%d rows, %d per page, ms per page' % (ROWS, PER_PAGE))
+            print('%8s %12s %12s %12s' % ('page', 'offset', 'offset+count',
+                                          'keyset'))
+            for page in DEPTHS:
+                # the cursor a client would hold after reaching this page
+                last = ordered.offset((page - 1) * PER_PAGE - 1).first() \
+                    if page > 1 else None
+                cursor = last and _encode_cursor([last.score, last.id])
+
+                def offset():
+                    ordered.limit(PER_PAGE) \
+                        .offset((page - 1) * PER_PAGE).all()
+
+                def paginate():
+                    ordered.paginate(page, PER_PAGE)
+
+                def keyset():
+                    Item.query.seek_paginate(Item.score, cursor, PER_PAGE)
+
+                results = []
+                for func in offset, paginate, keyset:
+                    best = min(timeit.repeat(func, number=NUMBER, repeat=3))
+                    results.append(best / NUMBER * 1e3)
+                print('%8d %12.3f %12.3f %12.3f' % ((page,) + tuple(results)))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
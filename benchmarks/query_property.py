@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""
+    Query property benchmark
+    ~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Measures the cost of building ``Model.query.filter_by(...)`` without
+    executing it.  The previous query property, which resolved the mapper
+    and set up a new query for every access, is compared with copying the
+    query prepared per model class for the current session.
+
+    Run with ``python benchmarks/query_property.py`` after ``make develop``.
+"""
+from __future__ import print_function
+
+import timeit
+
+import flask
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import orm
+from sqlalchemy.orm.exc import UnmappedClassError
+
+
+class LegacyQueryProperty(object):
+    """The query property as it was before queries were prepared."""
+
+    def __init__(self, sa):
+        self.sa = sa
+
+    def __get__(self, obj, type):
+        try:
+            mapper = orm.class_mapper(type)
+            if mapper:
+                return type.query_class(mapper, session=self.sa.session())
+        except UnmappedClassError:
+            return None
+
+
+def main(number=50000):
+    app = flask.Flask(__name__)
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db = SQLAlchemy(app)
+
+    class User(db.Model):
+        id = db.Column(db.Integer, primary_key=True)
+        name = db.Column(db.String(40))
+        email = db.Column(db.String(80))
+
+    db.create_all()
+
+    def build():
+        User.query.filter_by(name='x')
+
+    with app.app_context():
+        current = timeit.timeit(build, number=number)
+        User.query = LegacyQueryProperty(db)
+        legacy = timeit.timeit(build, number=number)
+
+    print('%d times Model.query.filter_by(...)' % number)
+    print('%-24s %10s %12s' % ('query property', 'seconds', 'us per query'))
+    for label, elapsed in [('new query (previous)', legacy),
+                           ('prepared query', current)]:
+        print('%-24s %10.3f %12.2f' % (label, elapsed,
+                                       elapsed / number * 1e6))
+
+
+if __name__ == '__main__':
+    main()
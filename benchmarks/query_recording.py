@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+    Query recording benchmark
+    ~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Measures the cost of finding the call site of a recorded query with a
+    realistic stack between the application and the cursor: application
+    code calling into the framework, then a few dozen frames of SQLAlchemy.
+    The previous implementation, which compared the module name of every
+    frame and formatted the context for every query, is used as baseline.
+
+    Run with ``python benchmarks/query_recording.py`` after ``make develop``.
+"""
+from __future__ import print_function
+
+import sys
+import timeit
+import types
+
+from flask_sqlalchemy import _CallSiteResolver, _format_call_site
+
+try:
+    xrange
+except NameError:
+    xrange = range
+
+APP_PACKAGE = 'benchapp'
+ORM_DEPTH = 30
+FRAMEWORK_DEPTH = 15
+NUMBER = 20000
+
+
+def legacy_calling_context(app_path):
+    frm = sys._getframe(1)
+    while frm.f_back is not None:
+        name = frm.f_globals.get('__name__')
+        if name and (name == app_path or name.startswith(app_path + '.')):
+            return '%s:%s (%s)' % (frm.f_code.co_filename, frm.f_lineno,
+                                   frm.f_code.co_name)
+        frm = frm.f_back
+    return '<unknown>'
+
+
+def make_module(name, source):
+    module = types.ModuleType(name)
+    exec(compile(source, '<%s>' % name, 'exec'), module.__dict__)
+    return module
+
+
+def make_chain(name, depth):
+    """A module whose ``call(func)`` calls `func` `depth` frames deeper."""
+    lines = ['def f0(func):\n    return func()\n']
+    for i in xrange(1, depth):
+        lines.append('def f%d(func):\n    return f%d(func)\n' % (i, i - 1))
+    lines.append('call = f%d\n' % (depth - 1))
+    return make_module(name, ''.join(lines))
+
+
+orm = make_chain('sqlalchemy.fake', ORM_DEPTH)
+framework = make_chain('werkzeug.fake', FRAMEWORK_DEPTH)
+app = make_module(APP_PACKAGE + '.views', '''
+def view(orm, func):
+    return orm.call(func)
+''')
+
+
+def run(func):
+    return framework.call(lambda: app.view(orm, func))
+
+
+def main():
+    resolver = _CallSiteResolver(APP_PACKAGE)
+
+    def legacy():
+        for _ in xrange(NUMBER):
+            legacy_calling_context(APP_PACKAGE)
+
+    def cached():
+        for _ in xrange(NUMBER):
+            resolver()
+
+    def cached_read():
+        for _ in xrange(NUMBER):
+            _format_call_site(resolver())
+
+    print('%d frames of ORM code above the application' % ORM_DEPTH)
+    print('%-28s %10s' % ('implementation', 'us/query'))
+    for label, func in [('legacy', legacy),
+                        ('cached, not read', cached),
+                        ('cached, context read', cached_read)]:
+        best = min(timeit.repeat(lambda: run(func), number=1, repeat=5))
+        print('%-28s %10.2f' % (label, best / NUMBER * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""
+    Replica balancer benchmark
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Sends reads from several threads to three SQLite replicas, one of which
+    answers ten times slower than the others, and reports the read latency
+    percentiles for each of the builtin balancers.
+
+    Run with ``python benchmarks/replica_balancers.py`` after
+    ``make develop``.
+"""
+from __future__ import print_function
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+import flask
+from flask_sqlalchemy import SQLAlchemy, get_state
+from sqlalchemy import event
+from sqlalchemy.pool import QueuePool
+
+
+DELAYS = [0.001, 0.001, 0.01]
+THREADS = 8
+READS = 150
+
+
+class BenchmarkSQLAlchemy(SQLAlchemy):
+
+    def apply_driver_hacks(self, app, info, options):
+        SQLAlchemy.apply_driver_hacks(self, app, info, options)
+        # pool file connections so that the pools report their load
+        options['poolclass'] = QueuePool
+        options['connect_args'] = {'check_same_thread': False}
+
+
+def simulate_delay(delay):
+    def before_cursor_execute(*args):
+        time.sleep(delay)
+    return before_cursor_execute
+
+
+def run(balancer, weights, directory):
+    app = flask.Flask(__name__)
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['SQLALCHEMY_POOL_SIZE'] = THREADS
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(
+        directory, 'master.db')
+    app.config['SQLALCHEMY_DATABASE_SLAVE_URIS'] = [
+        'sqlite:///' + os.path.join(directory, 'replica%d.db' % i)
+        for i in range(len(DELAYS))]
+    app.config['SQLALCHEMY_DATABASE_SLAVE_WEIGHTS'] = weights
+    app.config['SQLALCHEMY_DATABASE_SLAVE_BALANCER'] = balancer
+    db = BenchmarkSQLAlchemy(app)
+
+    class Item(db.Model):
+        id = db.Column(db.Integer, primary_key=True)
+
+    for replica, delay in zip(get_state(app).get_replicas(), DELAYS):
+        db.Model.metadata.create_all(bind=replica.engine)
+        event.listen(replica.engine, 'before_cursor_execute',
+                     simulate_delay(delay))
+
+    latencies = []
+
+    def worker():
+        with app.app_context():
+            for _ in range(READS):
+                start = time.time()
+                Item.query.all()
+                latencies.append(time.time() - start)
+                db.session.remove()
+
+    threads = [threading.Thread(target=worker) for _ in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    latencies.sort()
+    return [latencies[int(len(latencies) * p)] * 1000
+            for p in (0.5, 0.9, 0.99)]
+
+
+def main():
+    directory = tempfile.mkdtemp()
+    try:
+        print('%-30s %8s %8s %8s' % ('balancer', 'p50 ms', 'p90 ms',
+                                     'p99 ms'))
+        for balancer, weights in [('random', None),
+                                  ('round_robin', None),
+                                  ('round_robin', [5, 5, 1]),
+                                  ('least_connections', None),
+                                  ('power_of_two_choices', None)]:
+            name = balancer + (' %r' % weights if weights else '')
+            print('%-30s %8.2f %8.2f %8.2f' % (
+                (name,) + tuple(run(balancer, weights, directory))))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+"""
+    Session construction benchmark
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Measures how long it takes to create a :class:`SignallingSession` as
+    the number of tables grows, once with the cached binds mapping and once
+    with the mapping rebuilt by :meth:`SQLAlchemy.get_binds` for every
+    session (the previous behavior).
+
+    Run with ``python benchmarks/session_binds.py`` after ``make develop``.
+"""
+from __future__ import print_function
+
+import timeit
+
+import flask
+from flask_sqlalchemy import SQLAlchemy
+
+
+BIND_KEYS = ['bind%d' % i for i in range(5)]
+
+
+def make_db(table_count):
+    app = flask.Flask(__name__)
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['SQLALCHEMY_BINDS'] = dict(
+        (key, 'sqlite://') for key in BIND_KEYS)
+    db = SQLAlchemy(app)
+
+    for i in range(table_count):
+        bind_key = ([None] + BIND_KEYS)[i % (len(BIND_KEYS) + 1)]
+        type('Model%d' % i, (db.Model,), {
+            '__bind_key__': bind_key,
+            'id': db.Column(db.Integer, primary_key=True),
+        })
+
+    return app, db
+
+
+def main(number=1000):
+    print('%8s %14s %14s' % ('tables', 'rebuilt (us)', 'cached (us)'))
+    for table_count in 25, 50, 100, 200, 400, 800:
+        app, db = make_db(table_count)
+        factory = db.create_session({})
+
+        def rebuilt():
+            factory(binds=db.get_binds(app)).close()
+
+        def cached():
+            factory().close()
+
+        results = []
+        for fn in rebuilt, cached:
+            fn()
+            best = min(timeit.repeat(fn, number=number, repeat=3))
+            results.append(best / number * 1e6)
+        print('%8d %14.1f %14.1f' % ((table_count,) + tuple(results)))
+
+
+if __name__ == '__main__':
+    main()
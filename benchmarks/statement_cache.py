@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""
+    Statement cache benchmark
+    ~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Compares looking up a row with ``Model.query.filter_by(...).first()``,
+    which builds and compiles the query every time, against
+    :meth:`BaseQuery.cached_statement` with an empty cache (cold) and with
+    the query and its compiled SQL already cached (warm).
+
+    Run with ``python benchmarks/statement_cache.py`` after ``make develop``.
+"""
+from __future__ import print_function
+
+import timeit
+
+import flask
+from flask_sqlalchemy import SQLAlchemy
+
+
+def main(number=10000):
+    app = flask.Flask(__name__)
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db = SQLAlchemy(app)
+
+    class User(db.Model):
+        id = db.Column(db.Integer, primary_key=True)
+        name = db.Column(db.String(40), index=True)
+        email = db.Column(db.String(80))
+
+    db.create_all()
+    db.session.add_all([User(name='user %d' % i, email='%d@example.com' % i)
+                        for i in range(100)])
+    db.session.commit()
+    cache = db.get_statement_cache()
+
+    def uncached():
+        User.query.filter_by(name='user 42').first()
+
+    def cached():
+        User.query.cached_statement(
+            lambda q: q.filter_by(name=db.bindparam('name'))
+        ).params(name='user 42').first()
+
+    def cold():
+        cache.clear()
+        cached()
+
+    with app.app_context():
+        results = [('filter_by', timeit.timeit(uncached, number=number)),
+                   ('cached_statement cold', timeit.timeit(cold,
+                                                           number=number))]
+        cache.hits = cache.misses = 0
+        results.append(('cached_statement warm',
+                        timeit.timeit(cached, number=number)))
+
+    print('%d lookups by an indexed column' % number)
+    print('%-24s %10s %12s' % ('query', 'seconds', 'us per query'))
+    for label, elapsed in results:
+        print('%-24s %10.3f %12.2f' % (label, elapsed,
+                                       elapsed / number * 1e6))
+    print('warm cache: %d hits, %d misses' % (cache.hits, cache.misses))
+
+
+if __name__ == '__main__':
+    main()
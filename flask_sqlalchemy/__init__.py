@@ -10,29 +10,53 @@
 """
 from __future__ import absolute_import
 
+import atexit
+import base64
+import binascii
 import contextlib
+import copy
+import datetime
+import decimal
+import json
 import os
 import random
 import re
 import sys
 import time
 import functools
+import hashlib
+import itertools
+import tempfile
+import uuid
 import warnings
+import weakref
 import sqlalchemy
-from math import ceil
-from threading import Lock
+from bisect import bisect_left
+from collections import deque, OrderedDict
+from math import ceil, exp
+from threading import Event, Lock, Thread
 
 from flask import _request_ctx_stack, abort, has_request_context, request
 from flask.signals import Namespace
-from flask_sqlalchemy._compat import itervalues, xrange, string_types
+from flask_sqlalchemy._compat import iteritems, itervalues, xrange, \
+    string_types, Queue, Empty
 from operator import itemgetter
-from sqlalchemy import orm, event, inspect
+from sqlalchemy import orm, event, inspect, and_, or_
 from sqlalchemy.engine.url import make_url
-from sqlalchemy.ext.declarative import declarative_base, DeclarativeMeta
+from sqlalchemy.ext import baked
+from sqlalchemy.exc import CompileError
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.ext.declarative import declarative_base, declared_attr, \
+    DeclarativeMeta
 from sqlalchemy.orm.exc import UnmappedClassError
+from sqlalchemy.orm.attributes import set_committed_value
 from sqlalchemy.orm.session import Session as SessionBase
 from sqlalchemy.pool import NullPool
-from sqlalchemy.sql.expression import Select
+from sqlalchemy.sql import operators
+from sqlalchemy.sql.expression import Insert, Select, TextClause, \
+    UnaryExpression, UpdateBase
+from sqlalchemy.sql.util import find_tables
+from sqlalchemy.util import to_list
 
 
 # the best timer function for the platform
@@ -60,6 +84,10 @@ _signals = Namespace()
 
 models_committed = _signals.signal('models-committed')
 before_models_committed = _signals.signal('before-models-committed')
+replica_ejected = _signals.signal('replica-ejected')
+replica_restored = _signals.signal('replica-restored')
+repeated_queries = _signals.signal('repeated-queries')
+slow_query = _signals.signal('slow-query')
 
 
 def _make_table(db):
@@ -91,17 +119,38 @@ def _wrap_with_default_query_class(fn, cls):
     return newfn
 
 
-def _include_sqlalchemy(obj, cls):
-    for module in sqlalchemy, sqlalchemy.orm:
-        for key in module.__all__:
-            if not hasattr(obj, key):
-                setattr(obj, key, getattr(module, key))
-    # Note: obj.Table does not attempt to be a SQLAlchemy Table class.
-    obj.Table = _make_table(obj)
-    obj.relationship = _wrap_with_default_query_class(obj.relationship, cls)
-    obj.relation = _wrap_with_default_query_class(obj.relation, cls)
-    obj.dynamic_loader = _wrap_with_default_query_class(obj.dynamic_loader, cls)
-    obj.event = event
+#: name -> object of ``sqlalchemy`` and ``sqlalchemy.orm`` that is exposed
+#: on :class:`SQLAlchemy` objects, collected on first use
+_included_names = None
+
+
+def _get_included_names():
+    global _included_names
+    names = _included_names
+    if names is None:
+        names = {}
+        # the names of sqlalchemy take precedence over those of the orm
+        for module in sqlalchemy.orm, sqlalchemy:
+            for key in module.__all__:
+                names[key] = getattr(module, key)
+        _included_names = names
+    return names
+
+
+def _include_sqlalchemy(obj, name):
+    """Returns the object that `obj` exposes as `name`."""
+    if name == 'Table':
+        # Note: obj.Table does not attempt to be a SQLAlchemy Table class.
+        return _make_table(obj)
+    if name in ('relationship', 'relation', 'dynamic_loader'):
+        return _wrap_with_default_query_class(getattr(sqlalchemy.orm, name),
+                                              obj.Query)
+    if name == 'event':
+        return event
+    try:
+        return _get_included_names()[name]
+    except KeyError:
+        raise AttributeError(name)
 
 
 class _DebugQueryTuple(tuple):
@@ -109,7 +158,10 @@ class _DebugQueryTuple(tuple):
     parameters = property(itemgetter(1))
     start_time = property(itemgetter(2))
     end_time = property(itemgetter(3))
-    context = property(itemgetter(4))
+
+    @property
+    def context(self):
+        return _format_call_site(self[4])
 
     @property
     def duration(self):
@@ -123,19 +175,112 @@ class _DebugQueryTuple(tuple):
         )
 
 
-def _calling_context(app_path):
-    frm = sys._getframe(1)
-    while frm.f_back is not None:
+class _CallSiteResolver(object):
+    """Finds the innermost frame on the stack that belongs to the
+    application package.  Whether a code object belongs to it is only
+    checked once, after that each frame costs a single dict lookup.
+
+    Returns the code object and line number of the frame, or `None`.
+    Formatting is left to :func:`_format_call_site` so that it only happens
+    for queries that are actually looked at.
+    """
+
+    def __init__(self, app_path):
+        self.app_path = app_path
+        self._prefix = app_path + '.'
+        self._matches = {}
+
+    def _matches_code(self, frm):
         name = frm.f_globals.get('__name__')
-        if name and (name == app_path or name.startswith(app_path + '.')):
-            funcname = frm.f_code.co_name
-            return '%s:%s (%s)' % (
-                frm.f_code.co_filename,
-                frm.f_lineno,
-                funcname
-            )
-        frm = frm.f_back
-    return '<unknown>'
+        match = bool(name and (name == self.app_path or
+                               name.startswith(self._prefix)))
+        self._matches[frm.f_code] = match
+        return match
+
+    def __call__(self):
+        matches = self._matches
+        frm = sys._getframe(1)
+        while frm.f_back is not None:
+            match = matches.get(frm.f_code)
+            if match is None:
+                match = self._matches_code(frm)
+            if match:
+                return frm.f_code, frm.f_lineno
+            frm = frm.f_back
+        return None
+
+
+#: formatted call sites by (code, line number)
+_call_site_strings = {}
+
+
+def _format_call_site(site):
+    if site is None:
+        return '<unknown>'
+    try:
+        return _call_site_strings[site]
+    except KeyError:
+        code, lineno = site
+        rv = _call_site_strings[site] = '%s:%s (%s)' % (
+            code.co_filename, lineno, code.co_name)
+        return rv
+
+
+def _calling_context(app_path):
+    return _format_call_site(_CallSiteResolver(app_path)())
+
+
+_fingerprint_re = re.compile(r"""
+    '(?:[^']|'')*'              # string literals
+  | \b\d+(?:\.\d+)?\b           # numbers
+  | %\(\w+\)s | %s | (?<!:):\w+ | \?   # bind parameters
+""", re.X)
+_fingerprint_in_re = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+_fingerprint_space_re = re.compile(r'\s+')
+
+#: fingerprints by statement, cleared when it grows too large
+_fingerprints = {}
+_max_fingerprints = 1000
+
+
+def _fingerprint(statement):
+    """Normalizes a statement so that it is the same for all executions
+    that only differ in their literals or in the length of an ``IN`` list.
+    """
+    try:
+        return _fingerprints[statement]
+    except KeyError:
+        rv = _fingerprint_re.sub('?', statement)
+        rv = _fingerprint_in_re.sub('(?)', rv)
+        rv = _fingerprint_space_re.sub(' ', rv).strip()
+        if len(_fingerprints) >= _max_fingerprints:
+            _fingerprints.clear()
+        _fingerprints[statement] = rv
+        return rv
+
+
+class RepeatedQueriesWarning(UserWarning):
+    """Issued when the same statement runs more often from one place in a
+    request than ``SQLALCHEMY_RECORD_QUERIES_REPEAT_THRESHOLD`` allows,
+    which usually means a relationship is loaded lazily in a loop.
+    """
+
+
+class BindErrors(Exception):
+    """Raised by :meth:`SQLAlchemy.create_all`, :meth:`~SQLAlchemy.drop_all`
+    and :meth:`~SQLAlchemy.reflect` when ``SQLALCHEMY_DDL_WORKERS`` is set
+    and the operation failed for some binds.  It is raised once all binds
+    were handled, with the exception of every failed bind in :attr:`errors`.
+
+    .. versionadded:: 3.0
+    """
+
+    def __init__(self, errors):
+        #: bind key -> exception, the default bind has the key `None`
+        self.errors = errors
+        Exception.__init__(self, '; '.join(
+            '%s: %s' % (bind, errors[bind])
+            for bind in sorted(errors, key=lambda bind: bind or '')))
 
 
 class _symbol(object):
@@ -278,11 +423,52 @@ class SignallingSession(SessionBase):
         #: The application that this session belongs to.
         self.app = app = db.get_app()
         track_modifications = app.config['SQLALCHEMY_TRACK_MODIFICATIONS']
-        bind = options.pop('bind', None) or db.engine
-        binds = options.pop('binds', db.get_binds(app))
-
-        if track_modifications is None or track_modifications:
-            _SessionSignalEvents.register(self)
+        bind = options.pop('bind', None)
+        binds = options.pop('binds', None)
+
+        #: Whether the current transaction wrote to the master, and when
+        #: the last transaction that did was committed.  Used to keep
+        #: reads on the master until the replicas caught up.
+        self._pending_write = False
+        self._written_at = None
+
+        #: Shared table->engine mapping for tables of non-default binds,
+        #: consulted by :meth:`get_bind` for plain SQL expressions.
+        self._table_binds = {}
+        self._state = state = get_state(app)
+        if binds is None:
+            if bind is None:
+                # Tables of the default bind fall back to ``db.engine``
+                # anyway, the others are looked up in the cached mapping
+                # instead of being copied into every session.
+                self._table_binds = state.get_binds(default=False)
+            else:
+                binds = state.get_binds()
+        if bind is None:
+            bind = db.engine
+
+        #: Whether changes are collected for :data:`models_committed`, and
+        #: the changes of the current transaction once there are any.
+        self._track_modifications = track_modifications is None or \
+            bool(track_modifications)
+        self._model_changes = None
+        #: The background dispatcher of :data:`models_committed` if
+        #: ``SQLALCHEMY_ASYNC_SIGNALS`` is enabled.
+        self._signal_dispatcher = None
+        if self._track_modifications and app.config['SQLALCHEMY_ASYNC_SIGNALS']:
+            self._signal_dispatcher = state.get_signal_dispatcher()
+        #: identity key -> :class:`_InstanceSnapshot` of the changes of the
+        #: current transaction for the dispatcher
+        self._committed_changes = None
+        #: ``(region, primary key)`` of the cached instances written in the
+        #: current transaction, removed from the :class:`IdentityCache` once
+        #: it is committed.
+        self._cache_invalidations = None
+        #: The tables written in the current transaction, whose results
+        #: are removed from the :class:`ResultCache` once it is committed.
+        #: It holds ``None`` if statements were executed whose tables are
+        #: not known.
+        self._written_tables = None
 
         SessionBase.__init__(
             self, autocommit=autocommit, autoflush=autoflush,
@@ -290,13 +476,15 @@ class SignallingSession(SessionBase):
         )
 
     def get_bind(self, mapper=None, clause=None):
+        state = self._state
         # mapper is None if someone tries to just get a connection
         if mapper is not None:
-            info = getattr(mapper.mapped_table, 'info', {})
-            bind_key = info.get('bind_key')
-            if bind_key is not None:
-                state = get_state(self.app)
-                return state.db.get_engine(self.app, bind=bind_key)
+            try:
+                engine = state.mapper_binds[mapper]
+            except KeyError:
+                engine = state.get_mapper_bind(mapper)
+            if engine is not None:
+                return engine
 
         bind_mode_context = _current_bind_mode_context()
         current_mode = getattr(bind_mode_context, 'current_mode', None)
@@ -307,91 +495,389 @@ class SignallingSession(SessionBase):
         # Then use slave connection
         if ((current_mode is None and isinstance(clause, Select)) or
                 current_mode is _SLAVE):
-            state = get_state(self.app)
-            slaves = self.app.config['SQLALCHEMY_DATABASE_SLAVE_URIS']
-            if slaves:
-                random_index = random.randrange(len(slaves))
-                bind_key = 'slaves_{}'.format(random_index)
-            else:
-                bind_key = None
-            return state.db.get_engine(self.app, bind=bind_key)
+            if not state.get_replicas():
+                return state.master_engine
+            written_at = None
+            # Implicit reads after a write have to see it, so they stay on
+            # the master unless a replica is known to have caught up.
+            if current_mode is None and state.sticky_time is not None:
+                if self._pending_write:
+                    return state.master_engine
+                written_at = self._written_at
+                if (written_at is not None and
+                        time.time() - written_at >= state.sticky_time):
+                    written_at = self._written_at = None
+                if written_at is None and state.sticky_key is not None:
+                    written_at = state.last_write()
+            replica = state.choose_replica(written_at)
+            if replica is not None:
+                return replica.engine
+            return state.master_engine
+
+        if mapper is None and clause is not None and self._table_binds:
+            for table in find_tables(clause, include_crud=True):
+                engine = self._table_binds.get(table)
+                if engine is not None:
+                    return engine
 
         return SessionBase.get_bind(self, mapper, clause)
 
+    def execute(self, clause, params=None, mapper=None, bind=None, **kw):
+        if isinstance(clause, UpdateBase):
+            _record_written_tables(self, (clause.table,))
+        elif isinstance(clause, string_types):
+            if not _select_sql_re.match(clause):
+                _record_written_tables(self, (None,))
+        elif isinstance(clause, TextClause):
+            if not _select_sql_re.match(clause.text):
+                _record_written_tables(self, (None,))
+        return SessionBase.execute(self, clause, params, mapper, bind, **kw)
+
+
+_select_sql_re = re.compile(r'\s*(select|with)\b', re.I)
+
+
+def _record_written_tables(session, tables):
+    written = session._written_tables
+    if written is None:
+        written = session._written_tables = set()
+    written.update(tables)
+
 
 class _SessionSignalEvents(object):
+    """Collects the changes for :data:`models_committed`.  Instead of
+    scanning ``session.new``, ``session.dirty`` and ``session.deleted`` on
+    every flush, the mapper events of the unit of work record each written
+    instance once.  The mapper listeners are registered on the declarative
+    base of each :class:`SQLAlchemy` object with :meth:`register_base`,
+    the session listeners once on the session class, so sessions cost
+    nothing until they write an instance of a tracked model.
+    """
+
     @classmethod
-    def register(cls, session):
-        if not hasattr(session, '_model_changes'):
-            session._model_changes = {}
+    def register(cls, session_class):
+        event.listen(session_class, 'before_commit', cls.before_commit)
+        event.listen(session_class, 'after_commit', cls.after_commit)
+        event.listen(session_class, 'after_rollback', cls.after_rollback)
+        event.listen(session_class, 'after_bulk_update', cls.record_bulk)
+        event.listen(session_class, 'after_bulk_delete', cls.record_bulk)
 
-        event.listen(session, 'before_flush', cls.record_ops)
-        event.listen(session, 'before_commit', cls.record_ops)
-        event.listen(session, 'before_commit', cls.before_commit)
-        event.listen(session, 'after_commit', cls.after_commit)
-        event.listen(session, 'after_rollback', cls.after_rollback)
+    @classmethod
+    def register_base(cls, base):
+        for name in 'after_insert', 'after_update', 'after_delete':
+            listener = getattr(cls, name)
+            if not event.contains(base, name, listener):
+                event.listen(base, name, listener, propagate=True)
 
     @classmethod
     def unregister(cls, session):
-        if hasattr(session, '_model_changes'):
-            del session._model_changes
+        """Stops collecting changes for `session`.
 
-        event.remove(session, 'before_flush', cls.record_ops)
-        event.remove(session, 'before_commit', cls.record_ops)
-        event.remove(session, 'before_commit', cls.before_commit)
-        event.remove(session, 'after_commit', cls.after_commit)
-        event.remove(session, 'after_rollback', cls.after_rollback)
+        .. deprecated:: 3.0
+           Pass ``track_modifications=False`` to the session instead.
+        """
+        warnings.warn(DeprecationWarning(
+            '_SessionSignalEvents.unregister is deprecated, create the '
+            'session with track_modifications=False instead'), stacklevel=2)
+        session._track_modifications = False
+        session._model_changes = None
+        session._committed_changes = None
+
+    @classmethod
+    def after_insert(cls, mapper, connection, target):
+        cls.record_op('insert', mapper, target)
+
+    @classmethod
+    def after_update(cls, mapper, connection, target):
+        cls.record_op('update', mapper, target)
+
+    @classmethod
+    def after_delete(cls, mapper, connection, target):
+        cls.record_op('delete', mapper, target)
 
     @staticmethod
-    def record_ops(session, flush_context=None, instances=None):
-        try:
-            d = session._model_changes
-        except AttributeError:
+    def record_op(operation, mapper, target):
+        session = orm.object_session(target)
+        if not isinstance(session, SignallingSession):
+            return
+        _record_written_tables(session, mapper.tables)
+        if operation != 'insert' and \
+                getattr(mapper.class_, '__cache__', None):
+            _invalidate_cached(session, mapper,
+                               mapper.primary_key_from_instance(target))
+        if not session._track_modifications:
+            return
+        if not session._state.tracks_model(mapper.class_):
             return
 
-        for targets, operation in ((session.new, 'insert'), (session.dirty, 'update'), (session.deleted, 'delete')):
-            for target in targets:
-                state = inspect(target)
-                key = state.identity_key if state.has_identity else id(target)
-                d[key] = (target, operation)
+        d = session._model_changes
+        if d is None:
+            d = session._model_changes = {}
+        key = mapper.identity_key_from_instance(target)
+        # an instance inserted in this transaction stays an insert
+        if operation == 'update' and d.get(key, (None, None))[1] == 'insert':
+            operation = 'insert'
+        d[key] = (target, operation)
+        if session._signal_dispatcher is not None:
+            # the instances are expired by the commit, so the background
+            # thread gets what they looked like when they were last written
+            snapshots = session._committed_changes
+            if snapshots is None:
+                snapshots = session._committed_changes = {}
+            snapshots[key] = _InstanceSnapshot(target)
 
     @staticmethod
     def before_commit(session):
-        try:
-            d = session._model_changes
-        except AttributeError:
+        if not session._track_modifications or \
+                not before_models_committed.receivers:
             return
 
-        if d:
-            before_models_committed.send(session.app, changes=list(d.values()))
+        # the changes that are still pending are flushed by the commit
+        # after this event, so they are added as they look now
+        d = session._model_changes or {}
+        changes = list(d.values())
+        tracks_model = session._state.tracks_model
+        for targets, operation in ((session.new, 'insert'),
+                                   (session.dirty, 'update'),
+                                   (session.deleted, 'delete')):
+            for target in targets:
+                state = inspect(target)
+                if state.key in d or not tracks_model(state.class_):
+                    continue
+                changes.append((target, operation))
+        if changes:
+            before_models_committed.send(session.app, changes=changes)
 
     @staticmethod
-    def after_commit(session):
-        try:
-            d = session._model_changes
-        except AttributeError:
+    def record_bulk(context):
+        mapper = context.mapper
+        session = context.session
+        if not isinstance(session, SignallingSession):
             return
+        _record_written_tables(session, mapper.tables if mapper is not None
+                               else (None,))
+        if mapper is not None and getattr(mapper.class_, '__cache__', None):
+            # the rows that were changed are not known
+            _invalidate_cached(session, mapper)
 
+    @staticmethod
+    def after_commit(session):
+        invalidations = session._cache_invalidations
+        if invalidations:
+            session._cache_invalidations = None
+            cache = session._state.get_identity_cache()
+            for region, pk in invalidations:
+                if pk is None:
+                    cache.clear(region)
+                else:
+                    cache.delete(region, pk)
+
+        # results are invalidated whether changes are tracked or not
+        written = session._written_tables
+        if written:
+            session._written_tables = None
+            result_cache = session._state._result_cache
+            if result_cache is not None:
+                if None in written:
+                    result_cache.clear()
+                else:
+                    result_cache.invalidate(*[table.fullname
+                                              for table in written])
+
+        d = session._model_changes
         if d:
-            models_committed.send(session.app, changes=list(d.values()))
+            if session._signal_dispatcher is not None:
+                snapshots = session._committed_changes
+                session._committed_changes = None
+                session._signal_dispatcher.dispatch([
+                    (key, snapshots[key], operation)
+                    for key, (_, operation) in iteritems(d)])
+            else:
+                models_committed.send(session.app, changes=list(d.values()))
             d.clear()
 
     @staticmethod
     def after_rollback(session):
+        d = session._model_changes
+        if d:
+            d.clear()
+        session._committed_changes = None
+        session._cache_invalidations = None
+        session._written_tables = None
+
+
+def _invalidate_cached(session, mapper, pk=None):
+    """Removes the instance of `mapper` with the primary key `pk`, or all
+    of them, from the identity cache once the session commits.
+    """
+    invalidations = session._cache_invalidations
+    if invalidations is None:
+        invalidations = session._cache_invalidations = set()
+    if pk is not None:
+        pk = tuple(pk)
+    invalidations.add((session._state.get_cache_region(mapper), pk))
+
+
+class _InstanceSnapshot(object):
+    """The column values of an instance, to create a detached copy of it
+    in another thread.
+    """
+
+    __slots__ = ('mapper', 'key', 'values')
+
+    def __init__(self, target):
+        state = inspect(target)
+        self.mapper = state.mapper
+        self.key = state.key
+        loaded = state.dict
+        self.values = [(prop.key, loaded[prop.key])
+                       for prop in self.mapper.column_attrs
+                       if prop.key in loaded]
+
+    @classmethod
+    def from_values(cls, mapper, values):
+        snapshot = cls.__new__(cls)
+        snapshot.mapper = mapper
+        snapshot.key = None
+        snapshot.values = values
+        return snapshot
+
+    def restore(self):
+        instance = self.mapper.class_manager.new_instance()
+        for key, value in self.values:
+            set_committed_value(instance, key, value)
+        orm.make_transient_to_detached(instance)
+        return instance
+
+
+class _SignalDispatcher(object):
+    """Sends :data:`models_committed` from a background thread.  Changes
+    to the same instance that are committed within `window` seconds are
+    merged into one signal.  When `queue_size` commits are waiting, further
+    commits block until the thread caught up.
+    """
+
+    def __init__(self, app, queue_size=1000, window=0.1):
+        self.app = app
+        self.window = window
+        self.queue = Queue(queue_size)
+        self._thread = Thread(target=self._run,
+                              name='flask_sqlalchemy signal dispatcher')
+        self._thread.daemon = True
+
+    def start(self):
+        self._thread.start()
+        _signal_dispatchers.add(self)
+
+    def dispatch(self, changes):
+        self.queue.put(changes)
+
+    def flush(self):
+        """Waits until all changes queued so far were sent."""
+        self.queue.join()
+
+    def _merge(self, batch, changes):
+        for key, snapshot, operation in changes:
+            if operation == 'update' and \
+                    batch.get(key, (None, None))[1] == 'insert':
+                operation = 'insert'
+            batch[key] = (snapshot, operation)
+
+    def _run(self):
+        while True:
+            batch = OrderedDict()
+            self._merge(batch, self.queue.get())
+            taken = 1
+            deadline = _timer() + self.window
+            while True:
+                timeout = deadline - _timer()
+                try:
+                    if timeout > 0:
+                        changes = self.queue.get(timeout=timeout)
+                    else:
+                        changes = self.queue.get_nowait()
+                except Empty:
+                    break
+                self._merge(batch, changes)
+                taken += 1
+            try:
+                self.send(batch)
+            finally:
+                for _ in xrange(taken):
+                    self.queue.task_done()
+
+    def send(self, batch):
         try:
-            d = session._model_changes
-        except AttributeError:
-            return
+            with self.app.app_context():
+                models_committed.send(self.app, changes=[
+                    (snapshot.restore(), operation)
+                    for snapshot, operation in itervalues(batch)])
+        except Exception:
+            self.app.logger.exception('Exception in a models_committed '
+                                      'receiver')
+
 
-        d.clear()
+#: the started :class:`_SignalDispatcher` objects, flushed at exit so that
+#: the signals of the last commits are not lost with the daemon threads
+_signal_dispatchers = weakref.WeakSet()
+
+
+@atexit.register
+def _flush_signal_dispatchers():
+    for dispatcher in list(_signal_dispatchers):
+        dispatcher.flush()
+
+
+class _ReadYourWritesEvents(object):
+    """Remembers on a :class:`SignallingSession` when it wrote to the master,
+    and in the application state for the client returned by
+    ``SQLALCHEMY_DATABASE_SLAVE_STICKY_KEY`` so that its later sessions see
+    the write as well.  Registered once for the class, not for every
+    session.
+    """
+
+    @classmethod
+    def register(cls, session_class):
+        event.listen(session_class, 'after_flush', cls.record_write)
+        event.listen(session_class, 'after_bulk_update', cls.record_write)
+        event.listen(session_class, 'after_bulk_delete', cls.record_write)
+        event.listen(session_class, 'after_commit', cls.after_commit)
+        event.listen(session_class, 'after_rollback', cls.after_rollback)
+
+    @staticmethod
+    def record_write(session, *args):
+        session._pending_write = True
+
+    @staticmethod
+    def after_commit(session):
+        if session._pending_write:
+            session._pending_write = False
+            session._written_at = written_at = time.time()
+            state = session._state
+            if state.get_replicas() and state.sticky_time is not None and \
+                    state.sticky_key is not None:
+                state.record_write(written_at)
+
+    @staticmethod
+    def after_rollback(session):
+        session._pending_write = False
+
+
+_ReadYourWritesEvents.register(SignallingSession)
+_SessionSignalEvents.register(SignallingSession)
 
 
 class _EngineDebuggingSignalEvents(object):
     """Sets up handlers for two events that let us track the execution time of queries."""
 
-    def __init__(self, engine, import_name):
+    def __init__(self, engine, import_name, sample_rate=1.0,
+                 max_queries=None, repeat_threshold=None):
         self.engine = engine
         self.app_package = import_name
+        self.call_site = _CallSiteResolver(import_name)
+        self.sample_rate = sample_rate
+        self.max_queries = max_queries
+        self.repeat_threshold = repeat_threshold
 
     def register(self):
         event.listen(self.engine, 'before_cursor_execute', self.before_cursor_execute)
@@ -400,19 +886,50 @@ class _EngineDebuggingSignalEvents(object):
     def before_cursor_execute(self, conn, cursor, statement,
                               parameters, context, executemany):
         if connection_stack.top is not None:
-            context._query_start_time = _timer()
+            if (self.sample_rate < 1.0 and
+                    random.random() >= self.sample_rate):
+                context._query_start_time = None
+            else:
+                context._query_start_time = _timer()
 
     def after_cursor_execute(self, conn, cursor, statement,
                              parameters, context, executemany):
         ctx = connection_stack.top
         if ctx is not None:
+            start_time = context._query_start_time
+            if start_time is None:
+                return
             queries = getattr(ctx, 'sqlalchemy_queries', None)
             if queries is None:
-                queries = []
+                queries = deque(maxlen=self.max_queries)
                 setattr(ctx, 'sqlalchemy_queries', queries)
+            site = self.call_site()
             queries.append(_DebugQueryTuple((
-                statement, parameters, context._query_start_time, _timer(),
-                _calling_context(self.app_package))))
+                statement, parameters, start_time, _timer(), site)))
+            if self.repeat_threshold is not None:
+                self.count_repeats(ctx, statement, site)
+
+    def count_repeats(self, ctx, statement, site):
+        counts = getattr(ctx, 'sqlalchemy_query_counts', None)
+        if counts is None:
+            counts = {}
+            setattr(ctx, 'sqlalchemy_query_counts', counts)
+        fingerprint = _fingerprint(statement)
+        key = (fingerprint, site)
+        count = counts[key] = counts.get(key, 0) + 1
+        # only report once per fingerprint and call site
+        if count == self.repeat_threshold + 1:
+            context = _format_call_site(site)
+            message = 'Statement ran more than %d times from %s: %s' % (
+                self.repeat_threshold, context, fingerprint)
+            if site is None:
+                warnings.warn(message, RepeatedQueriesWarning)
+            else:
+                code, lineno = site
+                warnings.warn_explicit(message, RepeatedQueriesWarning,
+                                       code.co_filename, lineno)
+            repeated_queries.send(ctx.app, fingerprint=fingerprint,
+                                  context=context, count=count)
 
 
 def get_debug_queries():
@@ -446,8 +963,110 @@ def get_debug_queries():
         A string giving a rough estimation of where in your application
         query was issued.  The exact format is undefined so don't try
         to reconstruct filename or function name.
+
+    To keep recording cheap enough for production, only a fraction of the
+    queries can be recorded with ``SQLALCHEMY_RECORD_QUERIES_SAMPLE_RATE``
+    and the number of queries kept per context can be limited with
+    ``SQLALCHEMY_RECORD_QUERIES_MAX``, in which case the oldest queries are
+    dropped.
+
+    .. versionchanged:: 3.0
+       A new list is returned on every call.
+    """
+    return list(getattr(connection_stack.top, 'sqlalchemy_queries', ()))
+
+
+class _DebugQueryGroup(object):
+    """Statistics of the recorded queries that share a fingerprint and a
+    call site.  Returned by :func:`get_debug_query_stats`.
     """
-    return getattr(connection_stack.top, 'sqlalchemy_queries', [])
+
+    def __init__(self, fingerprint, site):
+        self.fingerprint = fingerprint
+        self.site = site
+        #: the recorded queries in this group
+        self.queries = []
+
+    @property
+    def context(self):
+        return _format_call_site(self.site)
+
+    @property
+    def count(self):
+        return len(self.queries)
+
+    @property
+    def total(self):
+        return sum(q.duration for q in self.queries)
+
+    def percentile(self, percent):
+        """Returns the duration below which `percent` of the queries
+        finished, using the nearest rank.
+        """
+        durations = sorted(q.duration for q in self.queries)
+        rank = int(ceil(percent / 100.0 * len(durations)))
+        return durations[max(rank - 1, 0)]
+
+    @property
+    def p50(self):
+        return self.percentile(50)
+
+    @property
+    def p99(self):
+        return self.percentile(99)
+
+    def __repr__(self):
+        return '<query group statement="%s" count=%d total=%.03f>' % (
+            self.fingerprint,
+            self.count,
+            self.total
+        )
+
+
+def get_debug_query_stats():
+    """Groups the queries returned by :func:`get_debug_queries` by their
+    statement with the literals and bind parameters stripped and by the place
+    in the application they were issued from.  This makes it easy to spot
+    statements that run once per item of a list, which usually means that a
+    relationship is loaded lazily.
+
+    The groups are ordered by the total time spent on them and have the
+    following attributes:
+
+    `fingerprint`
+        The normalized statement
+
+    `context`
+        Where in the application the queries were issued, see
+        :func:`get_debug_queries`
+
+    `count`
+        The number of queries
+
+    `total`
+        The time the queries took in seconds
+
+    `p50` / `p99`
+        The median and the 99th percentile of the duration in seconds
+
+    `queries`
+        The recorded queries
+
+    If ``SQLALCHEMY_RECORD_QUERIES_REPEAT_THRESHOLD`` is set, a
+    :class:`RepeatedQueriesWarning` is issued and the
+    :data:`repeated_queries` signal is sent as soon as a group grows beyond
+    it.
+
+    .. versionadded:: 3.0
+    """
+    groups = {}
+    for query in get_debug_queries():
+        key = (_fingerprint(query.statement), query[4])
+        group = groups.get(key)
+        if group is None:
+            group = groups[key] = _DebugQueryGroup(*key)
+        group.queries.append(query)
+    return sorted(itervalues(groups), key=lambda g: g.total, reverse=True)
 
 
 class Pagination(object):
@@ -458,7 +1077,7 @@ class Pagination(object):
     no longer work.
     """
 
-    def __init__(self, query, page, per_page, total, items):
+    def __init__(self, query, page, per_page, total, items, has_next=None):
         #: the unlimited query object that was used to create this
         #: pagination object.
         self.query = query
@@ -466,25 +1085,53 @@ class Pagination(object):
         self.page = page
         #: the number of items to be displayed on a page.
         self.per_page = per_page
-        #: the total number of items matching the query
-        self.total = total
+        self._total = total
         #: the items for the current page
         self.items = items
+        self._has_next = has_next
+
+    @property
+    def total(self):
+        """The total number of items matching the query.  If a callable was
+        passed as `total` it is only called when this is read, see
+        :class:`LazyTotal`.  `None` if the items were not counted.
+        """
+        total = self._total
+        if callable(total):
+            total = self._total = total()
+        return total
+
+    @total.setter
+    def total(self, value):
+        self._total = value
 
     @property
     def pages(self):
-        """The total number of pages"""
+        """The total number of pages.  If the items were not counted this
+        is the number of the last page known to exist, which is the next
+        page if there is one.
+        """
+        if self._total is None:
+            return self.page + 1 if self.has_next else self.page
         if self.per_page == 0:
             pages = 0
         else:
             pages = int(ceil(self.total / float(self.per_page)))
         return pages
 
+    def _paginate(self, page, error_out):
+        # count is only passed when it differs from the default, so that
+        # query classes overriding paginate with the old signature work
+        if self._total is None:
+            return self.query.paginate(page, self.per_page, error_out,
+                                       count=False)
+        return self.query.paginate(page, self.per_page, error_out)
+
     def prev(self, error_out=False):
         """Returns a :class:`Pagination` object for the previous page."""
         assert self.query is not None, 'a query object is required ' \
                                        'for this method to work'
-        return self.query.paginate(self.page - 1, self.per_page, error_out)
+        return self._paginate(self.page - 1, error_out)
 
     @property
     def prev_num(self):
@@ -500,11 +1147,13 @@ class Pagination(object):
         """Returns a :class:`Pagination` object for the next page."""
         assert self.query is not None, 'a query object is required ' \
                                        'for this method to work'
-        return self.query.paginate(self.page + 1, self.per_page, error_out)
+        return self._paginate(self.page + 1, error_out)
 
     @property
     def has_next(self):
         """True if a next page exists."""
+        if self._has_next is not None:
+            return self._has_next
         return self.page < self.pages
 
     @property
@@ -549,6 +1198,314 @@ class Pagination(object):
                 last = num
 
 
+def _dump_cursor_value(value):
+    if isinstance(value, datetime.datetime):
+        parts = [value.year, value.month, value.day, value.hour,
+                 value.minute, value.second, value.microsecond]
+        offset = value.utcoffset()
+        if offset is not None:
+            # aware datetimes keep their UTC offset in seconds
+            parts.append(offset.days * 86400 + offset.seconds)
+        return {'datetime': parts}
+    if isinstance(value, datetime.date):
+        return {'date': [value.year, value.month, value.day]}
+    if isinstance(value, datetime.time):
+        return {'time': [value.hour, value.minute, value.second,
+                         value.microsecond]}
+    if isinstance(value, decimal.Decimal):
+        return {'decimal': str(value)}
+    if isinstance(value, uuid.UUID):
+        return {'uuid': value.hex}
+    if isinstance(value, bytes):
+        return {'bytes': base64.b64encode(value).decode('ascii')}
+    if isinstance(value, dict):
+        return {'json': value}
+    return value
+
+
+def _load_cursor_value(value):
+    if not isinstance(value, dict):
+        return value
+    (kind, value), = value.items()
+    if kind == 'datetime':
+        if len(value) == 8:
+            offset = datetime.timedelta(seconds=value.pop())
+            return datetime.datetime(*value, tzinfo=sqlalchemy.util.timezone(
+                offset))
+        return datetime.datetime(*value)
+    if kind == 'date':
+        return datetime.date(*value)
+    if kind == 'time':
+        return datetime.time(*value)
+    if kind == 'decimal':
+        return decimal.Decimal(value)
+    if kind == 'uuid':
+        return uuid.UUID(value)
+    if kind == 'bytes':
+        return base64.b64decode(value.encode('ascii'))
+    if kind == 'json':
+        return value
+    raise ValueError('unknown cursor value %r' % kind)
+
+
+def _encode_cursor(values, backwards=False):
+    """Encodes the ordering values of a row into an opaque, URL safe
+    cursor.  The cursor is not signed, changing it only moves the page.
+    """
+    data = json.dumps([int(backwards)] + [_dump_cursor_value(v)
+                                          for v in values],
+                      separators=(',', ':'))
+    return base64.urlsafe_b64encode(data.encode('utf-8')) \
+        .rstrip(b'=').decode('ascii')
+
+
+def _decode_cursor(cursor):
+    """Returns the values and the direction of a cursor.  Raises
+    `ValueError` for cursors that were not created by
+    :func:`_encode_cursor`.
+    """
+    try:
+        if not isinstance(cursor, bytes):
+            cursor = cursor.encode('ascii')
+        cursor += b'=' * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(cursor).decode('utf-8'))
+        values = [_load_cursor_value(v) for v in data[1:]]
+        return values, bool(data[0])
+    except (TypeError, ValueError, IndexError, AttributeError,
+            UnicodeError, binascii.Error):
+        raise ValueError('invalid cursor')
+
+
+def _seek_columns(query, order_by):
+    """Splits the ordering into (column, descending) pairs and appends the
+    primary key of the queried model unless it is already part of it, so
+    that the ordering is unique.  Raises `ValueError` if there is nothing
+    to order by.
+    """
+    columns = []
+    for expr in order_by:
+        descending = False
+        if isinstance(expr, UnaryExpression) and \
+                expr.modifier in (operators.asc_op, operators.desc_op):
+            descending = expr.modifier is operators.desc_op
+            expr = expr.element
+        if hasattr(expr, '__clause_element__'):
+            expr = expr.__clause_element__()
+        columns.append((expr, descending))
+    entity = query._mapper_zero()
+    if entity is not None:
+        descending = columns[-1][1] if columns else False
+        for pk in entity.primary_key:
+            if not any(pk.compare(column) for column, _ in columns):
+                columns.append((pk, descending))
+    if not columns:
+        raise ValueError('the query has no primary key to order by, '
+                         'pass order_by with unique columns')
+    return columns
+
+
+def _seek_criterion(columns, values, backwards):
+    """Builds the criterion for the rows after `values`, or before them if
+    `backwards` is set.
+    """
+    clauses = []
+    for index, (column, descending) in enumerate(columns):
+        after = column < values[index] if descending != backwards \
+            else column > values[index]
+        clauses.append(and_(*[c == v for (c, _), v
+                              in zip(columns[:index], values)] + [after]))
+    # the redundant bound on the first column lets the database use an
+    # index range scan
+    first, descending = columns[0]
+    bound = first <= values[0] if descending != backwards \
+        else first >= values[0]
+    return and_(bound, or_(*clauses))
+
+
+class SeekPagination(object):
+    """Returned by :meth:`BaseQuery.seek_paginate`.  Instead of page
+    numbers it has opaque cursors that point to the rows before and after
+    the current page, so fetching a page costs the same however deep it is.
+    There is no total and no page count.
+
+    .. versionadded:: 3.0
+    """
+
+    def __init__(self, query, order_by, per_page, cursor, items,
+                 next_cursor, prev_cursor):
+        #: the unlimited query object that was used to create this
+        #: pagination object.
+        self.query = query
+        #: the ordering the pages follow
+        self.order_by = order_by
+        #: the number of items to be displayed on a page.
+        self.per_page = per_page
+        #: the cursor of the current page, `None` for the first page
+        self.cursor = cursor
+        #: the items for the current page
+        self.items = items
+        #: the cursor of the next page, or `None` if this is the last page
+        self.next_cursor = next_cursor
+        #: the cursor of the previous page, or `None` if this is the first
+        #: page
+        self.prev_cursor = prev_cursor
+
+    @property
+    def has_next(self):
+        """True if a next page exists."""
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        """True if a previous page exists"""
+        return self.prev_cursor is not None
+
+    def next(self, error_out=False):
+        """Returns a :class:`SeekPagination` object for the next page."""
+        assert self.query is not None, 'a query object is required ' \
+                                       'for this method to work'
+        return self.query.seek_paginate(self.order_by, self.next_cursor,
+                                        self.per_page, error_out)
+
+    def prev(self, error_out=False):
+        """Returns a :class:`SeekPagination` object for the previous page."""
+        assert self.query is not None, 'a query object is required ' \
+                                       'for this method to work'
+        return self.query.seek_paginate(self.order_by, self.prev_cursor,
+                                        self.per_page, error_out)
+
+
+def _statement_key(query, statement=None):
+    """Tells queries apart by their SQL and parameters."""
+    if statement is None:
+        statement = query.statement
+    bind = query.session.get_bind(query._mapper_zero(), clause=statement)
+    compiled = statement.compile(dialect=bind.dialect)
+    return (str(compiled),
+            repr(sorted(iteritems(compiled.construct_params()))))
+
+
+class PaginationTotal(object):
+    """Decides how :meth:`BaseQuery.paginate` finds the total number of
+    items.  The strategy of an application is created from
+    ``SQLALCHEMY_PAGINATION_TOTAL`` by :meth:`SQLAlchemy.make_pagination_total`
+    and shared by all its queries.
+
+    .. versionadded:: 3.0
+    """
+
+    def count(self, query):
+        """Returns the number of rows `query` (without its ordering)
+        returns, or a callable that returns it when the total is read.
+        """
+        raise NotImplementedError()
+
+
+class ExactTotal(PaginationTotal):
+    """Counts the rows for every page.  This is the default."""
+
+    def count(self, query):
+        return query.count()
+
+
+class LazyTotal(PaginationTotal):
+    """Only counts the rows once :attr:`Pagination.total`,
+    :attr:`~Pagination.pages` or :attr:`~Pagination.has_next` is read, so
+    pages that don't show them don't pay for it.
+    """
+
+    def count(self, query):
+        return query.count
+
+
+class CachedTotal(PaginationTotal):
+    """Reuses the count of a query for `ttl` seconds.  Queries are told
+    apart by their SQL and parameters.  At most `max_entries` counts are
+    kept, the oldest are dropped first.
+    """
+
+    def __init__(self, ttl=60.0, max_entries=1000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._counts = OrderedDict()
+        self._lock = Lock()
+
+    def key(self, query):
+        return _statement_key(query)
+
+    def count(self, query):
+        key = self.key(query)
+        now = _timer()
+        with self._lock:
+            cached = self._counts.get(key)
+        if cached is not None and cached[1] > now:
+            return cached[0]
+        total = query.count()
+        with self._lock:
+            self._counts.pop(key, None)
+            self._counts[key] = (total, now + self.ttl)
+            while len(self._counts) > self.max_entries:
+                self._counts.popitem(last=False)
+        return total
+
+
+class EstimatedTotal(PaginationTotal):
+    """Uses the row estimate of the query planner instead of counting.
+    Estimates below `exact_below` are replaced by an exact count, so small
+    results get exact totals.
+
+    The estimate is looked up by the ``estimate_<dialect name>`` method,
+    implemented for PostgreSQL and MySQL.  Other databases are counted.
+    Methods for more databases can be added by subclassing; they are
+    passed a connection, the compiled SQL and its parameters.
+    """
+
+    def __init__(self, exact_below=1000):
+        self.exact_below = exact_below
+
+    def count(self, query):
+        estimate = self.estimate(query)
+        if estimate is None or (self.exact_below is not None and
+                                estimate < self.exact_below):
+            return query.count()
+        return estimate
+
+    def estimate(self, query):
+        statement = query.statement
+        connection = query.session.connection(
+            mapper=query._mapper_zero(), clause=statement)
+        estimate = getattr(self, 'estimate_' + connection.dialect.name, None)
+        if estimate is None:
+            return None
+        compiled = statement.compile(dialect=connection.dialect)
+        params = compiled.construct_params()
+        if compiled.positional:
+            params = tuple(params[key] for key in compiled.positiontup)
+        return estimate(connection, str(compiled), params)
+
+    def estimate_postgresql(self, connection, sql, params):
+        plan = connection.execute('EXPLAIN (FORMAT JSON) ' + sql,
+                                  params).scalar()
+        if isinstance(plan, string_types):
+            plan = json.loads(plan)
+        return int(plan[0]['Plan']['Plan Rows'])
+
+    def estimate_mysql(self, connection, sql, params):
+        row = connection.execute('EXPLAIN ' + sql, params).first()
+        if row is None or row['rows'] is None:
+            return None
+        filtered = dict(row.items()).get('filtered') or 100
+        return int(row['rows'] * float(filtered) / 100)
+
+
+_pagination_totals = {
+    'exact': ExactTotal,
+    'lazy': LazyTotal,
+    'cached': CachedTotal,
+    'estimated': EstimatedTotal,
+}
+
+
 class BaseQuery(orm.Query):
     """SQLAlchemy :class:`~sqlalchemy.orm.query.Query` subclass with convenience methods for querying in a web application.
 
@@ -556,6 +1513,72 @@ class BaseQuery(orm.Query):
     Override the query class for an individual model by subclassing this and setting :attr:`~Model.query_class`.
     """
 
+    #: ``(ttl, tags)`` if the results are cached, set by :meth:`cache`.
+    _result_cache_options = None
+
+    def __iter__(self):
+        options = self._result_cache_options
+        if options is None:
+            return orm.Query.__iter__(self)
+        return iter(self._cached_results(*options))
+
+    def _prototype(self):
+        """Returns the query prepared by :attr:`Model.query` if this query
+        is an unchanged copy of it, else `None`.
+        """
+        mapper = self._mapper_zero()
+        if mapper is None:
+            return None
+        prototype = _QueryProperty.get_prototype(mapper.class_)
+        if prototype is None:
+            return None
+        d, prototype_d = self.__dict__, prototype.__dict__
+        if len(d) != len(prototype_d) or any(
+                d.get(key) is not value for key, value in iteritems(prototype_d)
+                if key != 'session'):
+            return None
+        return prototype
+
+    def get(self, ident):
+        """Like :meth:`~sqlalchemy.orm.query.Query.get`, but instances of
+        models with :attr:`~Model.__cache__` set are also looked up in the
+        :class:`IdentityCache` of the application before they are loaded,
+        and stored in it afterwards, if the query is :attr:`Model.query`
+        itself.  Instances taken from the cache are added to the session
+        without a query.
+        """
+
+        mapper = self._mapper_zero()
+        options = mapper is not None and _cache_options(mapper.class_)
+        session = self.session
+        if not options or isinstance(ident, dict) or \
+                not isinstance(session, SignallingSession) or \
+                self._prototype() is None:
+            return orm.Query.get(self, ident)
+
+        pk = tuple(to_list(ident))
+        region = session._state.get_cache_region(mapper)
+        if mapper.identity_key_from_primary_key(pk) in session.identity_map \
+                or (region, pk) in (session._cache_invalidations or ()):
+            return orm.Query.get(self, ident)
+
+        cache = session._state.get_identity_cache()
+        values = cache.get(region, pk)
+        if values is not None:
+            instance = _InstanceSnapshot.from_values(mapper, values).restore()
+            session.add(instance)
+            return instance
+
+        # an invalidation while the instance is loaded keeps it from being
+        # stored, as it might have been loaded before the change
+        version = cache.version(region, pk)
+        instance = orm.Query.get(self, ident)
+        # instances of subclasses are cached by their own model
+        if instance is not None and type(instance) is mapper.class_:
+            cache.set(region, pk, _InstanceSnapshot(instance).values,
+                      *options, version=version)
+        return instance
+
     def get_or_404(self, ident):
         """Like :meth:`get` but aborts with 404 if not found instead of returning ``None``."""
 
@@ -572,7 +1595,8 @@ class BaseQuery(orm.Query):
             abort(404)
         return rv
 
-    def paginate(self, page=None, per_page=None, error_out=True):
+    def paginate(self, page=None, per_page=None, error_out=True, total=None,
+                 count=True):
         """Returns ``per_page`` items from page ``page``.
 
         If no items are found and ``page`` is greater than 1, or if page is less than 1, it aborts with 404.
@@ -582,7 +1606,16 @@ class BaseQuery(orm.Query):
         If the values are not ints and ``error_out`` is ``True``, it aborts with 404.
         If there is no request or they aren't in the query, they default to 1 and 20 respectively.
 
+        The total is found by the :class:`PaginationTotal` configured with
+        ``SQLALCHEMY_PAGINATION_TOTAL``, or by ``total`` if it is given.
+        If ``count`` is ``False`` there is no total.  Instead one more item
+        than needed is fetched to find out whether there is a next page,
+        which is all endless scrolling needs.
+
         Returns a :class:`Pagination` object.
+
+        .. versionchanged:: 3.0
+           Added the ``total`` and ``count`` parameters.
         """
 
         if has_request_context():
@@ -613,41 +1646,934 @@ class BaseQuery(orm.Query):
         if error_out and page < 1:
             abort(404)
 
-        items = self.limit(per_page).offset((page - 1) * per_page).all()
+        if not count:
+            # one more row than needed tells whether there is a next page
+            items = self.limit(per_page + 1) \
+                .offset((page - 1) * per_page).all()
+            has_next = len(items) > per_page
+            items = items[:per_page]
+        else:
+            items = self.limit(per_page).offset((page - 1) * per_page).all()
+
+        if not items and page != 1 and error_out:
+            abort(404)
+
+        if not count:
+            return Pagination(self, page, per_page, None, items, has_next)
+
+        # No need to count if we're on the first page and there are fewer
+        # items than we expected.
+        if page == 1 and len(items) < per_page:
+            total = len(items)
+        else:
+            if total is None:
+                state = getattr(self.session, '_state', None)
+                total = state.get_pagination_total() if state is not None \
+                    else ExactTotal()
+            total = total.count(self.order_by(None))
+
+        return Pagination(self, page, per_page, total, items)
+
+    def stream(self, batch_size=1000, order_by=None):
+        """Iterates over the results in batches of ``batch_size`` rows, for
+        result sets too large to load at once.  Every batch is fetched with
+        keyset pagination, see :meth:`seek_paginate`, so later batches are
+        as cheap as the first and no cursor is kept open between them.
+        Model instances are expunged from the session once their batch is
+        done, so neither the identity map nor the memory use grows with the
+        number of rows.  Instances that are changed while iterating must be
+        merged back or flushed before the batch is done.
+
+        ``order_by`` works like for :meth:`seek_paginate` and defaults to
+        the primary key.  It replaces the ordering of the query.
+
+        .. versionadded:: 3.0
+        """
+
+        if order_by is None:
+            order_by = []
+        elif not isinstance(order_by, (list, tuple)):
+            order_by = [order_by]
+
+        columns = _seek_columns(self, order_by)
+        query = self.order_by(None).order_by(*[
+            column.desc() if descending else column.asc()
+            for column, descending in columns])
+        query = query.add_columns(*[column for column, _ in columns])
+        entities = len(self.column_descriptions)
+        session = self.session
+        values = None
+
+        while True:
+            batch = query
+            if values is not None:
+                batch = batch.filter(_seek_criterion(columns, values, False))
+            rows = batch.limit(batch_size).all()
+            if not rows:
+                break
+            values = rows[-1][entities:]
+            try:
+                for row in rows:
+                    yield row[0] if entities == 1 else tuple(row[:entities])
+            finally:
+                for row in rows:
+                    for item in row[:entities]:
+                        if hasattr(item, '_sa_instance_state') and \
+                                item in session:
+                            session.expunge(item)
+            if len(rows) < batch_size:
+                break
+
+    def seek_paginate(self, order_by, cursor=None, per_page=None,
+                      error_out=True):
+        """Returns ``per_page`` items after or before ``cursor``, using
+        keyset pagination.  Unlike :meth:`paginate` this neither skips rows
+        with ``OFFSET`` nor counts them, so every page is as cheap as the
+        first one, and rows inserted while paging don't shift the pages.
+
+        ``order_by`` is a column or a list of columns, optionally wrapped in
+        :func:`~sqlalchemy.sql.expression.desc`.  It replaces the ordering
+        of the query.  The primary key is appended to make the ordering
+        unique.  The columns must not be nullable.
+
+        ``cursor`` is one of the :attr:`~SeekPagination.next_cursor` and
+        :attr:`~SeekPagination.prev_cursor` values of an earlier page, or
+        ``None`` for the first page.  If ``cursor`` or ``per_page`` are
+        ``None`` they are retrieved from the ``cursor`` and ``per_page``
+        request arguments.  Invalid cursors abort with 404, unless
+        ``error_out`` is ``False`` in which case the first page is returned.
+        If a cursor points past the end and ``error_out`` is ``True`` it
+        aborts with 404 as well.
+
+        Returns a :class:`SeekPagination` object.
+
+        .. versionadded:: 3.0
+        """
+
+        if not isinstance(order_by, (list, tuple)):
+            order_by = [order_by]
+
+        if has_request_context():
+            if cursor is None:
+                cursor = request.args.get('cursor') or None
+
+            if per_page is None:
+                try:
+                    per_page = int(request.args.get('per_page', 20))
+                except (TypeError, ValueError):
+                    if error_out:
+                        abort(404)
+
+                    per_page = 20
+        elif per_page is None:
+            per_page = 20
+
+        columns = _seek_columns(self, order_by)
+        values, backwards = None, False
+        if cursor is not None:
+            try:
+                values, backwards = _decode_cursor(cursor)
+                if len(values) != len(columns):
+                    raise ValueError('cursor does not match the ordering')
+            except ValueError:
+                if error_out:
+                    abort(404)
+
+                cursor = values = None
+                backwards = False
+
+        query = self.order_by(None).order_by(*[
+            column.desc() if descending != backwards else column.asc()
+            for column, descending in columns])
+        if values is not None:
+            query = query.filter(_seek_criterion(columns, values, backwards))
+        entities = len(self.column_descriptions)
+        rows = query.add_columns(*[column for column, _ in columns]) \
+            .limit(per_page + 1).all()
+
+        more = len(rows) > per_page
+        rows = rows[:per_page]
+        if backwards:
+            rows.reverse()
+
+        if not rows and cursor is not None and error_out:
+            abort(404)
+
+        if entities == 1:
+            items = [row[0] for row in rows]
+        else:
+            items = [tuple(row[:entities]) for row in rows]
+
+        next_cursor = prev_cursor = None
+        if rows:
+            if more or backwards:
+                next_cursor = _encode_cursor(rows[-1][entities:])
+            if cursor is not None and (more or not backwards):
+                prev_cursor = _encode_cursor(rows[0][entities:], True)
+
+        return SeekPagination(self, order_by, per_page, cursor, items,
+                              next_cursor, prev_cursor)
+
+    def cached_statement(self, *fns):
+        """Returns a :class:`~sqlalchemy.ext.baked.BakedQuery` result for
+        this query with the criteria of the functions `fns` added, each of
+        which is passed the query and returns a new one::
+
+            User.query.cached_statement(
+                lambda q: q.filter_by(name=db.bindparam('name'))
+            ).params(name='joe').first()
+
+        The query and its compiled SQL are built on first use only and kept
+        in the :class:`StatementCache` of the application, keyed on the model
+        and the code of the functions.  Values that change between calls
+        therefore have to be passed as bound parameters with ``params``,
+        not taken from the enclosing scope.
+
+        Has to be called on :attr:`Model.query` itself, as criteria added
+        before are not part of the key.
+
+        .. versionadded:: 3.0
+        """
+
+        prototype = self._prototype()
+        if prototype is None:
+            raise ValueError('cached_statement() has to be called on '
+                             'Model.query directly')
+
+        cache = get_state(self.session.app).get_statement_cache()
+        baked = cache.bakery(lambda session: prototype.with_session(session),
+                             prototype)
+        for fn in fns:
+            baked += fn
+        return baked(self.session)
+
+    def cache(self, ttl=60.0, tags=None):
+        """Returns a copy of this query whose results are kept in the
+        :class:`ResultCache` of the application for `ttl` seconds, keyed on
+        the SQL and its parameters::
+
+            plans = Plan.query.filter_by(public=True).cache(ttl=300).all()
+
+        The cached rows hold the column values of the instances.  Instances
+        that are already in the session are used as they are, the others
+        are added to it without a query.  Relationships loaded by the query
+        are loaded again when they are accessed.
+
+        Entries are tagged with the tables the query selects from and the
+        `tags`, which are models or strings.  They are invalidated when a
+        session commits a change to one of these tables, through the unit
+        of work, a bulk update or delete of a query or a statement passed
+        to ``session.execute``, and by :meth:`SQLAlchemy.bulk_insert` and
+        :meth:`SQLAlchemy.bulk_upsert`, whether or not
+        ``SQLALCHEMY_TRACK_MODIFICATIONS`` is enabled.  Textual statements
+        other than ``SELECT`` invalidate all results.  Writes on a
+        connection of their own, such as ``session.connection().execute``,
+        aren't seen and need :meth:`ResultCache.invalidate`.  Sessions with
+        changes that weren't committed yet don't use the cache.
+
+        .. versionadded:: 3.0
+        """
+
+        query = self._clone()
+        query._result_cache_options = (ttl, tags)
+        return query
+
+    def _cached_results(self, ttl, tags):
+        session = self.session
+        if not isinstance(session, SignallingSession) or \
+                session._pending_write or not session._is_clean():
+            return list(orm.Query.__iter__(self))
+
+        statement = self.statement
+        key = (self._mapper_zero(),) + _statement_key(self, statement)
+        cache = session._state.get_result_cache()
+        rows = cache.get(key)
+        if rows is not None:
+            return _load_rows(session, rows)
+
+        results = list(orm.Query.__iter__(self))
+        tags = set(table.fullname for table in find_tables(statement))
+        for tag in self._result_cache_options[1] or ():
+            if isinstance(tag, string_types):
+                tags.add(tag)
+            else:
+                tags.update(_table_tags(orm.class_mapper(tag)))
+        cache.set(key, _dump_rows(results), ttl, tags)
+        return results
+
+
+class _QueryProperty(object):
+    #: the instances, whose prototypes are cleared whenever a mapper is
+    #: added as that can change the entities
+    instances = weakref.WeakSet()
+
+    def __init__(self, sa):
+        self.sa = sa
+        #: Maps model classes to a query without a session, which is copied
+        #: for the current session on every access instead of setting up
+        #: the mapper entities of a new query.  ``None`` is stored for
+        #: unmapped classes.
+        self.prototypes = weakref.WeakKeyDictionary()
+        self.instances.add(self)
+
+    def __get__(self, obj, type):
+        prototype = self.prototypes.get(type, False)
+        if prototype is False or (prototype is not None and
+                                  prototype.__class__ is not type.query_class):
+            prototype = self.prototypes[type] = self.make_prototype(type)
+        if prototype is not None:
+            return prototype.with_session(self.sa.session())
+
+    @staticmethod
+    def make_prototype(type):
+        try:
+            mapper = orm.class_mapper(type)
+        except UnmappedClassError:
+            return None
+        if mapper:
+            return type.query_class(mapper)
+
+    @staticmethod
+    def get_prototype(type):
+        """Returns the prototype prepared for `type` by its query property,
+        or `None`.
+        """
+        for cls in type.__mro__:
+            prop = cls.__dict__.get('query')
+            if prop is not None:
+                if isinstance(prop, _QueryProperty):
+                    return prop.prototypes.get(type)
+                return None
+
+    @classmethod
+    def reset(cls, mapper, class_):
+        for prop in list(cls.instances):
+            prop.prototypes.clear()
+
+
+event.listen(orm.Mapper, 'instrument_class', _QueryProperty.reset)
+
+
+def _cache_options(model):
+    """Returns ``(ttl, max_entries)`` from the :attr:`~Model.__cache__` of
+    `model`, or `None` if it isn't cached.
+    """
+    options = getattr(model, '__cache__', None)
+    if not options:
+        return None
+    return options.get('ttl', 60.0), options.get('max_entries', 1000)
+
+
+class IdentityCache(object):
+    """Keeps the column values of instances of models with
+    :attr:`~Model.__cache__` across requests, for :meth:`BaseQuery.get` and
+    :meth:`~BaseQuery.get_or_404`.  Entries are stored per model in a
+    `region` named after the application, the database URI of the model's
+    bind and the model, and keyed by the primary key.
+    Committing a session removes the instances it changed or deleted.
+
+    The cache of an application is created from
+    ``SQLALCHEMY_IDENTITY_CACHE`` by :meth:`SQLAlchemy.make_identity_cache`.
+
+    .. versionadded:: 3.0
+    """
+
+    def get(self, region, key):
+        """Returns the values stored for `key`, or `None`.  The values must
+        not be shared with other callers.
+        """
+        raise NotImplementedError()
+
+    def version(self, region, key):
+        """Returns a token that changes when `key` is deleted or `region`
+        cleared, or `None` if the cache can't tell.
+        """
+        return None
+
+    def set(self, region, key, values, ttl, max_entries, version=None):
+        """Stores `values` for `ttl` seconds, unless `version` is given and
+        :meth:`version` no longer returns it.  When `region` holds more
+        than `max_entries` entries the least recently used are dropped.
+        """
+        raise NotImplementedError()
+
+    def delete(self, region, key):
+        """Removes the entry for `key` if there is one."""
+        raise NotImplementedError()
+
+    def clear(self, region):
+        """Removes all entries of `region`."""
+        raise NotImplementedError()
+
+
+class MemoryIdentityCache(IdentityCache):
+    """Keeps the entries in the memory of the process.  This is the
+    default.
+    """
+
+    def __init__(self):
+        self._regions = {}
+        #: region -> the number of times entries of it were removed
+        self._versions = {}
+        self._lock = Lock()
+
+    def get(self, region, key):
+        with self._lock:
+            entries = self._regions.get(region)
+            if not entries:
+                return None
+            entry = entries.pop(key, None)
+            if entry is None or entry[1] <= _timer():
+                return None
+            entries[key] = entry
+        # every instance gets values of its own to change
+        return [(name, copy.deepcopy(value)
+                 if isinstance(value, (dict, list, set)) else value)
+                for name, value in entry[0]]
+
+    def version(self, region, key):
+        return self._versions.get(region, 0)
+
+    def set(self, region, key, values, ttl, max_entries, version=None):
+        with self._lock:
+            if version is not None and \
+                    version != self._versions.get(region, 0):
+                return
+            entries = self._regions.get(region)
+            if entries is None:
+                entries = self._regions[region] = OrderedDict()
+            entries.pop(key, None)
+            entries[key] = (values, _timer() + ttl)
+            while len(entries) > max_entries:
+                entries.popitem(last=False)
+
+    def delete(self, region, key):
+        with self._lock:
+            self._versions[region] = self._versions.get(region, 0) + 1
+            entries = self._regions.get(region)
+            if entries:
+                entries.pop(key, None)
+
+    def clear(self, region):
+        with self._lock:
+            self._versions[region] = self._versions.get(region, 0) + 1
+            self._regions.pop(region, None)
+
+
+class FileIdentityCache(IdentityCache):
+    """Keeps every entry in a JSON file below `path`, so that several
+    worker processes on one machine share the cache and see each others
+    invalidations.  Recently used entries are told apart by their
+    modification time.
+
+    Every region has a version file that is replaced whenever entries of
+    it are removed, so that an entry stored from values loaded before an
+    invalidation in another process is removed again.
+
+    `path` is created with permissions for the owner only.  An existing
+    directory that is owned by another user is refused.  Entries with
+    column values that can't be stored as JSON are not cached.
+    """
+
+    def __init__(self, path):
+        if not os.path.isdir(path):
+            os.makedirs(path, 0o700)
+        if hasattr(os, 'getuid') and os.stat(path).st_uid != os.getuid():
+            raise ValueError('The identity cache directory %r is not owned '
+                             'by the current user' % path)
+        self.path = path
+
+    def _name(self, value):
+        return hashlib.sha1(repr(value).encode('utf-8')).hexdigest()
+
+    def _region_path(self, region):
+        return os.path.join(self.path, self._name(region))
+
+    def _entry_path(self, region, key):
+        return os.path.join(self._region_path(region), self._name(key))
+
+    def _version_path(self, region):
+        return os.path.join(self._region_path(region), _VERSION_FILE)
+
+    def version(self, region, key):
+        try:
+            with open(self._version_path(region), 'rb') as f:
+                return f.read().decode('ascii')
+        except (IOError, OSError):
+            return ''
+
+    def _new_version(self, region):
+        directory = self._region_path(region)
+        try:
+            if not os.path.isdir(directory):
+                os.makedirs(directory, 0o700)
+            fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(uuid.uuid4().hex.encode('ascii'))
+            os.rename(tmp, self._version_path(region))
+        except (IOError, OSError):
+            pass
+
+    def get(self, region, key):
+        filename = self._entry_path(region, key)
+        try:
+            with open(filename, 'rb') as f:
+                expires, values = json.loads(f.read().decode('utf-8'))
+            if expires <= time.time():
+                return None
+            values = [(name, _load_cursor_value(value))
+                      for name, value in values]
+        except (IOError, OSError, ValueError, TypeError):
+            return None
+        try:
+            os.utime(filename, None)
+        except OSError:
+            pass
+        return values
+
+    def set(self, region, key, values, ttl, max_entries, version=None):
+        directory = self._region_path(region)
+        filename = self._entry_path(region, key)
+        try:
+            # the values are stored like the ones of seek cursors
+            data = json.dumps([time.time() + ttl, [
+                (name, _dump_cursor_value(value)) for name, value in values
+            ]], separators=(',', ':')).encode('utf-8')
+        except (TypeError, ValueError):
+            return
+        try:
+            if not os.path.isdir(directory):
+                os.makedirs(directory, 0o700)
+            fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            # replaces an existing entry atomically
+            os.rename(tmp, filename)
+            # removals replace the version before the entries, so either
+            # this sees the new version or the entry is removed after it
+            if version is not None and version != self.version(region, key):
+                self._remove(filename)
+                return
+            names = [name for name in os.listdir(directory)
+                     if not name.endswith('.tmp') and name != _VERSION_FILE]
+        except (IOError, OSError):
+            return
+        if len(names) > max_entries:
+            entries = []
+            for name in names:
+                try:
+                    entries.append((os.path.getmtime(
+                        os.path.join(directory, name)), name))
+                except OSError:
+                    pass
+            entries.sort()
+            for _, name in entries[:len(entries) - max_entries]:
+                self._remove(os.path.join(directory, name))
+
+    def _remove(self, filename):
+        try:
+            os.remove(filename)
+        except OSError:
+            pass
+
+    def delete(self, region, key):
+        self._new_version(region)
+        self._remove(self._entry_path(region, key))
+
+    def clear(self, region):
+        self._new_version(region)
+        directory = self._region_path(region)
+        try:
+            names = os.listdir(directory)
+        except OSError:
+            return
+        for name in names:
+            if name != _VERSION_FILE:
+                self._remove(os.path.join(directory, name))
+
+
+#: the file of a region of the :class:`FileIdentityCache` holding its version
+_VERSION_FILE = 'version'
+
+
+_identity_caches = {
+    'memory': MemoryIdentityCache,
+    'file': FileIdentityCache,
+}
+
+
+def _table_tags(mapper):
+    return [table.fullname for table in mapper.tables]
+
+
+def _dump_rows(results):
+    """Turns query results into tuples of values and the column values of
+    instances, keeping the class of the tuples returned for several
+    entities.
+    """
+    rows = []
+    for result in results:
+        if isinstance(result, tuple):
+            rows.append((type(result), tuple(
+                _InstanceSnapshot(value)
+                if hasattr(value, '_sa_instance_state') else value
+                for value in result)))
+        elif hasattr(result, '_sa_instance_state'):
+            rows.append((None, (_InstanceSnapshot(result),)))
+        else:
+            rows.append((None, (result,)))
+    return rows
+
+
+def _load_rows(session, rows):
+    identity_map = session.identity_map
+    results = []
+
+    def load(value):
+        if not isinstance(value, _InstanceSnapshot):
+            return value
+        instance = identity_map.get(value.key)
+        if instance is None:
+            instance = value.restore()
+            session.add(instance)
+        return instance
+
+    for cls, values in rows:
+        if cls is None:
+            results.append(load(values[0]))
+        else:
+            results.append(cls([load(value) for value in values]))
+    return results
+
+
+def _rows_size(rows):
+    """Roughly the number of bytes taken by the cached `rows`."""
+    size = sys.getsizeof(rows)
+    for _, values in rows:
+        size += sys.getsizeof(values)
+        for value in values:
+            if isinstance(value, _InstanceSnapshot):
+                size += sys.getsizeof(value) + sys.getsizeof(value.values)
+                size += sum(sys.getsizeof(item) + sys.getsizeof(item[1])
+                            for item in value.values)
+            else:
+                size += sys.getsizeof(value)
+    return size
+
+
+class ResultCache(object):
+    """The least recently used cache of the results of
+    :meth:`BaseQuery.cache`, holding up to ``SQLALCHEMY_RESULT_CACHE_SIZE``
+    query results per application.  It is returned by
+    :meth:`SQLAlchemy.get_result_cache`.
+
+    .. versionadded:: 3.0
+    """
+
+    def __init__(self, max_entries=1000):
+        self.max_entries = max_entries
+        #: the number of queries whose results were found in the cache
+        self.hits = 0
+        #: the number of queries that were executed
+        self.misses = 0
+        #: roughly the number of bytes taken by the cached results
+        self.memory = 0
+        self._entries = OrderedDict()
+        self._tags = {}
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def hit_ratio(self):
+        """The share of queries answered from the cache."""
+        total = self.hits + self.misses
+        return float(self.hits) / total if total else 0.0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] <= _timer():
+                self.misses += 1
+                return None
+            self.hits += 1
+            # keep the most recently used last
+            del self._entries[key]
+            self._entries[key] = entry
+            return entry[0]
+
+    def set(self, key, rows, ttl, tags):
+        entry = (rows, _timer() + ttl, tags, _rows_size(rows))
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = entry
+            self.memory += entry[3]
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self.memory -= entry[3]
+        for tag in entry[2]:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    def invalidate(self, *tags):
+        """Removes the results tagged with any of `tags`, which are table
+        names, models or the strings passed to :meth:`BaseQuery.cache`.
+        """
+        names = []
+        for tag in tags:
+            if isinstance(tag, string_types):
+                names.append(tag)
+            else:
+                names.extend(_table_tags(orm.class_mapper(tag)))
+        with self._lock:
+            for name in names:
+                for key in list(self._tags.get(name, ())):
+                    self._remove(key)
+
+    def clear(self):
+        """Removes all results."""
+        with self._lock:
+            self._entries.clear()
+            self._tags.clear()
+            self.memory = 0
+
+    def invalidate_changes(self, sender, changes):
+        """Receives :data:`models_committed` to invalidate the results of
+        the changed models.
+        """
+        models = set(target if isinstance(target, type) else type(target)
+                     for target, _ in changes)
+        self.invalidate(*models)
+
+
+class StatementCache(sqlalchemy.util.LRUCache):
+    """The least recently used cache of the queries and the compiled SQL
+    of :meth:`BaseQuery.cached_statement`, holding up to
+    ``SQLALCHEMY_STATEMENT_CACHE_SIZE`` entries per application.  It is
+    returned by :meth:`SQLAlchemy.get_statement_cache`.
+
+    .. versionadded:: 3.0
+    """
+
+    def __init__(self, capacity=200):
+        sqlalchemy.util.LRUCache.__init__(self, capacity)
+        #: the bakery creating the cached queries
+        self.bakery = baked.Bakery(baked.BakedQuery, self)
+        #: the number of lookups of a query or its compiled SQL that were
+        #: found in the cache
+        self.hits = 0
+        #: the number of lookups that weren't, after which the query was
+        #: built or compiled
+        self.misses = 0
+
+    def get(self, key, default=None):
+        rv = sqlalchemy.util.LRUCache.get(self, key, default)
+        if rv is default:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return rv
+
+
+def _record_queries(app):
+    if app.debug:
+        return True
+    rq = app.config['SQLALCHEMY_RECORD_QUERIES']
+    if rq is not None:
+        return rq
+    return bool(app.config.get('TESTING'))
+
+
+class EngineMetrics(object):
+    """Query and connection pool metrics of one bind, kept for as long as
+    the application runs when ``SQLALCHEMY_METRICS`` is enabled.  Memory
+    use is fixed: query durations only go into the buckets of a histogram.
+
+    The metrics of all binds are returned by :meth:`SQLAlchemy.get_metrics`
+    and can be exported with :meth:`SQLAlchemy.export_metrics`.
+
+    .. versionadded:: 3.0
+    """
+
+    def __init__(self, bind, buckets):
+        #: the bind key, `None` for the default bind
+        self.bind = bind
+        #: the upper bounds of the histogram buckets in seconds, sorted
+        self.buckets = tuple(sorted(buckets))
+        #: the number of queries per bucket, the last one counts the
+        #: queries slower than the largest bound
+        self.bucket_counts = [0] * (len(self.buckets) + 1)
+        #: the number of queries
+        self.queries = 0
+        #: the total duration of all queries in seconds
+        self.query_time = 0.0
+        #: the number of queries above ``SQLALCHEMY_SLOW_QUERY_THRESHOLD``
+        self.slow_queries = 0
+        #: the number of connections checked out of the pool
+        self.checkouts = 0
+        #: the total time spent waiting for the pool in seconds
+        self.checkout_wait = 0.0
+        #: the number of checkouts that happened while the pool was
+        #: beyond its size
+        self.overflow_checkouts = 0
+        #: the engine currently connected for the bind
+        self.engine = None
+        self._lock = Lock()
+
+    def observe(self, duration, slow=False):
+        """Records a query that took `duration` seconds."""
+        index = bisect_left(self.buckets, duration)
+        with self._lock:
+            self.bucket_counts[index] += 1
+            self.queries += 1
+            self.query_time += duration
+            if slow:
+                self.slow_queries += 1
+
+    def record_wait(self, wait):
+        """Records the time it took to get a connection from the pool."""
+        with self._lock:
+            self.checkout_wait += wait
+
+    def record_checkout(self, overflow=False):
+        """Records a connection checkout."""
+        with self._lock:
+            self.checkouts += 1
+            if overflow:
+                self.overflow_checkouts += 1
+
+    @property
+    def checked_out(self):
+        """The number of connections currently checked out of the pool.
+        Pools that don't keep count report `0`.
+        """
+        checkedout = getattr(getattr(self.engine, 'pool', None),
+                             'checkedout', None)
+        return checkedout() if checkedout is not None else 0
+
+    @property
+    def overflow(self):
+        """The number of connections currently open beyond the pool size."""
+        overflow = getattr(getattr(self.engine, 'pool', None),
+                           'overflow', None)
+        return max(overflow(), 0) if overflow is not None else 0
 
-        if not items and page != 1 and error_out:
-            abort(404)
+    def __repr__(self):
+        return '<%s %s queries=%d>' % (self.__class__.__name__, self.bind,
+                                       self.queries)
 
-        # No need to count if we're on the first page and there are fewer
-        # items than we expected.
-        if page == 1 and len(items) < per_page:
-            total = len(items)
-        else:
-            total = self.order_by(None).count()
 
-        return Pagination(self, page, per_page, total, items)
+class _EngineMetricsEvents(object):
+    """Feeds the :class:`EngineMetrics` of a bind and sends
+    :data:`slow_query`.
+    """
 
+    def __init__(self, app, engine, metrics, slow_threshold=None):
+        self.app = app
+        self.engine = engine
+        self.metrics = metrics
+        self.slow_threshold = slow_threshold
 
-class _QueryProperty(object):
-    def __init__(self, sa):
-        self.sa = sa
+    def register(self):
+        self.metrics.engine = self.engine
+        self.instrument_pool(self.engine)
+        event.listen(self.engine, 'before_cursor_execute', self.before_cursor_execute)
+        event.listen(self.engine, 'after_cursor_execute', self.after_cursor_execute)
+        event.listen(self.engine, 'checkout', self.checkout)
+        event.listen(self.engine, 'engine_disposed', self.instrument_pool)
+
+    def instrument_pool(self, engine):
+        # pools have no event for the time spent waiting for a connection,
+        # so the call that takes one out of the pool is timed instead.
+        # dispose() replaces the pool, which is why this is repeated then.
+        pool = engine.pool
+        do_get = getattr(pool, '_do_get', None)
+        if do_get is None:
+            return
+        record_wait = self.metrics.record_wait
 
-    def __get__(self, obj, type):
-        try:
-            mapper = orm.class_mapper(type)
-            if mapper:
-                return type.query_class(mapper, session=self.sa.session())
-        except UnmappedClassError:
-            return None
+        def _do_get():
+            start = _timer()
+            try:
+                return do_get()
+            finally:
+                record_wait(_timer() - start)
+        pool._do_get = _do_get
 
+    def checkout(self, dbapi_connection, connection_record, connection_proxy):
+        overflow = getattr(self.engine.pool, 'overflow', None)
+        self.metrics.record_checkout(overflow is not None and overflow() > 0)
 
-def _record_queries(app):
-    if app.debug:
-        return True
-    rq = app.config['SQLALCHEMY_RECORD_QUERIES']
-    if rq is not None:
-        return rq
-    return bool(app.config.get('TESTING'))
+    def before_cursor_execute(self, conn, cursor, statement,
+                              parameters, context, executemany):
+        context._metrics_start_time = _timer()
+
+    def after_cursor_execute(self, conn, cursor, statement,
+                             parameters, context, executemany):
+        duration = _timer() - context._metrics_start_time
+        slow = (self.slow_threshold is not None and
+                duration >= self.slow_threshold)
+        self.metrics.observe(duration, slow)
+        if slow:
+            slow_query.send(self.app, statement=statement,
+                            parameters=parameters, duration=duration,
+                            bind=self.metrics.bind)
+
+
+def _format_metrics(metrics, prefix):
+    """Formats :class:`EngineMetrics` in the Prometheus text format."""
+    def sample(name, value, **labels):
+        label = ','.join('%s="%s"' % (k, labels[k]) for k in sorted(labels))
+        return '%s%s{%s} %r' % (prefix, name, label, value)
+
+    def header(name, kind, help):
+        return ['# HELP %s%s %s' % (prefix, name, help),
+                '# TYPE %s%s %s' % (prefix, name, kind)]
+
+    lines = header('query_duration_seconds', 'histogram',
+                   'Duration of queries.')
+    for m in metrics:
+        bind = m.bind or 'default'
+        cumulative = 0
+        for bound, count in zip(m.buckets + ('+Inf',), m.bucket_counts):
+            cumulative += count
+            lines.append(sample('query_duration_seconds_bucket', cumulative,
+                                bind=bind, le=bound))
+        lines.append(sample('query_duration_seconds_sum', m.query_time,
+                            bind=bind))
+        lines.append(sample('query_duration_seconds_count', m.queries,
+                            bind=bind))
+
+    for name, kind, attr, help in [
+        ('slow_queries_total', 'counter', 'slow_queries',
+         'Queries above the slow query threshold.'),
+        ('pool_checkouts_total', 'counter', 'checkouts',
+         'Connections checked out of the pool.'),
+        ('pool_checkout_wait_seconds_total', 'counter', 'checkout_wait',
+         'Time spent waiting for a connection from the pool.'),
+        ('pool_overflow_checkouts_total', 'counter', 'overflow_checkouts',
+         'Checkouts while the pool was beyond its size.'),
+        ('pool_checked_out', 'gauge', 'checked_out',
+         'Connections currently checked out of the pool.'),
+        ('pool_overflow', 'gauge', 'overflow',
+         'Connections currently open beyond the pool size.'),
+    ]:
+        lines.extend(header(name, kind, help))
+        for m in metrics:
+            lines.append(sample(name, getattr(m, attr),
+                                bind=m.bind or 'default'))
+    return '\n'.join(lines) + '\n'
 
 
 class _EngineConnector(object):
@@ -659,6 +2585,8 @@ class _EngineConnector(object):
         self._connected_for = None
         self._bind = bind
         self._lock = Lock()
+        #: the :class:`EngineMetrics` of the bind if they are enabled
+        self.metrics = None
 
     def get_uri(self):
         if self._bind is None:
@@ -676,23 +2604,496 @@ class _EngineConnector(object):
         return binds[self._bind]
 
     def get_engine(self):
+        # Once created the engine is only ever replaced by reconfigure(),
+        # so the common case needs neither the lock nor the config.
+        engine = self._engine
+        if engine is not None:
+            return engine
+        with self._lock:
+            if self._engine is None:
+                self._connect()
+            return self._engine
+
+    def reconfigure(self):
+        """Recreates the engine if its URI or echo setting changed.  The
+        previous engine is disposed so that its pooled connections are
+        closed.
+        """
+        with self._lock:
+            previous = self._engine
+            self._connect()
+        if previous is not None and previous is not self._engine:
+            previous.dispose()
+
+    def _connect(self):
+        uri = self.get_uri()
+        echo = self._app.config['SQLALCHEMY_ECHO']
+        if (uri, echo) == self._connected_for:
+            return
+        info = make_url(uri)
+        options = {'convert_unicode': True}
+        self._sa.apply_pool_defaults(self._app, options)
+        self._sa.apply_driver_hacks(self._app, info, options)
+        if echo:
+            options['echo'] = True
+        engine = sqlalchemy.create_engine(info, **options)
+        if _record_queries(self._app):
+            config = self._app.config
+            _EngineDebuggingSignalEvents(
+                engine, self._app.import_name,
+                config['SQLALCHEMY_RECORD_QUERIES_SAMPLE_RATE'],
+                config['SQLALCHEMY_RECORD_QUERIES_MAX'],
+                config['SQLALCHEMY_RECORD_QUERIES_REPEAT_THRESHOLD']).register()
+        config = self._app.config
+        if (config['SQLALCHEMY_METRICS'] or
+                config['SQLALCHEMY_SLOW_QUERY_THRESHOLD'] is not None):
+            # the metrics of a bind outlive its engines
+            if self.metrics is None:
+                self.metrics = EngineMetrics(
+                    self._bind, config['SQLALCHEMY_METRICS_BUCKETS'])
+            _EngineMetricsEvents(
+                self._app, engine, self.metrics,
+                config['SQLALCHEMY_SLOW_QUERY_THRESHOLD']).register()
+        self._connected_for = (uri, echo)
+        self._engine = engine
+
+
+class Replica(object):
+    """A read replica out of ``SQLALCHEMY_DATABASE_SLAVE_URIS`` as it is
+    passed to a :class:`ReplicaBalancer`.
+
+    Replicas also work as circuit breakers: after `max_failures` connection
+    errors in a row a replica is ejected from the rotation for
+    `eject_time` seconds.  Once that time is over a single read is let
+    through to probe it, see :meth:`claim_probe`, while the replica stays
+    out of the rotation for all other reads.  If the probe fails the
+    replica is ejected for twice as long, up to `max_eject_time` seconds.
+    A successful connection restores the replica completely.
+    """
+
+    def __init__(self, bind, engine, weight=1, max_failures=3,
+                 eject_time=1.0, max_eject_time=60.0):
+        #: the bind key of the replica (``'slaves_0'``, ``'slaves_1'``, ...)
+        self.bind = bind
+        #: the engine connected to the replica
+        self.engine = engine
+        #: the relative share of reads the replica should receive, taken
+        #: from ``SQLALCHEMY_DATABASE_SLAVE_WEIGHTS``
+        self.weight = weight
+        self.max_failures = max_failures
+        self.eject_time = eject_time
+        self.max_eject_time = max_eject_time
+        #: the number of connection errors since the last success
+        self.failures = 0
+        #: how often the replica was ejected since the last success
+        self.ejections = 0
+        #: the timer value until which the replica is ejected, or may not
+        #: be probed while a probe is in flight
+        self.ejected_until = 0.0
+        #: whether a read was let through to probe the ejected replica
+        self.probing = False
+        self._lock = Lock()
+
+    @property
+    def checked_out(self):
+        """The number of connections currently checked out of the pool
+        of the replica.  Pools that don't keep count report `0`.
+        """
+        checkedout = getattr(self.engine.pool, 'checkedout', None)
+        if checkedout is None:
+            return 0
+        return checkedout()
+
+    def is_available(self):
+        """`True` unless the replica is ejected.  Replicas stay ejected
+        after their back-off until a probe connected.
+        """
+        return not self.ejected_until
+
+    def claim_probe(self, now=None):
+        """Returns `True` for exactly one caller once the back-off of the
+        ejected replica is over.  That caller's read probes the replica.
+        If it neither connects nor fails within `eject_time` seconds the
+        next caller gets to probe.
+        """
+        if now is None:
+            now = _timer()
+        if not self.ejected_until or now < self.ejected_until:
+            return False
+        with self._lock:
+            if not self.ejected_until or now < self.ejected_until:
+                return False
+            self.probing = True
+            self.ejected_until = now + self.eject_time
+            return True
+
+    def record_success(self):
+        """Records a successful connection.  Returns `True` if this restored
+        a replica that was ejected before.
+        """
+        if not self.failures and not self.ejections:
+            return False
+        with self._lock:
+            restored = self.ejections > 0
+            self.failures = 0
+            self.ejections = 0
+            self.ejected_until = 0.0
+            self.probing = False
+            return restored
+
+    def record_failure(self, now=None):
+        """Records a connection error.  Returns `True` if this ejected the
+        replica.
+        """
+        if now is None:
+            now = _timer()
+        with self._lock:
+            self.failures += 1
+            # a replica that is on probation after an ejection goes back
+            # out on the first error
+            if self.failures < self.max_failures and not self.ejections:
+                return False
+            if self.ejected_until > now and not self.probing:
+                return False
+            self.probing = False
+            timeout = min(self.eject_time * 2 ** self.ejections,
+                          self.max_eject_time)
+            self.ejections += 1
+            self.ejected_until = now + timeout
+            return True
+
+    @property
+    def status(self):
+        """A dictionary describing the health of the replica for
+        monitoring.
+        """
+        ejected_until = self.ejected_until
+        return {
+            'bind': self.bind,
+            'url': repr(self.engine.url),
+            'available': not ejected_until,
+            'failures': self.failures,
+            'ejections': self.ejections,
+            'ejected_for': max(ejected_until - _timer(), 0.0)
+            if ejected_until else 0.0,
+        }
+
+    def __repr__(self):
+        return '<%s %s weight=%r>' % (self.__class__.__name__, self.bind,
+                                      self.weight)
+
+
+class _ReplicaHealthEvents(object):
+    """Feeds the connection errors and successes of a replica's engine
+    into its circuit breaker.
+    """
+
+    def __init__(self, app, replica):
+        self.app = app
+        self.replica = replica
+
+    def register(self):
+        event.listen(self.replica.engine, 'engine_connect',
+                     self.engine_connect)
+        event.listen(self.replica.engine, 'handle_error', self.handle_error)
+
+    def engine_connect(self, conn, branch):
+        if not branch and self.replica.record_success():
+            replica_restored.send(self.app, replica=self.replica)
+
+    def handle_error(self, context):
+        # only errors while connecting or lost connections count, not
+        # errors in the statements themselves
+        if context.connection is not None and not context.is_disconnect:
+            return
+        if self.replica.record_failure():
+            replica_ejected.send(self.app, replica=self.replica)
+
+
+class _ReplicaPinger(object):
+    """Background thread that connects to every replica at a fixed
+    interval so that failures are noticed and ejected replicas come back
+    without waiting for reads.
+    """
+
+    def __init__(self, replicas, interval):
+        self.replicas = replicas
+        self.interval = interval
+        self._stopped = Event()
+        self._thread = Thread(target=self._run,
+                              name='flask_sqlalchemy replica pinger')
+        self._thread.daemon = True
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def ping(self):
+        for replica in self.replicas:
+            try:
+                with replica.engine.connect() as conn:
+                    conn.scalar(sqlalchemy.select([1]))
+            except Exception:
+                # recorded by the replica's health events
+                pass
+
+    def _run(self):
+        while True:
+            self._stopped.wait(self.interval)
+            if self._stopped.is_set():
+                break
+            self.ping()
+
+
+class ReplicaBalancer(object):
+    """Chooses the replica that serves a read.  Subclasses have to implement
+    :meth:`choose`, the configured balancer is created by
+    :meth:`SQLAlchemy.make_balancer`.
+
+    .. versionadded:: 3.0
+    """
+
+    def register(self, replica):
+        """Called once for every replica before it is first passed to
+        :meth:`choose`.  Can be used to install engine event listeners.
+        """
+
+    def choose(self, replicas):
+        """Returns one out of the non-empty list of `replicas`."""
+        raise NotImplementedError()
+
+
+class RandomBalancer(ReplicaBalancer):
+    """Picks replicas at random, proportional to their weight."""
+
+    def choose(self, replicas):
+        total = 0
+        for replica in replicas:
+            total += replica.weight
+        point = random.random() * total
+        for replica in replicas:
+            point -= replica.weight
+            if point < 0:
+                return replica
+        return replicas[-1]
+
+
+class RoundRobinBalancer(ReplicaBalancer):
+    """Smooth weighted round-robin: over ``sum(weights)`` reads each replica
+    is picked exactly ``weight`` times, with the picks spread out evenly.
+    """
+
+    def __init__(self):
+        self._current = {}
+        self._lock = Lock()
+
+    def choose(self, replicas):
         with self._lock:
-            uri = self.get_uri()
-            echo = self._app.config['SQLALCHEMY_ECHO']
-            if (uri, echo) == self._connected_for:
-                return self._engine
-            info = make_url(uri)
-            options = {'convert_unicode': True}
-            self._sa.apply_pool_defaults(self._app, options)
-            self._sa.apply_driver_hacks(self._app, info, options)
-            if echo:
-                options['echo'] = True
-            self._engine = rv = sqlalchemy.create_engine(info, **options)
-            if _record_queries(self._app):
-                _EngineDebuggingSignalEvents(self._engine,
-                                             self._app.import_name).register()
-            self._connected_for = (uri, echo)
-            return rv
+            current = self._current
+            total = 0
+            best = None
+            for replica in replicas:
+                total += replica.weight
+                value = current.get(replica.bind, 0) + replica.weight
+                current[replica.bind] = value
+                if best is None or value > current[best.bind]:
+                    best = replica
+            current[best.bind] -= total
+            return best
+
+
+class LeastConnectionsBalancer(ReplicaBalancer):
+    """Picks the replica with the fewest connections checked out of its
+    pool relative to its weight.  Ties are broken at random.
+    """
+
+    def choose(self, replicas):
+        best = []
+        best_load = None
+        for replica in replicas:
+            load = replica.checked_out / float(replica.weight)
+            if best_load is None or load < best_load:
+                best = [replica]
+                best_load = load
+            elif load == best_load:
+                best.append(replica)
+        return random.choice(best)
+
+
+class PowerOfTwoChoicesBalancer(ReplicaBalancer):
+    """Picks two replicas at random and uses the one with the lower average
+    query latency relative to its weight.  The average decays exponentially
+    with a time constant of `decay` seconds so that a replica which was slow
+    a while ago gets another chance.
+    """
+
+    def __init__(self, decay=10.0):
+        self.decay = decay
+        self._latency = {}
+
+    def register(self, replica):
+        self._latency[replica.bind] = (0.0, None)
+        event.listen(replica.engine, 'before_cursor_execute',
+                     self._before_cursor_execute)
+        event.listen(replica.engine, 'after_cursor_execute',
+                     functools.partial(self._after_cursor_execute, replica))
+
+    def _before_cursor_execute(self, conn, cursor, statement,
+                               parameters, context, executemany):
+        context._balancer_start_time = _timer()
+
+    def _after_cursor_execute(self, replica, conn, cursor, statement,
+                              parameters, context, executemany):
+        now = _timer()
+        self.observe(replica, now - context._balancer_start_time, now)
+
+    def observe(self, replica, duration, now=None):
+        """Adds the `duration` of a query to the latency average of the
+        `replica`.
+        """
+        if now is None:
+            now = _timer()
+        average, last = self._latency.get(replica.bind, (0.0, None))
+        if last is None:
+            average = duration
+        else:
+            weight = exp(-max(now - last, 0.0) / self.decay)
+            average = average * weight + duration * (1.0 - weight)
+        self._latency[replica.bind] = (average, now)
+
+    def latency(self, replica):
+        """The current latency average of the `replica` in seconds."""
+        return self._latency.get(replica.bind, (0.0, None))[0]
+
+    def choose(self, replicas):
+        if len(replicas) == 1:
+            return replicas[0]
+        a, b = random.sample(replicas, 2)
+        if self.latency(a) / a.weight <= self.latency(b) / b.weight:
+            return a
+        return b
+
+
+_balancers = {
+    'random': RandomBalancer,
+    'round_robin': RoundRobinBalancer,
+    'least_connections': LeastConnectionsBalancer,
+    'power_of_two_choices': PowerOfTwoChoicesBalancer,
+}
+
+
+class ReplicationLagProbe(object):
+    """Tells whether a replica already has the data written at a given
+    time, so that reads after a write don't have to stay on the master for
+    the whole ``SQLALCHEMY_DATABASE_SLAVE_STICKY_TIME``.  Subclasses have
+    to implement :meth:`measure`, the configured probe is created by
+    :meth:`SQLAlchemy.make_lag_probe`.
+
+    Measurements are reused for `interval` seconds.
+
+    .. versionadded:: 3.0
+    """
+
+    def __init__(self, interval=1.0):
+        self.interval = interval
+        self._measurements = {}
+
+    def measure(self, replica):
+        """Returns how many seconds the `replica` is behind the master or
+        `None` if that is unknown, for example because replication stopped.
+        """
+        raise NotImplementedError()
+
+    def lag(self, replica):
+        """Returns a tuple of the lag of the `replica` in seconds (or `None`)
+        and the time it was measured at.
+        """
+        now = time.time()
+        measurement = self._measurements.get(replica.bind)
+        if measurement is None or now - measurement[1] >= self.interval:
+            try:
+                lag = self.measure(replica)
+            except sqlalchemy.exc.SQLAlchemyError:
+                lag = None
+            measurement = self._measurements[replica.bind] = (lag, now)
+        return measurement
+
+    def caught_up(self, replica, written_at):
+        """`True` if the `replica` has the writes committed at the
+        timestamp `written_at`.
+        """
+        lag, measured_at = self.lag(replica)
+        return lag is not None and measured_at - lag >= written_at
+
+
+class MySQLLagProbe(ReplicationLagProbe):
+    """Reads ``Seconds_Behind_Master`` from ``SHOW SLAVE STATUS``."""
+
+    def measure(self, replica):
+        with replica.engine.connect() as conn:
+            row = conn.execute('SHOW SLAVE STATUS').first()
+        if row is None:
+            return None
+        return row['Seconds_Behind_Master']
+
+
+class PostgreSQLLagProbe(ReplicationLagProbe):
+    """Compares the time of the last replayed transaction with the current
+    time on a streaming replica (PostgreSQL 10 or later).
+    """
+
+    query = (
+        'SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() '
+        'THEN 0 ELSE EXTRACT(EPOCH FROM now() - '
+        'pg_last_xact_replay_timestamp()) END'
+    )
+
+    def measure(self, replica):
+        with replica.engine.connect() as conn:
+            lag = conn.scalar(self.query)
+        if lag is None:
+            return None
+        return float(lag)
+
+
+_lag_probes = {
+    'mysql': MySQLLagProbe,
+    'postgresql': PostgreSQLLagProbe,
+}
+
+
+def _bulk_columns(mapper):
+    """Returns the columns of a mapper by attribute name."""
+    if mapper.inherits is not None and \
+            mapper.local_table is not mapper.inherits.local_table:
+        raise ValueError('Bulk writes of %s would leave out the columns of '
+                         'the tables it inherits, write the rows of each '
+                         'table of a joined table inheritance hierarchy '
+                         'with the session instead' % mapper.class_.__name__)
+    return dict((prop.key, prop.columns[0]) for prop in mapper.column_attrs
+                if prop.columns[0].table is mapper.local_table)
+
+
+def _bulk_row(columns, row):
+    """Turns a dictionary keyed by attribute name or a model instance into
+    the parameters of an ``INSERT`` of the mapper's table.
+    """
+    if not isinstance(row, dict):
+        row = inspect(row).dict
+    return dict((columns[key].key, value) for key, value in iteritems(row)
+                if key in columns)
+
+
+def _make_plugin(value, builtins, kind):
+    if isinstance(value, string_types):
+        assert value in builtins, 'Unknown %s %r.  Use one of %s' % (
+            kind, value, ', '.join(sorted(builtins)))
+        value = builtins[value]
+    if isinstance(value, type):
+        value = value()
+    return value
 
 
 def _should_set_tablename(bases, d):
@@ -726,26 +3127,67 @@ def _should_set_tablename(bases, d):
         return True
 
     for base in bases:
-        if hasattr(base, '__tablename__') or hasattr(base, '__table__'):
-            return False
+        try:
+            found = _base_tablenames[base]
+        except KeyError:
+            found = _base_tablenames[base] = _scan_base(base)
+        if found is not None:
+            return found
+
+
+#: base class -> what :func:`_scan_base` found in it
+_base_tablenames = weakref.WeakKeyDictionary()
+
+
+def _scan_base(base):
+    """Returns `False` if `base` has a table or tablename, `True` if it has
+    a primary key column, else `None`.  Only the ``__dict__`` of every
+    class in the MRO is looked at, attributes of a class hide those of the
+    classes after it.
+    """
 
-        for name in dir(base):
-            attr = getattr(base, name)
+    mro = base.__mro__
+    if any('__tablename__' in c.__dict__ or '__table__' in c.__dict__
+           for c in mro):
+        return False
 
+    seen = set()
+    for c in mro:
+        for name, attr in iteritems(c.__dict__):
+            if name in seen:
+                continue
+            seen.add(name)
+            if isinstance(attr, declared_attr):
+                attr = getattr(base, name)
             if isinstance(attr, sqlalchemy.Column) and attr.primary_key:
                 return True
 
 
+def _join_camelcase(match):
+    word = match.group()
+    if len(word) > 1:
+        return ('_%s_%s' % (word[:-1], word[-1])).lower()
+    return '_' + word.lower()
+
+
+#: class name -> generated tablename
+_tablenames = {}
+
+
+def _make_tablename(name):
+    try:
+        return _tablenames[name]
+    except KeyError:
+        tablename = _tablenames[name] = \
+            _camelcase_re.sub(_join_camelcase, name).lstrip('_')
+        return tablename
+
+
 class _BoundDeclarativeMeta(DeclarativeMeta):
 
     def __new__(cls, name, bases, d):
         if _should_set_tablename(bases, d):
-            def _join(match):
-                word = match.group()
-                if len(word) > 1:
-                    return ('_%s_%s' % (word[:-1], word[-1])).lower()
-                return '_' + word.lower()
-            d['__tablename__'] = _camelcase_re.sub(_join, name).lstrip('_')
+            d['__tablename__'] = _make_tablename(name)
 
         return DeclarativeMeta.__new__(cls, name, bases, d)
 
@@ -754,6 +3196,24 @@ class _BoundDeclarativeMeta(DeclarativeMeta):
         DeclarativeMeta.__init__(self, name, bases, d)
         if bind_key is not None:
             self.__table__.info['bind_key'] = bind_key
+            _touch_metadata(self.__table__.metadata)
+
+
+#: MetaData -> number of changes to its tables, used as the key of the
+#: binds mapping cached by :meth:`_SQLAlchemyState.get_binds`
+_metadata_versions = weakref.WeakKeyDictionary()
+
+
+def _touch_metadata(metadata):
+    _metadata_versions[metadata] = _metadata_versions.get(metadata, 0) + 1
+
+
+def _table_attached(table, parent):
+    if isinstance(parent, sqlalchemy.MetaData):
+        _touch_metadata(parent)
+
+
+event.listen(sqlalchemy.Table, 'after_parent_attach', _table_attached)
 
 
 def get_state(app):
@@ -771,6 +3231,308 @@ class _SQLAlchemyState(object):
         self.db = db
         self.app = app
         self.connectors = {}
+        #: mapper -> engine of its bind key, or `None` for the default bind
+        self.mapper_binds = {}
+        #: the engine of the default bind, set together with the replicas
+        self.master_engine = None
+        self.balancer = None
+        self.lag_probe = None
+        self.sticky_time = None
+        #: returns the client whose writes keep its reads on the master
+        self.sticky_key = None
+        #: client -> when its last write was committed, oldest first
+        self._last_writes = OrderedDict()
+        self._last_writes_lock = Lock()
+        self._binds_cache = None
+        #: mapper -> region of the identity cache
+        self._cache_regions = {}
+        self._replicas = None
+        #: guards the lazy creation of the replicas, caches, dispatcher and
+        #: pagination strategy of the application
+        self._init_lock = Lock()
+        self._pinger = None
+        self._pagination_total = None
+        #: model class -> whether its changes are tracked
+        self._tracked_models = {}
+        self._signal_dispatcher = None
+        self._statement_cache = None
+        self._identity_cache = None
+        self._result_cache = None
+
+    def tracks_model(self, model):
+        """Whether changes to instances of `model` are sent with
+        :data:`models_committed`, according to the
+        :attr:`~Model.__track_modifications__` of the model or else
+        ``SQLALCHEMY_TRACK_MODIFICATIONS_MODELS``.  Only subclasses of
+        the ``Model`` base of the :class:`SQLAlchemy` object are tracked.
+        """
+        try:
+            return self._tracked_models[model]
+        except KeyError:
+            models = self.app.config['SQLALCHEMY_TRACK_MODIFICATIONS_MODELS']
+            tracked = getattr(model, '__track_modifications__', None)
+            if not issubclass(model, self.db.Model):
+                tracked = False
+            elif tracked is not None:
+                tracked = bool(tracked)
+            elif models is None:
+                tracked = True
+            else:
+                tracked = any(cls in models or cls.__name__ in models
+                              for cls in model.__mro__)
+            self._tracked_models[model] = tracked
+            return tracked
+
+    def get_signal_dispatcher(self):
+        """Returns the background dispatcher of :data:`models_committed`,
+        which is started on first use.
+        """
+        dispatcher = self._signal_dispatcher
+        if dispatcher is None:
+            with self._init_lock:
+                if self._signal_dispatcher is None:
+                    config = self.app.config
+                    dispatcher = _SignalDispatcher(
+                        self.app, config['SQLALCHEMY_ASYNC_SIGNALS_QUEUE_SIZE'],
+                        config['SQLALCHEMY_ASYNC_SIGNALS_WINDOW'])
+                    dispatcher.start()
+                    self._signal_dispatcher = dispatcher
+                dispatcher = self._signal_dispatcher
+        return dispatcher
+
+    def get_statement_cache(self):
+        """Returns the :class:`StatementCache` of the application."""
+        cache = self._statement_cache
+        if cache is None:
+            with self._init_lock:
+                if self._statement_cache is None:
+                    self._statement_cache = StatementCache(
+                        self.app.config['SQLALCHEMY_STATEMENT_CACHE_SIZE'])
+                cache = self._statement_cache
+        return cache
+
+    def get_identity_cache(self):
+        """Returns the :class:`IdentityCache` of the application, which is
+        created on first use.
+        """
+        cache = self._identity_cache
+        if cache is None:
+            with self._init_lock:
+                if self._identity_cache is None:
+                    self._identity_cache = \
+                        self.db.make_identity_cache(self.app)
+                cache = self._identity_cache
+        return cache
+
+    def get_result_cache(self):
+        """Returns the :class:`ResultCache` of the application, which is
+        created on first use and invalidated by the sessions and bulk
+        writes that commit changes to the tables of its results.
+        """
+        cache = self._result_cache
+        if cache is None:
+            with self._init_lock:
+                if self._result_cache is None:
+                    cache = ResultCache(
+                        self.app.config['SQLALCHEMY_RESULT_CACHE_SIZE'])
+                    self._result_cache = cache
+                cache = self._result_cache
+        return cache
+
+    def get_pagination_total(self):
+        """Returns the :class:`PaginationTotal` of the application, which
+        is created on first use.
+        """
+        total = self._pagination_total
+        if total is None:
+            with self._init_lock:
+                if self._pagination_total is None:
+                    self._pagination_total = \
+                        self.db.make_pagination_total(self.app)
+                total = self._pagination_total
+        return total
+
+    def _binds_cache_key(self):
+        metadata = self.db.Model.metadata
+        return _metadata_versions.get(metadata, 0), len(metadata.tables)
+
+    def get_binds(self, default=True):
+        """Returns the table->engine mapping of :meth:`SQLAlchemy.get_binds`.
+
+        The mapping is computed once and only rebuilt when a table is
+        attached to or removed from the metadata, a model sets its bind key
+        or :meth:`invalidate_binds` is called, which
+        :meth:`SQLAlchemy.reconfigure` does after ``SQLALCHEMY_BINDS``
+        changed.
+        If `default` is `False` the tables of the default bind are left out.
+        The returned dictionaries are shared and must not be modified.
+        """
+        key = self._binds_cache_key()
+        cache = self._binds_cache
+        if cache is None or cache[0] != key:
+            binds = self.db.get_binds(self.app)
+            bound = dict((table, engine) for table, engine in iteritems(binds)
+                         if table.info.get('bind_key') is not None)
+            cache = self._binds_cache = (key, binds, bound)
+        return cache[1] if default else cache[2]
+
+    def get_mapper_bind(self, mapper):
+        """Returns the engine for the bind key of a mapper's table or `None`
+        for the default bind.  The result is remembered in
+        :attr:`mapper_binds`.
+        """
+        info = getattr(mapper.mapped_table, 'info', {})
+        bind_key = info.get('bind_key')
+        engine = None
+        if bind_key is not None:
+            engine = self.db.get_engine(self.app, bind=bind_key)
+        self.mapper_binds[mapper] = engine
+        return engine
+
+    def get_cache_region(self, mapper):
+        """Returns the name the instances of `mapper` are cached under in
+        the :class:`IdentityCache`, made of the import name of the
+        application, the database URI of the mapper's bind, with the
+        password hidden, and the model.
+        """
+        try:
+            return self._cache_regions[mapper]
+        except KeyError:
+            cls = mapper.class_
+            engine = self.db.get_engine(
+                self.app, mapper.local_table.info.get('bind_key'))
+            region = self._cache_regions[mapper] = '%s:%r:%s.%s' % (
+                self.app.import_name, engine.url, cls.__module__,
+                cls.__name__)
+            return region
+
+    def invalidate_binds(self):
+        """Forces the mappings returned by :meth:`get_binds` and
+        :meth:`get_mapper_bind` to be rebuilt.  Only needed if the bind key
+        of an existing table is changed.
+        """
+        self._binds_cache = None
+        self.mapper_binds = {}
+        self._cache_regions = {}
+
+    def get_replicas(self):
+        """Returns the list of :class:`Replica` objects for the configured
+        ``SQLALCHEMY_DATABASE_SLAVE_URIS``.  The list and the balancer are
+        created on first use and are kept until :meth:`SQLAlchemy.reconfigure`
+        is called.
+        """
+        replicas = self._replicas
+        if replicas is None:
+            with self._init_lock:
+                replicas = self._replicas
+                if replicas is None:
+                    replicas = self._make_replicas()
+        return replicas
+
+    def _make_replicas(self):
+        config = self.app.config
+        uris = config['SQLALCHEMY_DATABASE_SLAVE_URIS'] or ()
+        weights = config['SQLALCHEMY_DATABASE_SLAVE_WEIGHTS'] or ()
+        assert not weights or len(weights) == len(uris), \
+            'SQLALCHEMY_DATABASE_SLAVE_WEIGHTS needs one weight for each ' \
+            'of the SQLALCHEMY_DATABASE_SLAVE_URIS'
+        balancer = self.db.make_balancer(self.app)
+        replicas = []
+        for index in xrange(len(uris)):
+            bind = 'slaves_{}'.format(index)
+            replica = Replica(
+                bind, self.db.get_engine(self.app, bind),
+                weight=weights[index] if weights else 1,
+                max_failures=config['SQLALCHEMY_DATABASE_SLAVE_MAX_FAILURES'],
+                eject_time=config['SQLALCHEMY_DATABASE_SLAVE_EJECT_TIME'],
+                max_eject_time=config[
+                    'SQLALCHEMY_DATABASE_SLAVE_MAX_EJECT_TIME'])
+            _ReplicaHealthEvents(self.app, replica).register()
+            balancer.register(replica)
+            replicas.append(replica)
+
+        self.master_engine = self.db.get_engine(self.app)
+        self.sticky_time = config['SQLALCHEMY_DATABASE_SLAVE_STICKY_TIME']
+        self.sticky_key = config['SQLALCHEMY_DATABASE_SLAVE_STICKY_KEY']
+        self.lag_probe = self.db.make_lag_probe(self.app)
+
+        interval = config['SQLALCHEMY_DATABASE_SLAVE_PING_INTERVAL']
+        if replicas and interval:
+            self._pinger = _ReplicaPinger(replicas, interval)
+            self._pinger.start()
+
+        self.balancer = balancer
+        self._replicas = replicas
+        return replicas
+
+    def choose_replica(self, written_at=None):
+        """Returns the :class:`Replica` that should serve the next read or
+        `None` if no replicas are configured or all of them are ejected.
+        If `written_at` is given only replicas that the lag probe reports
+        to have caught up with writes committed at that time are used.
+        """
+        replicas = self.get_replicas()
+        if not replicas:
+            return None
+        for replica in replicas:
+            if replica.ejected_until:
+                now = _timer()
+                available = []
+                for r in replicas:
+                    if r.is_available():
+                        available.append(r)
+                    elif written_at is None and r.claim_probe(now):
+                        # this read finds out whether the replica is back
+                        return r
+                replicas = available
+                break
+        if written_at is not None:
+            if self.lag_probe is None:
+                return None
+            replicas = [r for r in replicas
+                        if self.lag_probe.caught_up(r, written_at)]
+        if not replicas:
+            return None
+        return self.balancer.choose(replicas)
+
+    def record_write(self, written_at):
+        """Remembers that the client returned by :attr:`sticky_key` committed
+        a write at `written_at`.  Clients whose writes are older than the
+        sticky time are forgotten.
+        """
+        key = self.sticky_key()
+        if key is None:
+            return
+        expired = written_at - self.sticky_time
+        with self._last_writes_lock:
+            last_writes = self._last_writes
+            last_writes.pop(key, None)
+            last_writes[key] = written_at
+            while True:
+                oldest = next(iter(last_writes))
+                if last_writes[oldest] > expired:
+                    break
+                del last_writes[oldest]
+
+    def last_write(self):
+        """Returns when the client returned by :attr:`sticky_key` last
+        committed a write, or `None` if it's longer ago than the sticky
+        time.
+        """
+        key = self.sticky_key()
+        if key is None:
+            return None
+        written_at = self._last_writes.get(key)
+        if written_at is None or time.time() - written_at >= self.sticky_time:
+            return None
+        return written_at
+
+    def invalidate_replicas(self):
+        """Forces the replicas and the balancer to be recreated."""
+        if self._pinger is not None:
+            self._pinger.stop()
+            self._pinger = None
+        self._replicas = None
 
 
 class Model(object):
@@ -788,6 +3550,59 @@ class Model(object):
     #: Equivalent to ``db.session.query(Model)`` unless :attr:`query_class` has been changed.
     query = None
 
+    #: Set to `True` or `False` to decide whether changes to instances of the model are sent with
+    #: :data:`models_committed`, overriding ``SQLALCHEMY_TRACK_MODIFICATIONS_MODELS``.
+    __track_modifications__ = None
+
+    #: Set to a dictionary with the ``ttl`` in seconds (60 by default) and the number of
+    #: ``max_entries`` (1000 by default) to cache instances across requests for :meth:`BaseQuery.get`.
+    __cache__ = None
+
+
+class _Upsert(Insert):
+    """An ``INSERT`` that updates the `update_columns` of the row that
+    already has the values of the `index_elements`.
+    """
+
+    # the extra attributes are not part of the cache key of SQLAlchemy 1.4
+    inherit_cache = False
+
+    def __init__(self, table, index_elements, update_columns):
+        Insert.__init__(self, table)
+        self.index_elements = index_elements
+        self.update_columns = update_columns
+
+
+@compiles(_Upsert)
+def _compile_upsert(element, compiler, **kw):
+    raise CompileError('Upserts are not supported by the %s dialect' %
+                       compiler.dialect.name)
+
+
+@compiles(_Upsert, 'postgresql')
+@compiles(_Upsert, 'sqlite')
+def _compile_on_conflict(element, compiler, **kw):
+    quote = compiler.preparer.quote
+    sql = compiler.visit_insert(element, **kw)
+    target = ', '.join(quote(c.name) for c in element.index_elements)
+    if not element.update_columns:
+        return '%s ON CONFLICT (%s) DO NOTHING' % (sql, target)
+    return '%s ON CONFLICT (%s) DO UPDATE SET %s' % (sql, target, ', '.join(
+        '%s = excluded.%s' % (quote(c.name), quote(c.name))
+        for c in element.update_columns))
+
+
+@compiles(_Upsert, 'mysql')
+def _compile_on_duplicate_key(element, compiler, **kw):
+    quote = compiler.preparer.quote
+    sql = compiler.visit_insert(element, **kw)
+    # MySQL has no way to do nothing, assigning a column to itself is the
+    # usual replacement
+    columns = element.update_columns or element.index_elements[:1]
+    return '%s ON DUPLICATE KEY UPDATE %s' % (sql, ', '.join(
+        '%s = VALUES(%s)' % (quote(c.name), quote(c.name))
+        for c in columns))
+
 
 class SQLAlchemy(object):
     """This class is used to control the SQLAlchemy integration to one
@@ -886,11 +3701,24 @@ class SQLAlchemy(object):
         self.Model = self.make_declarative_base(model_class, metadata)
         self._engine_lock = Lock()
         self.app = app
-        _include_sqlalchemy(self, query_class)
 
         if app is not None:
             self.init_app(app)
 
+    def __getattr__(self, name):
+        # the objects of sqlalchemy and sqlalchemy.orm are looked up when
+        # they are first used instead of being copied to every instance
+        value = _include_sqlalchemy(self, name)
+        setattr(self, name, value)
+        return value
+
+    def __dir__(self):
+        names = set(dir(type(self)))
+        names.update(self.__dict__)
+        names.update(_get_included_names())
+        names.update(('Table', 'event'))
+        return sorted(names)
+
     @property
     def metadata(self):
         """The metadata associated with ``db.Model``."""
@@ -942,6 +3770,7 @@ class SQLAlchemy(object):
             base.query_class = self.Query
 
         base.query = _QueryProperty(self)
+        _SessionSignalEvents.register_base(base)
         return base
 
     def init_app(self, app):
@@ -952,10 +3781,27 @@ class SQLAlchemy(object):
         """
         app.config.setdefault('SQLALCHEMY_DATABASE_URI', 'sqlite://')
         app.config.setdefault('SQLALCHEMY_DATABASE_SLAVE_URIS', None)
+        app.config.setdefault('SQLALCHEMY_DATABASE_SLAVE_WEIGHTS', None)
+        app.config.setdefault('SQLALCHEMY_DATABASE_SLAVE_BALANCER', 'random')
+        app.config.setdefault('SQLALCHEMY_DATABASE_SLAVE_MAX_FAILURES', 3)
+        app.config.setdefault('SQLALCHEMY_DATABASE_SLAVE_EJECT_TIME', 1.0)
+        app.config.setdefault('SQLALCHEMY_DATABASE_SLAVE_MAX_EJECT_TIME', 60.0)
+        app.config.setdefault('SQLALCHEMY_DATABASE_SLAVE_PING_INTERVAL', None)
+        app.config.setdefault('SQLALCHEMY_DATABASE_SLAVE_STICKY_TIME', None)
+        app.config.setdefault('SQLALCHEMY_DATABASE_SLAVE_STICKY_KEY', None)
+        app.config.setdefault('SQLALCHEMY_DATABASE_SLAVE_LAG_PROBE', None)
         app.config.setdefault('SQLALCHEMY_BINDS', None)
         app.config.setdefault('SQLALCHEMY_NATIVE_UNICODE', None)
         app.config.setdefault('SQLALCHEMY_ECHO', False)
         app.config.setdefault('SQLALCHEMY_RECORD_QUERIES', None)
+        app.config.setdefault('SQLALCHEMY_RECORD_QUERIES_SAMPLE_RATE', 1.0)
+        app.config.setdefault('SQLALCHEMY_RECORD_QUERIES_MAX', None)
+        app.config.setdefault('SQLALCHEMY_RECORD_QUERIES_REPEAT_THRESHOLD', None)
+        app.config.setdefault('SQLALCHEMY_METRICS', False)
+        app.config.setdefault('SQLALCHEMY_METRICS_BUCKETS', (
+            0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0))
+        app.config.setdefault('SQLALCHEMY_SLOW_QUERY_THRESHOLD', None)
+        app.config.setdefault('SQLALCHEMY_PAGINATION_TOTAL', 'exact')
         app.config.setdefault('SQLALCHEMY_POOL_SIZE', None)
         app.config.setdefault('SQLALCHEMY_POOL_TIMEOUT', None)
         app.config.setdefault('SQLALCHEMY_POOL_RECYCLE', None)
@@ -963,6 +3809,15 @@ class SQLAlchemy(object):
         app.config.setdefault('SQLALCHEMY_COMMIT_ON_TEARDOWN', False)
         app.config.setdefault('SQLALCHEMY_USING_NULLPOOL', False)
         track_modifications = app.config.setdefault('SQLALCHEMY_TRACK_MODIFICATIONS', None)
+        app.config.setdefault('SQLALCHEMY_TRACK_MODIFICATIONS_MODELS', None)
+        app.config.setdefault('SQLALCHEMY_ASYNC_SIGNALS', False)
+        app.config.setdefault('SQLALCHEMY_ASYNC_SIGNALS_QUEUE_SIZE', 1000)
+        app.config.setdefault('SQLALCHEMY_ASYNC_SIGNALS_WINDOW', 0.1)
+        app.config.setdefault('SQLALCHEMY_STATEMENT_CACHE_SIZE', 200)
+        app.config.setdefault('SQLALCHEMY_IDENTITY_CACHE', 'memory')
+        app.config.setdefault('SQLALCHEMY_IDENTITY_CACHE_PATH', None)
+        app.config.setdefault('SQLALCHEMY_RESULT_CACHE_SIZE', 1000)
+        app.config.setdefault('SQLALCHEMY_DDL_WORKERS', None)
 
         if track_modifications is None:
             warnings.warn('SQLALCHEMY_TRACK_MODIFICATIONS adds significant overhead and will be disabled by default in the future.  Set it to True or False to suppress this warning.')
@@ -1071,20 +3926,166 @@ class SQLAlchemy(object):
         """Creates the connector for a given state and bind."""
         return _EngineConnector(self, self.get_app(app), bind)
 
+    def make_balancer(self, app=None):
+        """Creates the :class:`ReplicaBalancer` for an application from the
+        ``SQLALCHEMY_DATABASE_SLAVE_BALANCER`` configuration key, which is
+        either the name of a builtin balancer, a balancer class or an
+        instance.  Override this to configure the builtin balancers.
+
+        .. versionadded:: 3.0
+        """
+        return _make_plugin(
+            self.get_app(app).config['SQLALCHEMY_DATABASE_SLAVE_BALANCER'],
+            _balancers, 'balancer')
+
+    def make_lag_probe(self, app=None):
+        """Creates the :class:`ReplicationLagProbe` for an application from
+        the ``SQLALCHEMY_DATABASE_SLAVE_LAG_PROBE`` configuration key, which
+        works like the one for :meth:`make_balancer`.  Returns `None` if no
+        probe is configured.
+
+        .. versionadded:: 3.0
+        """
+        return _make_plugin(
+            self.get_app(app).config['SQLALCHEMY_DATABASE_SLAVE_LAG_PROBE'],
+            _lag_probes, 'lag probe')
+
+    def make_pagination_total(self, app=None):
+        """Creates the :class:`PaginationTotal` for an application from the
+        ``SQLALCHEMY_PAGINATION_TOTAL`` configuration key, which works like
+        the one for :meth:`make_balancer`.
+
+        .. versionadded:: 3.0
+        """
+        return _make_plugin(
+            self.get_app(app).config['SQLALCHEMY_PAGINATION_TOTAL'],
+            _pagination_totals, 'pagination total')
+
+    def make_identity_cache(self, app=None):
+        """Creates the :class:`IdentityCache` for an application from the
+        ``SQLALCHEMY_IDENTITY_CACHE`` configuration key, which works like
+        the one for :meth:`make_balancer`.  ``'file'`` creates a
+        :class:`FileIdentityCache` in ``SQLALCHEMY_IDENTITY_CACHE_PATH``.
+
+        .. versionadded:: 3.0
+        """
+        config = self.get_app(app).config
+        value = config['SQLALCHEMY_IDENTITY_CACHE']
+        if value == 'file':
+            path = config['SQLALCHEMY_IDENTITY_CACHE_PATH']
+            assert path is not None, 'The file identity cache needs a ' \
+                'directory.  Set it in the SQLALCHEMY_IDENTITY_CACHE_PATH ' \
+                'configuration variable'
+            return FileIdentityCache(path)
+        return _make_plugin(value, _identity_caches, 'identity cache')
+
     def get_engine(self, app=None, bind=None):
         """Returns a specific engine."""
 
         app = self.get_app(app)
         state = get_state(app)
 
-        with self._engine_lock:
+        connector = state.connectors.get(bind)
+        if connector is None:
+            with self._engine_lock:
+                connector = state.connectors.get(bind)
+                if connector is None:
+                    connector = self.make_connector(app, bind)
+                    state.connectors[bind] = connector
+
+        return connector.get_engine()
+
+    def reconfigure(self, bind='__all__', app=None):
+        """Engines are created once and then reused without looking at the
+        configuration again.  If ``SQLALCHEMY_DATABASE_URI``,
+        ``SQLALCHEMY_BINDS`` or ``SQLALCHEMY_ECHO`` are changed at runtime
+        this has to be called to recreate the affected engines.  The `bind`
+        parameter works like the one of :meth:`create_all`.
+        """
+        app = self.get_app(app)
+        state = get_state(app)
+
+        if bind == '__all__':
+            binds = list(state.connectors)
+        elif isinstance(bind, string_types) or bind is None:
+            binds = [bind]
+        else:
+            binds = bind
+
+        for bind in binds:
             connector = state.connectors.get(bind)
+            if connector is not None:
+                connector.reconfigure()
+        state.invalidate_binds()
+        state.invalidate_replicas()
+
+    def get_replicas(self, app=None):
+        """Returns the :class:`Replica` objects for the read replicas of an
+        application.  Their :attr:`~Replica.status` can be used to monitor
+        which replicas are ejected.
+
+        .. versionadded:: 3.0
+        """
+        return get_state(self.get_app(app)).get_replicas()
+
+    def flush_signals(self, app=None):
+        """Waits until the :data:`models_committed` signals of all commits
+        so far were sent when ``SQLALCHEMY_ASYNC_SIGNALS`` is enabled, for
+        example in tests.  This also happens when the interpreter exits.
+
+        .. versionadded:: 3.0
+        """
+        dispatcher = get_state(self.get_app(app))._signal_dispatcher
+        if dispatcher is not None:
+            dispatcher.flush()
+
+    def get_statement_cache(self, app=None):
+        """Returns the :class:`StatementCache` of
+        :meth:`BaseQuery.cached_statement`, whose ``hits`` and ``misses``
+        help choosing ``SQLALCHEMY_STATEMENT_CACHE_SIZE``.
+
+        .. versionadded:: 3.0
+        """
+        return get_state(self.get_app(app)).get_statement_cache()
+
+    def get_result_cache(self, app=None):
+        """Returns the :class:`ResultCache` of :meth:`BaseQuery.cache`,
+        whose :attr:`~ResultCache.hit_ratio` and
+        :attr:`~ResultCache.memory` help choosing
+        ``SQLALCHEMY_RESULT_CACHE_SIZE``.
 
-            if connector is None:
-                connector = self.make_connector(app, bind)
-                state.connectors[bind] = connector
+        .. versionadded:: 3.0
+        """
+        return get_state(self.get_app(app)).get_result_cache()
+
+    def get_metrics(self, app=None):
+        """Returns the :class:`EngineMetrics` of all binds that were
+        connected so far, keyed by bind key.  The default bind has the key
+        `None`.  Empty unless ``SQLALCHEMY_METRICS`` is enabled.
+
+        .. versionadded:: 3.0
+        """
+        state = get_state(self.get_app(app))
+        with self._engine_lock:
+            connectors = list(iteritems(state.connectors))
+        return dict((bind, connector.metrics) for bind, connector
+                    in connectors if connector.metrics is not None)
+
+    def export_metrics(self, app=None, prefix='flask_sqlalchemy_'):
+        """Returns the metrics of :meth:`get_metrics` in the text format
+        understood by Prometheus, for example to serve them from a view::
 
-            return connector.get_engine()
+            @app.route('/metrics')
+            def metrics():
+                return db.export_metrics(), 200, {
+                    'Content-Type': 'text/plain; version=0.0.4'}
+
+        .. versionadded:: 3.0
+        """
+        metrics = self.get_metrics(app)
+        return _format_metrics(
+            [metrics[bind] for bind in sorted(metrics, key=lambda b: b or '')],
+            prefix)
 
     def get_app(self, reference_app=None):
         """Helper method that implements the logic to look up an application."""
@@ -1121,6 +4122,118 @@ class SQLAlchemy(object):
             retval.update(dict((table, engine) for table in tables))
         return retval
 
+    def bulk_insert(self, model, rows, chunk_size=1000, app=None,
+                    send_signals=False):
+        """Inserts many rows of a model at once, bypassing the session.
+        ``rows`` are dictionaries keyed by attribute name or model
+        instances.  They are inserted ``chunk_size`` at a time with
+        ``executemany``, in a transaction of their own on the engine of the
+        model's bind.  Rows work best if they all set the same attributes,
+        each change in the set of attributes starts another
+        ``executemany``.
+
+        Column defaults are applied, but nothing that the unit of work does
+        for instances happens: instances are not added to a session and
+        don't get their primary key, relationships are ignored and no ORM
+        events are sent.  If ``send_signals`` is `True` and
+        ``SQLALCHEMY_TRACK_MODIFICATIONS`` is enabled,
+        :data:`before_models_committed` and :data:`models_committed` are
+        sent once with ``(model, 'insert')`` as the only change, the model
+        class standing in for the inserted instances.
+
+        Models with joined table inheritance raise :exc:`ValueError` as
+        their rows span several tables.
+
+        Returns the number of rows.
+
+        .. versionadded:: 3.0
+        """
+        table = orm.class_mapper(model).local_table
+        statement = table.insert()
+        return self._execute_bulk(app, model, rows, chunk_size, send_signals,
+                                  'insert', lambda keys: statement)
+
+    def bulk_upsert(self, model, rows, chunk_size=1000, app=None,
+                    index_elements=None, update=None, send_signals=False):
+        """Like :meth:`bulk_insert` but rows that conflict with an existing
+        row on the ``index_elements`` attributes (the primary key by
+        default) update that row instead.  ``update`` is the list of
+        attributes that are updated, by default all the attributes set in
+        the row except the ``index_elements``.  An empty list leaves
+        existing rows alone.
+
+        This uses ``ON CONFLICT`` on PostgreSQL and SQLite (3.24 or later)
+        and ``ON DUPLICATE KEY UPDATE`` on MySQL, where the conflict is
+        found by any unique key instead.  Other databases raise
+        :exc:`~sqlalchemy.exc.CompileError`.  Signals are sent with
+        ``(model, 'upsert')`` as the change.
+
+        .. versionadded:: 3.0
+        """
+        mapper = orm.class_mapper(model)
+        columns = _bulk_columns(mapper)
+        if index_elements is None:
+            index_elements = list(mapper.primary_key)
+        else:
+            index_elements = [columns[key] for key in index_elements]
+        if update is not None:
+            update = [columns[key] for key in update]
+
+        def statement_for(keys):
+            update_columns = update
+            if update_columns is None:
+                update_columns = [c for c in itervalues(columns)
+                                  if c.key in keys and c not in index_elements]
+            return _Upsert(mapper.local_table, index_elements, update_columns)
+
+        return self._execute_bulk(app, model, rows, chunk_size, send_signals,
+                                  'upsert', statement_for)
+
+    def _execute_bulk(self, app, model, rows, chunk_size, send_signals,
+                      operation, statement_for):
+        app = self.get_app(app)
+        mapper = orm.class_mapper(model)
+        columns = _bulk_columns(mapper)
+        engine = self.get_engine(app, mapper.local_table.info.get('bind_key'))
+        changes = [(model, operation)]
+        if send_signals:
+            # the same rule as SignallingSession: None means enabled
+            track = app.config['SQLALCHEMY_TRACK_MODIFICATIONS']
+            send_signals = (track is None or bool(track)) and \
+                get_state(app).tracks_model(model)
+        statements = {}
+
+        def keys_of(row):
+            return tuple(sorted(row))
+
+        rows = iter(rows)
+        count = 0
+        with engine.begin() as connection:
+            while True:
+                chunk = [_bulk_row(columns, row)
+                         for row in itertools.islice(rows, chunk_size)]
+                if not chunk:
+                    break
+                # executemany needs the same parameters in every row
+                for keys, group in itertools.groupby(chunk, keys_of):
+                    statement = statements.get(keys)
+                    if statement is None:
+                        statement = statements[keys] = statement_for(keys)
+                    connection.execute(statement, list(group))
+                count += len(chunk)
+            if count and send_signals:
+                before_models_committed.send(app, changes=changes)
+        if count and send_signals:
+            models_committed.send(app, changes=changes)
+        if count:
+            state = get_state(app)
+            if state._result_cache is not None:
+                state._result_cache.invalidate(*_table_tags(mapper))
+            if operation == 'upsert' and _cache_options(model):
+                state.get_identity_cache().clear(
+                    state.get_cache_region(mapper))
+        return count
+
     def _execute_for_all_tables(self, app, bind, operation, skip_tables=False):
         app = self.get_app(app)
 
@@ -1131,19 +4244,94 @@ class SQLAlchemy(object):
         else:
             binds = bind
 
+        workers = app.config['SQLALCHEMY_DDL_WORKERS']
+        if workers and workers > 1 and len(binds) > 1:
+            return self._execute_concurrently(app, list(binds), operation,
+                                              skip_tables, workers)
+
+        for bind in binds:
+            self._execute_for_bind(app, bind, operation, skip_tables)
+
+    def _execute_for_bind(self, app, bind, operation, skip_tables,
+                          metadata=None):
+        extra = {}
+        if not skip_tables:
+            tables = self.get_tables_for_bind(bind)
+            extra['tables'] = tables
+        op = getattr(metadata or self.Model.metadata, operation)
+        op(bind=self.get_engine(app, bind), **extra)
+
+    def _execute_concurrently(self, app, binds, operation, skip_tables,
+                              workers):
+        """Runs the operation for every bind on up to `workers` threads.
+        Each bind still creates and drops its tables in the order of their
+        foreign keys.  Tables are reflected into a metadata per bind, as
+        the models' metadata can't be changed from several threads, and
+        added to it afterwards.
+
+        In-memory SQLite databases are handled by the calling thread, as
+        every thread has a database of its own.
+        """
+        pending = Queue()
+        local = []
+        for bind in binds:
+            url = self.get_engine(app, bind).url
+            if url.drivername.startswith('sqlite') and \
+                    url.database in (None, '', ':memory:'):
+                local.append(bind)
+            else:
+                pending.put(bind)
+        existing = set(self.Model.metadata.tables)
+        reflected = {}
+        errors = {}
+
+        def execute(bind):
+            try:
+                if operation == 'reflect':
+                    metadata = reflected[bind] = sqlalchemy.MetaData()
+                    metadata.reflect(
+                        bind=self.get_engine(app, bind),
+                        only=lambda name, metadata: name not in existing)
+                else:
+                    self._execute_for_bind(app, bind, operation, skip_tables)
+            except Exception as e:
+                errors[bind] = e
+
+        def run():
+            while True:
+                try:
+                    bind = pending.get_nowait()
+                except Empty:
+                    return
+                execute(bind)
+
+        threads = [Thread(target=run, name='flask_sqlalchemy ' + operation)
+                   for _ in xrange(min(workers, pending.qsize()))]
+        for thread in threads:
+            thread.start()
+        for bind in local:
+            execute(bind)
+        for thread in threads:
+            thread.join()
+
+        metadata = self.Model.metadata
         for bind in binds:
-            extra = {}
-            if not skip_tables:
-                tables = self.get_tables_for_bind(bind)
-                extra['tables'] = tables
-            op = getattr(self.Model.metadata, operation)
-            op(bind=self.get_engine(app, bind), **extra)
+            if bind in reflected and bind not in errors:
+                for table in reflected[bind].sorted_tables:
+                    if table.key not in metadata.tables:
+                        table.tometadata(metadata)
+        if errors:
+            raise BindErrors(errors)
 
     def create_all(self, bind='__all__', app=None):
         """Creates all tables.
 
         .. versionchanged:: 0.12
            Parameters were added
+
+        .. versionchanged:: 3.0
+           Binds are handled concurrently if ``SQLALCHEMY_DDL_WORKERS`` is
+           set, see :class:`BindErrors`.
         """
         self._execute_for_all_tables(app, bind, 'create_all')
 
@@ -1152,6 +4340,10 @@ class SQLAlchemy(object):
 
         .. versionchanged:: 0.12
            Parameters were added
+
+        .. versionchanged:: 3.0
+           Binds are handled concurrently if ``SQLALCHEMY_DDL_WORKERS`` is
+           set, see :class:`BindErrors`.
         """
         self._execute_for_all_tables(app, bind, 'drop_all')
 
@@ -1160,6 +4352,10 @@ class SQLAlchemy(object):
 
         .. versionchanged:: 0.12
            Parameters were added
+
+        .. versionchanged:: 3.0
+           Binds are handled concurrently if ``SQLALCHEMY_DDL_WORKERS`` is
+           set, see :class:`BindErrors`.
         """
         self._execute_for_all_tables(app, bind, 'reflect', skip_tables=True)
 
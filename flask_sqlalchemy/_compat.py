@@ -25,6 +25,8 @@ if PY2:
 
     string_types = (unicode, bytes)
 
+    from Queue import Queue, Empty
+
 else:
     def iteritems(d):
         return iter(d.items())
@@ -35,3 +37,5 @@ else:
     xrange = range
 
     string_types = (str, )
+
+    from queue import Queue, Empty
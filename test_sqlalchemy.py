@@ -1,13 +1,20 @@
 from __future__ import with_statement
 
 import atexit
+import os
+import sys
+import time
+import warnings
 import unittest
-from datetime import datetime
+from datetime import datetime, timedelta
 import flask
 import flask_sqlalchemy as sqlalchemy
+from flask_sqlalchemy import _timer
 from sqlalchemy import MetaData, event
+from sqlalchemy.exc import OperationalError
 from sqlalchemy.ext.declarative import declared_attr
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.util import timezone
 
 
 def make_todo_model(db):
@@ -27,6 +34,19 @@ def make_todo_model(db):
     return Todo
 
 
+def make_todo_app(titles=(), **config):
+    app = flask.Flask(__name__)
+    app.config.update(config)
+    db = sqlalchemy.SQLAlchemy(app)
+    Todo = make_todo_model(db)
+    db.create_all()
+    if titles:
+        with app.app_context():
+            db.session.add_all([Todo(title, '') for title in titles])
+            db.session.commit()
+    return app, db, Todo
+
+
 class BasicAppTestCase(unittest.TestCase):
 
     def setUp(self):
@@ -82,6 +102,231 @@ class BasicAppTestCase(unittest.TestCase):
         self.assertEqual(self.db.metadata, self.db.Model.metadata)
 
 
+class QueryRecordingTestCase(unittest.TestCase):
+
+    def test_max_queries(self):
+        app, db, Todo = make_todo_app(TESTING=True,
+                                      SQLALCHEMY_RECORD_QUERIES_MAX=2)
+        with app.test_request_context():
+            for i in range(3):
+                Todo.query.filter_by(title=str(i)).all()
+            queries = sqlalchemy.get_debug_queries()
+            self.assertEqual(len(queries), 2)
+            self.assertEqual([q.parameters[0] for q in queries], ['1', '2'])
+
+    def test_sample_rate(self):
+        app, db, Todo = make_todo_app(
+            TESTING=True, SQLALCHEMY_RECORD_QUERIES_SAMPLE_RATE=0)
+        with app.test_request_context():
+            Todo.query.all()
+            self.assertEqual(sqlalchemy.get_debug_queries(), [])
+
+        app, db, Todo = make_todo_app(
+            TESTING=True, SQLALCHEMY_RECORD_QUERIES_SAMPLE_RATE=0.5)
+        with app.test_request_context():
+            for _ in range(200):
+                Todo.query.all()
+            recorded = len(sqlalchemy.get_debug_queries())
+            self.assertTrue(0 < recorded < 200)
+
+    def test_lazy_context(self):
+        app, db, Todo = make_todo_app(TESTING=True)
+        with app.test_request_context():
+            Todo.query.all()
+            query = sqlalchemy.get_debug_queries()[0]
+            # only the code object and line are kept until it is read
+            code, lineno = query[4]
+            self.assertEqual(code.co_name, 'test_lazy_context')
+            self.assertTrue('test_lazy_context' in query.context)
+            self.assertTrue(':%d ' % lineno in query.context)
+
+    def test_call_site_cache(self):
+        app, db, Todo = make_todo_app(TESTING=True)
+        with app.test_request_context():
+            for _ in range(2):
+                Todo.query.all()
+            first, second = sqlalchemy.get_debug_queries()
+            self.assertEqual(first[4], second[4])
+            self.assertTrue(first.context is second.context)
+
+        resolver = sqlalchemy._CallSiteResolver(__name__)
+        code, lineno = resolver()
+        self.assertEqual(code.co_name, 'test_call_site_cache')
+        self.assertTrue(resolver._matches[code])
+        self.assertFalse(any(resolver._matches[c] for c in resolver._matches
+                             if c is not code))
+        self.assertEqual(sqlalchemy._CallSiteResolver('nonexistent')(), None)
+
+    def test_query_stats(self):
+        app, db, Todo = make_todo_app(TESTING=True)
+        with app.test_request_context():
+            for i in range(5):
+                Todo.query.filter_by(title=str(i)).all()
+            for i in range(2):
+                db.session.execute("SELECT * FROM todos WHERE title = '%d'" % i)
+            db.session.execute("SELECT * FROM todos WHERE title = 'x'")
+            stats = sqlalchemy.get_debug_query_stats()
+            self.assertEqual(sorted(g.count for g in stats), [1, 2, 5])
+            group = [g for g in stats if g.count == 5][0]
+            self.assertTrue('test_query_stats' in group.context)
+            self.assertTrue('?' in group.fingerprint)
+            durations = sorted(q.duration for q in group.queries)
+            self.assertEqual(group.p50, durations[2])
+            self.assertEqual(group.p99, durations[4])
+            self.assertAlmostEqual(group.total, sum(durations))
+            # literals are stripped, the raw statements differ by site
+            raw = [g for g in stats if g.count < 5]
+            self.assertEqual(raw[0].fingerprint, raw[1].fingerprint)
+            self.assertNotEqual(raw[0].context, raw[1].context)
+
+    def test_fingerprint(self):
+        fingerprint = sqlalchemy._fingerprint
+        self.assertEqual(
+            fingerprint("SELECT a FROM t WHERE b = 'it''s' AND c IN (1, 2,\n 3)"),
+            'SELECT a FROM t WHERE b = ? AND c IN (?)')
+        self.assertEqual(fingerprint('SELECT x::int FROM t WHERE y = :y_1'),
+                         'SELECT x::int FROM t WHERE y = ?')
+        self.assertEqual(fingerprint('SELECT t1.a FROM t1 WHERE a = %(a)s'),
+                         'SELECT t1.a FROM t1 WHERE a = ?')
+
+    def test_repeated_queries(self):
+        app, db, Todo = make_todo_app(
+            TESTING=True, SQLALCHEMY_RECORD_QUERIES_REPEAT_THRESHOLD=3)
+        reported = []
+
+        def on_repeated(sender, fingerprint, context, count):
+            reported.append((sender, fingerprint, context, count))
+
+        with sqlalchemy.repeated_queries.connected_to(on_repeated,
+                                                      sender=app):
+            with warnings.catch_warnings(record=True) as caught:
+                warnings.simplefilter('always')
+                def load(ids):
+                    for i in ids:
+                        Todo.query.get(i)
+
+                with app.test_request_context():
+                    load(range(3))
+                    self.assertEqual(reported, [])
+                    load(range(3, 6))
+                with app.test_request_context():
+                    load(range(3))
+
+        self.assertEqual(len(reported), 1)
+        sender, fingerprint, context, count = reported[0]
+        self.assertTrue(sender is app)
+        self.assertTrue('(load)' in context)
+        self.assertEqual(count, 4)
+        caught = [w for w in caught
+                  if issubclass(w.category, sqlalchemy.RepeatedQueriesWarning)]
+        self.assertEqual(len(caught), 1)
+        self.assertEqual(caught[0].filename, __file__.rstrip('c'))
+
+
+class _QueuePoolSQLAlchemy(sqlalchemy.SQLAlchemy):
+    """Pools connections to SQLite files, which otherwise use a NullPool."""
+
+    def apply_driver_hacks(self, app, info, options):
+        from sqlalchemy.pool import QueuePool
+        sqlalchemy.SQLAlchemy.apply_driver_hacks(self, app, info, options)
+        options['poolclass'] = QueuePool
+
+
+class MetricsTestCase(unittest.TestCase):
+
+    def test_disabled(self):
+        app, db, Todo = make_todo_app()
+        Todo.query.all()
+        self.assertEqual(db.get_metrics(), {})
+        self.assertEqual(db.export_metrics(), db.export_metrics())
+
+    def test_histogram(self):
+        app, db, Todo = make_todo_app(SQLALCHEMY_METRICS=True,
+                                      SQLALCHEMY_METRICS_BUCKETS=(10, 0))
+        metrics = db.get_metrics()[None]
+        self.assertEqual(metrics.buckets, (0, 10))
+        before = metrics.queries
+        for _ in range(3):
+            Todo.query.all()
+        self.assertEqual(metrics.queries, before + 3)
+        self.assertEqual(metrics.bucket_counts[0], 0)
+        self.assertEqual(metrics.bucket_counts[1], metrics.queries)
+        self.assertEqual(metrics.bucket_counts[2], 0)
+        self.assertTrue(metrics.query_time > 0)
+        self.assertTrue(metrics.checkouts > 0)
+        self.assertEqual(metrics.slow_queries, 0)
+
+        # the metrics of a bind are kept when the engine is replaced
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///'
+        db.reconfigure()
+        self.assertTrue(db.get_metrics()[None] is metrics)
+        self.assertTrue(metrics.engine is db.engine)
+
+    def test_slow_query(self):
+        app, db, Todo = make_todo_app(SQLALCHEMY_SLOW_QUERY_THRESHOLD=0)
+        reported = []
+
+        def on_slow_query(sender, statement, parameters, duration, bind):
+            reported.append((sender, statement, bind))
+
+        with sqlalchemy.slow_query.connected_to(on_slow_query, sender=app):
+            Todo.query.all()
+        self.assertEqual(len(reported), 1)
+        sender, statement, bind = reported[0]
+        self.assertTrue(sender is app)
+        self.assertTrue(statement.startswith('SELECT'))
+        self.assertEqual(bind, None)
+        self.assertTrue(db.get_metrics()[None].slow_queries > 0)
+
+    def test_pool(self):
+        import tempfile
+        _, path = tempfile.mkstemp()
+        self.addCleanup(os.remove, path)
+        app = flask.Flask(__name__)
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + path
+        app.config['SQLALCHEMY_POOL_SIZE'] = 1
+        app.config['SQLALCHEMY_MAX_OVERFLOW'] = 1
+        app.config['SQLALCHEMY_METRICS'] = True
+        db = _QueuePoolSQLAlchemy(app)
+        engine = db.engine
+        metrics = db.get_metrics()[None]
+
+        first = engine.connect()
+        second = engine.connect()
+        self.assertEqual(metrics.checkouts, 2)
+        self.assertEqual(metrics.overflow_checkouts, 1)
+        self.assertEqual(metrics.checked_out, 2)
+        self.assertEqual(metrics.overflow, 1)
+        self.assertTrue(metrics.checkout_wait > 0)
+        first.close()
+        second.close()
+        self.assertEqual(metrics.checked_out, 0)
+
+        # the pool is replaced when the engine is disposed
+        engine.dispose()
+        wait = metrics.checkout_wait
+        engine.connect().close()
+        self.assertTrue(metrics.checkout_wait > wait)
+
+    def test_export(self):
+        app, db, Todo = make_todo_app(
+            SQLALCHEMY_METRICS=True,
+            SQLALCHEMY_METRICS_BUCKETS=(0.5, 10),
+            SQLALCHEMY_BINDS={'users': 'sqlite://'})
+        db.get_engine(app, 'users').execute('SELECT 1')
+        metrics = db.get_metrics()
+        text = db.export_metrics(prefix='db_')
+        lines = text.splitlines()
+        self.assertTrue('# TYPE db_query_duration_seconds histogram' in lines)
+        self.assertTrue('db_query_duration_seconds_count{bind="users"} 1'
+                        in lines)
+        self.assertTrue('db_query_duration_seconds_bucket{bind="default",'
+                        'le="+Inf"} %d' % metrics[None].queries in lines)
+        self.assertTrue('db_pool_checkouts_total{bind="users"} %d'
+                        % metrics['users'].checkouts in lines)
+        self.assertTrue(text.endswith('\n'))
+
+
 class MetaDataTestCase(unittest.TestCase):
 
     def setUp(self):
@@ -173,6 +418,81 @@ class TestQueryProperty(unittest.TestCase):
         db.session.commit()
         self.assertEqual(len(Todo.query.all()), 1)
 
+    def test_prototype(self):
+        db = sqlalchemy.SQLAlchemy(self.app)
+        Todo = make_todo_model(db)
+        db.create_all()
+
+        query = Todo.query
+        self.assertFalse(query is Todo.query)
+        self.assertTrue(query.session is db.session())
+        db.session.remove()
+        self.assertTrue(Todo.query.session is db.session())
+        self.assertFalse(query.session is db.session())
+        self.assertEqual(Todo.query.filter_by(title='Test').count(), 0)
+
+        class CustomQuery(sqlalchemy.BaseQuery):
+            pass
+
+        Todo.query_class = CustomQuery
+        self.assertTrue(isinstance(Todo.query, CustomQuery))
+
+        class Base(db.Model):
+            __abstract__ = True
+
+        self.assertTrue(Base.query is None)
+
+        # a mapper added later can change the entities of the query
+        class Page(Todo):
+            __tablename__ = None
+
+        self.assertTrue(isinstance(Page.query, CustomQuery))
+        self.assertFalse(Todo in db.Model.__dict__['query'].prototypes)
+
+        # prototypes belong to the property and don't keep models alive
+        import gc
+        prototypes = db.Model.__dict__['query'].prototypes
+        self.assertTrue(Page in prototypes)
+        self.assertFalse(prototypes is
+                         sqlalchemy.SQLAlchemy().Model.__dict__['query']
+                         .prototypes)
+        class Abstract(db.Model):
+            __abstract__ = True
+
+        self.assertTrue(Abstract.query is None)
+        self.assertTrue(Abstract in prototypes)
+        del Abstract
+        gc.collect()
+        self.assertEqual(list(prototypes), [Page])
+
+    def test_cached_statement(self):
+        self.app.config['SQLALCHEMY_STATEMENT_CACHE_SIZE'] = 10
+        db = sqlalchemy.SQLAlchemy(self.app)
+        Todo = make_todo_model(db)
+        db.create_all()
+        db.session.add_all([Todo('a', 'first'), Todo('b', 'second')])
+        db.session.commit()
+
+        def by_title(title):
+            return Todo.query.cached_statement(
+                lambda q: q.filter_by(title=db.bindparam('title'))
+            ).params(title=title).one().text
+
+        cache = db.get_statement_cache()
+        self.assertEqual(cache.capacity, 10)
+        self.assertEqual(by_title('a'), 'first')
+        self.assertEqual((cache.hits, cache.misses), (0, 2))
+        self.assertEqual(by_title('b'), 'second')
+        self.assertEqual((cache.hits, cache.misses), (2, 2))
+        self.assertEqual(
+            Todo.query.cached_statement(
+                lambda q: q.order_by(Todo.title.desc())).first().text,
+            'second')
+        self.assertEqual((cache.hits, cache.misses), (2, 4))
+
+        self.assertRaises(ValueError, Todo.query.filter_by(title='a')
+                          .cached_statement)
+
 
 class SignallingTestCase(unittest.TestCase):
 
@@ -227,6 +547,258 @@ class SignallingTestCase(unittest.TestCase):
             self.assertEqual(recorded[0][0], todo)
             self.assertEqual(recorded[0][1], 'delete')
 
+    def test_incremental_tracking(self):
+        recorded = []
+
+        def before_committed(sender, changes):
+            recorded.append(('before', sorted(op for _, op in changes)))
+
+        def committed(sender, changes):
+            recorded.append(('after', sorted(op for _, op in changes)))
+
+        session = self.db.session
+        with sqlalchemy.before_models_committed.connected_to(
+                before_committed, sender=self.app):
+            with sqlalchemy.models_committed.connected_to(committed,
+                                                          sender=self.app):
+                todos = []
+                for i in range(3):
+                    todos.append(self.Todo(str(i), ''))
+                    session.add(todos[-1])
+                    session.flush()
+                    # inserted in this transaction, stays an insert
+                    todos[0].text = str(i)
+                    session.flush()
+                # not flushed yet, but known before the commit
+                todos[1].done = True
+                session.commit()
+                self.assertEqual(recorded, [('before', ['insert'] * 3),
+                                            ('after', ['insert'] * 3)])
+
+                del recorded[:]
+                todos[0].text = 'changed'
+                session.delete(todos[1])
+                session.flush()
+                session.rollback()
+                todos[2].text = 'changed'
+                session.commit()
+                self.assertEqual(recorded, [('before', ['update']),
+                                            ('after', ['update'])])
+
+    def test_commit_does_not_flush_early(self):
+        session = self.db.session
+        pending = []
+
+        def before_committed(sender, changes):
+            pending.extend(target in session.new for target, _ in changes)
+
+        with sqlalchemy.before_models_committed.connected_to(
+                before_committed, sender=self.app):
+            session.add(self.Todo('', ''))
+            session.commit()
+        self.assertEqual(pending, [True])
+
+    def test_listeners_per_base(self):
+        from sqlalchemy.ext.declarative import declarative_base
+        Base = declarative_base()
+
+        class Other(Base):
+            __tablename__ = 'other'
+            __track_modifications__ = True
+            id = self.db.Column(self.db.Integer, primary_key=True)
+
+        Base.metadata.create_all(self.db.engine)
+        recorded = []
+
+        def committed(sender, changes):
+            recorded.extend(changes)
+
+        with sqlalchemy.before_models_committed.connected_to(
+                committed, sender=self.app):
+            with sqlalchemy.models_committed.connected_to(committed,
+                                                          sender=self.app):
+                todo = self.Todo('', '')
+                self.db.session.add_all([todo, Other()])
+                self.db.session.commit()
+        # pending before the commit and written by it
+        self.assertEqual(recorded, [(todo, 'insert')] * 2)
+
+    def test_unregister(self):
+        session = self.db.session()
+        with warnings.catch_warnings(record=True) as w:
+            warnings.simplefilter('always')
+            sqlalchemy._SessionSignalEvents.unregister(session)
+        self.assertEqual(w[0].category, DeprecationWarning)
+        recorded = []
+
+        def committed(sender, changes):
+            recorded.extend(changes)
+
+        with sqlalchemy.models_committed.connected_to(committed,
+                                                      sender=self.app):
+            session.add(self.Todo('', ''))
+            session.commit()
+        self.assertEqual(recorded, [])
+
+    def test_tracked_models(self):
+        self.app.config['SQLALCHEMY_TRACK_MODIFICATIONS_MODELS'] = ['Tag']
+        db = self.db
+
+        class Tag(db.Model):
+            id = db.Column(db.Integer, primary_key=True)
+
+        class SpecialTag(Tag):
+            pass
+
+        db.create_all()
+        recorded = []
+
+        def committed(sender, changes):
+            recorded.extend(changes)
+
+        with sqlalchemy.models_committed.connected_to(committed,
+                                                      sender=self.app):
+            tag, special = Tag(), SpecialTag()
+            db.session.add_all([self.Todo('', ''), tag, special])
+            db.session.commit()
+        self.assertEqual(sorted(recorded, key=lambda c: c[0] is special),
+                         [(tag, 'insert'), (special, 'insert')])
+
+    def test_track_modifications_opt_in(self):
+        self.app.config['SQLALCHEMY_TRACK_MODIFICATIONS_MODELS'] = []
+        db = self.db
+
+        class Tag(db.Model):
+            __track_modifications__ = True
+            id = db.Column(db.Integer, primary_key=True)
+
+        db.create_all()
+        recorded = []
+
+        def committed(sender, changes):
+            recorded.extend(changes)
+
+        with sqlalchemy.models_committed.connected_to(committed,
+                                                      sender=self.app):
+            db.session.add(self.Todo('', ''))
+            db.session.commit()
+            # nothing is collected for sessions without tracked models
+            self.assertEqual(db.session()._model_changes, None)
+            self.assertEqual(recorded, [])
+
+            tag = Tag()
+            db.session.add_all([self.Todo('', ''), tag])
+            db.session.commit()
+            self.assertEqual(recorded, [(tag, 'insert')])
+
+
+class AsyncSignalsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.app = app = flask.Flask(__name__)
+        app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = True
+        app.config['SQLALCHEMY_ASYNC_SIGNALS'] = True
+        app.config['SQLALCHEMY_ASYNC_SIGNALS_WINDOW'] = 0
+        self.db = sqlalchemy.SQLAlchemy(app)
+        self.Todo = make_todo_model(self.db)
+        self.db.create_all()
+        self.recorded = []
+
+    def committed(self, sender, changes):
+        import threading
+        self.recorded.append((threading.current_thread(), [
+            (type(target), target.id, target.title, operation)
+            for target, operation in changes]))
+
+    def test_dispatch(self):
+        import threading
+        Todo, session = self.Todo, self.db.session
+        with sqlalchemy.models_committed.connected_to(self.committed,
+                                                      sender=self.app):
+            todo = Todo('first', '')
+            session.add(todo)
+            session.commit()
+            self.db.flush_signals()
+            thread, changes = self.recorded[0]
+            self.assertFalse(thread is threading.current_thread())
+            self.assertEqual(changes, [(Todo, todo.id, 'first', 'insert')])
+
+            session.delete(todo)
+            session.commit()
+            self.db.flush_signals()
+            self.assertEqual(self.recorded[1][1],
+                             [(Todo, todo.id, 'first', 'delete')])
+
+    def test_coalescing(self):
+        self.app.config['SQLALCHEMY_ASYNC_SIGNALS_WINDOW'] = 1.0
+        Todo, session = self.Todo, self.db.session
+        with sqlalchemy.models_committed.connected_to(self.committed,
+                                                      sender=self.app):
+            todo, other = Todo('a', ''), Todo('b', '')
+            session.add_all([todo, other])
+            session.commit()
+            for title in 'cd':
+                todo.title = title
+                session.commit()
+            other.title = 'e'
+            session.commit()
+            self.db.flush_signals()
+        self.assertEqual(len(self.recorded), 1)
+        self.assertEqual(self.recorded[0][1], [
+            (Todo, todo.id, 'd', 'insert'), (Todo, other.id, 'e', 'insert')])
+
+    def test_back_pressure(self):
+        import threading
+        self.app.config['SQLALCHEMY_ASYNC_SIGNALS_QUEUE_SIZE'] = 1
+        release = threading.Event()
+
+        def committed(sender, changes):
+            release.wait()
+
+        def commit(title):
+            with self.app.app_context():
+                self.db.session.add(self.Todo(title, ''))
+                self.db.session.commit()
+                self.db.session.remove()
+
+        with sqlalchemy.models_committed.connected_to(committed,
+                                                      sender=self.app):
+            # the first commit is being sent, the second one waits in the
+            # queue and the third has to wait for it
+            commit('1')
+            time.sleep(0.05)
+            commit('2')
+            thread = threading.Thread(target=commit, args=('3',))
+            thread.start()
+            thread.join(0.2)
+            self.assertTrue(thread.is_alive())
+            release.set()
+            thread.join()
+            self.db.flush_signals()
+
+    def test_flush_at_exit(self):
+        import subprocess
+        script = '\n'.join([
+            'import time, flask, flask_sqlalchemy',
+            'app = flask.Flask(__name__)',
+            'app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = True',
+            'app.config["SQLALCHEMY_ASYNC_SIGNALS"] = True',
+            'db = flask_sqlalchemy.SQLAlchemy(app)',
+            'class Tag(db.Model):',
+            '    id = db.Column(db.Integer, primary_key=True)',
+            'def committed(sender, changes):',
+            '    time.sleep(0.2)',
+            '    print("sent")',
+            'flask_sqlalchemy.models_committed.connect(committed, app)',
+            'db.create_all()',
+            'db.session.add(Tag())',
+            'db.session.commit()',
+        ])
+        output = subprocess.check_output([sys.executable, '-c', script],
+                                         cwd=os.path.dirname(
+                                             os.path.abspath(__file__)))
+        self.assertEqual(output.decode('ascii').split(), ['sent'])
+
 
 class TablenameTestCase(unittest.TestCase):
     def test_name(self):
@@ -331,6 +903,32 @@ class TablenameTestCase(unittest.TestCase):
 
         self.assertEqual(RubberDuck.__tablename__, 'rubber_duck')
 
+    def test_mixin_hierarchy(self):
+        """Primary keys deep in mixin hierarchies are found and remembered."""
+
+        app = flask.Flask(__name__)
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        db = sqlalchemy.SQLAlchemy(app)
+
+        class IdMixin(object):
+            id = db.Column(db.Integer, primary_key=True)
+
+        class TimestampMixin(IdMixin):
+            created = db.Column(db.DateTime)
+
+        class NameMixin(TimestampMixin):
+            name = db.Column(db.String(20))
+
+        class HTTPDuck(NameMixin, db.Model):
+            pass
+
+        class Goose(NameMixin, db.Model):
+            pass
+
+        self.assertEqual(HTTPDuck.__tablename__, 'http_duck')
+        self.assertEqual(Goose.__tablename__, 'goose')
+        self.assertTrue(sqlalchemy._base_tablenames[NameMixin])
+
 
 class PaginationTestCase(unittest.TestCase):
 
@@ -380,6 +978,743 @@ class PaginationTestCase(unittest.TestCase):
             p = Todo.query.paginate()
             self.assertEqual(p.total, 100)
 
+    def count_statements(self, db):
+        counts = []
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            if 'count(' in statement.lower():
+                counts.append(statement)
+        event.listen(db.engine, 'before_cursor_execute',
+                     before_cursor_execute)
+        return counts
+
+    def test_lazy_total(self):
+        app, db, Todo = make_todo_app(['a'] * 30,
+                                      SQLALCHEMY_PAGINATION_TOTAL='lazy')
+        counts = self.count_statements(db)
+        with app.app_context():
+            p = Todo.query.paginate(2, 10)
+            self.assertEqual(len(p.items), 10)
+            self.assertEqual(counts, [])
+            self.assertTrue(p.has_next)
+            self.assertEqual(p.total, 30)
+            self.assertEqual(p.pages, 3)
+            self.assertEqual(len(counts), 1)
+
+    def test_paginate_without_count(self):
+        app, db, Todo = make_todo_app(['a'] * 25)
+        counts = self.count_statements(db)
+        with app.app_context():
+            p = Todo.query.paginate(1, 10, count=False)
+            self.assertEqual(len(p.items), 10)
+            self.assertEqual(p.total, None)
+            self.assertTrue(p.has_next)
+            self.assertEqual(p.pages, 2)
+            self.assertEqual(list(p.iter_pages()), [1, 2])
+
+            p = p.next().next()
+            self.assertEqual(p.page, 3)
+            self.assertEqual(len(p.items), 5)
+            self.assertFalse(p.has_next)
+            self.assertTrue(p.has_prev)
+            self.assertEqual(p.pages, 3)
+            self.assertEqual(list(p.iter_pages()), [1, 2, 3])
+            self.assertEqual(p.prev().total, None)
+
+            # a full last page has no next page either
+            p = Todo.query.paginate(5, 5, count=False)
+            self.assertFalse(p.has_next)
+            self.assertEqual(counts, [])
+
+    def test_paginate_with_old_signature(self):
+        class Query(sqlalchemy.BaseQuery):
+            def paginate(self, page=None, per_page=None, error_out=True):
+                return super(Query, self).paginate(page, per_page, error_out)
+
+        app = flask.Flask(__name__)
+        db = sqlalchemy.SQLAlchemy(app, query_class=Query)
+        Todo = make_todo_model(db)
+        db.create_all()
+        with app.app_context():
+            db.session.add_all([Todo('', '') for _ in range(25)])
+            db.session.commit()
+            p = Todo.query.paginate(1, 10)
+            self.assertEqual(p.next().page, 2)
+            self.assertEqual(p.next().prev().items, p.items)
+
+    def test_cached_total(self):
+        app, db, Todo = make_todo_app(['a'] * 20 + ['b'] * 5)
+        counts = self.count_statements(db)
+        cached = sqlalchemy.CachedTotal(ttl=60)
+        with app.app_context():
+            for _ in range(2):
+                p = Todo.query.paginate(2, 10, total=cached)
+                self.assertEqual(p.total, 25)
+            self.assertEqual(len(counts), 1)
+            # other parameters are counted separately
+            for title, total in [('a', 20), ('b', 5), ('a', 20)]:
+                p = Todo.query.filter_by(title=title) \
+                    .paginate(1, 2, total=cached)
+                self.assertEqual(p.total, total)
+            self.assertEqual(len(counts), 3)
+
+            expired = sqlalchemy.CachedTotal(ttl=0)
+            for _ in range(2):
+                Todo.query.paginate(2, 10, total=expired)
+            self.assertEqual(len(counts), 5)
+
+            cached.max_entries = 1
+            Todo.query.filter(Todo.id > 1).paginate(2, 10, total=cached)
+            self.assertEqual(len(cached._counts), 1)
+
+    def test_estimated_total(self):
+        class Estimated(sqlalchemy.EstimatedTotal):
+            def estimate_sqlite(self, connection, sql, params):
+                # pretend the planner overestimates tenfold
+                return connection.execute(
+                    'SELECT count(*) * 10 FROM (%s)' % sql, params).scalar()
+
+        app, db, Todo = make_todo_app(['a'] * 20 + ['b'] * 5,
+                                      SQLALCHEMY_PAGINATION_TOTAL=Estimated)
+        with app.app_context():
+            self.assertEqual(Todo.query.paginate(2, 10).total, 25)
+            self.assertEqual(
+                Todo.query.filter_by(title='a').paginate(2, 10).total, 20)
+            sqlalchemy.get_state(app).get_pagination_total().exact_below = 0
+            self.assertEqual(Todo.query.paginate(2, 10).total, 250)
+            self.assertEqual(
+                Todo.query.filter_by(title='b').paginate(1, 2).total, 50)
+            # databases without an estimate are counted
+            self.assertEqual(
+                sqlalchemy.EstimatedTotal(exact_below=0).count(Todo.query), 25)
+
+    def test_seek_paginate(self):
+        # duplicate titles are ordered by the primary key
+        titles = ['%02d' % (i // 2) for i in range(25)]
+        app, db, Todo = make_todo_app(titles)
+
+        with app.app_context():
+            pages = []
+            p = Todo.query.seek_paginate(Todo.title, per_page=10)
+            self.assertFalse(p.has_prev)
+            while True:
+                pages.append([todo.id for todo in p.items])
+                if not p.has_next:
+                    break
+                p = p.next()
+            self.assertEqual([len(page) for page in pages], [10, 10, 5])
+            self.assertEqual(sum(pages, []), list(range(1, 26)))
+
+            # walk back from the last page
+            self.assertTrue(p.has_prev)
+            back = p.prev()
+            self.assertEqual([todo.id for todo in back.items], pages[1])
+            self.assertTrue(back.has_next)
+            first = back.prev()
+            self.assertEqual([todo.id for todo in first.items], pages[0])
+            self.assertFalse(first.has_prev)
+            self.assertTrue(first.has_next)
+
+    def test_seek_paginate_descending(self):
+        app, db, Todo = make_todo_app(['a', 'b', 'b', 'c', 'd'])
+
+        with app.app_context():
+            p = Todo.query.filter(Todo.title != 'a') \
+                .seek_paginate(db.desc(Todo.title), per_page=2)
+            self.assertEqual([t.title for t in p.items], ['d', 'c'])
+            p = p.next()
+            self.assertEqual([t.title for t in p.items], ['b', 'b'])
+            self.assertEqual(p.items[0].id, 3)
+            self.assertFalse(p.has_next)
+            self.assertEqual([t.title for t in p.prev().items], ['d', 'c'])
+
+            p = db.session.query(Todo.title, Todo.id) \
+                .seek_paginate([Todo.pub_date, Todo.id], per_page=3)
+            self.assertEqual(p.items, [('a', 1), ('b', 2), ('b', 3)])
+            self.assertEqual(p.next().items, [('c', 4), ('d', 5)])
+
+    def test_seek_paginate_cursor(self):
+        app, db, Todo = make_todo_app(['a', 'b', 'c'])
+
+        @app.route('/')
+        def index():
+            p = Todo.query.seek_paginate(Todo.pub_date)
+            return ','.join([t.title for t in p.items] +
+                            [p.next_cursor or ''])
+
+        c = app.test_client()
+        titles, cursor = c.get('/?per_page=2').data.decode('utf8') \
+            .rsplit(',', 1)
+        self.assertEqual(titles, 'a,b')
+        r = c.get('/?per_page=2&cursor=' + cursor)
+        self.assertEqual(r.data.decode('utf8'), 'c,')
+        self.assertEqual(c.get('/?cursor=garbage').status_code, 404)
+
+        with app.app_context():
+            p = Todo.query.seek_paginate(Todo.pub_date, 'garbage',
+                                         error_out=False)
+            self.assertEqual(len(p.items), 3)
+            self.assertEqual(p.cursor, None)
+
+        values = [datetime(2015, 1, 2, 3, 4, 5, 6), 1.5, None, u'\xe9']
+        self.assertEqual(sqlalchemy._decode_cursor(
+            sqlalchemy._encode_cursor(values, True)), (values, True))
+
+    def test_seek_paginate_cursor_values(self):
+        tz = timezone(timedelta(hours=-5, minutes=-30))
+        values = [datetime(2015, 1, 2, 3, 4, 5, 6, tzinfo=tz),
+                  b'\x00\xff binary']
+        (aware, data), backwards = sqlalchemy._decode_cursor(
+            sqlalchemy._encode_cursor(values))
+        self.assertEqual(aware, values[0])
+        self.assertEqual(aware.utcoffset(), timedelta(hours=-5, minutes=-30))
+        self.assertEqual(data, values[1])
+        self.assertTrue(isinstance(data, bytes))
+
+
+class StreamTestCase(unittest.TestCase):
+
+    def setUp(self):
+        import tempfile
+        _, self.path = tempfile.mkstemp()
+        self.app = flask.Flask(__name__)
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + self.path
+        self.db = sqlalchemy.SQLAlchemy(self.app)
+        self.Todo = make_todo_model(self.db)
+        self.db.create_all()
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def insert(self, count, text=''):
+        table = self.Todo.__table__
+        for start in range(0, count, 1000):
+            self.db.engine.execute(table.insert(), [
+                {'title': '%06d' % (i % 7), 'text': text}
+                for i in range(start, min(start + 1000, count))])
+
+    def test_stream(self):
+        self.insert(25)
+        Todo = self.Todo
+        with self.app.app_context():
+            session = self.db.session
+            ids = [todo.id for todo in Todo.query.stream(batch_size=10)]
+            self.assertEqual(ids, list(range(1, 26)))
+            self.assertEqual(len(session.identity_map), 0)
+
+            ordered = [(t.title, t.id) for t in Todo.query.filter(Todo.id > 3)
+                       .stream(batch_size=4, order_by=self.db.desc(Todo.title))]
+            self.assertEqual(ordered, sorted(ordered, key=lambda x: (
+                -int(x[0]), -x[1])))
+            self.assertEqual(len(ordered), 22)
+
+            rows = list(session.query(Todo.id, Todo.title)
+                        .stream(batch_size=7))
+            self.assertEqual(rows[:2], [(1, '000000'), (2, '000001')])
+            self.assertEqual(len(rows), 25)
+
+            # at most one batch is in the identity map at a time
+            for todo in Todo.query.stream(batch_size=10):
+                self.assertTrue(len(session.identity_map) <= 10)
+                self.assertTrue(todo in session)
+
+    def test_stream_without_primary_key(self):
+        self.insert(3)
+        table = self.Todo.__table__
+        with self.app.app_context():
+            query = self.db.session.query(table.c.title)
+            self.assertRaises(ValueError, next, query.stream(batch_size=1))
+            rows = list(query.stream(batch_size=1, order_by=table.c.todo_id))
+            self.assertEqual(len(rows), 3)
+
+    def test_stream_memory(self):
+        rows = 2000
+        self.insert(rows)
+
+        with self.app.app_context():
+            identity_map = self.db.session.identity_map
+            todos = []
+            largest = 0
+            for todo in self.Todo.query.stream(batch_size=100):
+                # the instances are kept alive, so only expunging them
+                # keeps the identity map from growing
+                todos.append(todo)
+                largest = max(largest, len(identity_map))
+            self.assertEqual(len(todos), rows)
+            self.assertEqual(largest, 100)
+            self.assertEqual(len(identity_map), 0)
+            self.assertFalse(any(todo in self.db.session for todo in todos))
+
+
+class IdentityCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.app = app = flask.Flask(__name__)
+        app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+        self.db = db = sqlalchemy.SQLAlchemy(app)
+
+        class Plan(db.Model):
+            __cache__ = {'ttl': 60, 'max_entries': 2}
+            id = db.Column(db.Integer, primary_key=True)
+            name = db.Column(db.String(20))
+
+        self.Plan = Plan
+        db.create_all()
+        db.session.add_all([Plan(id=i, name='plan %d' % i)
+                            for i in range(1, 5)])
+        db.session.commit()
+        db.session.remove()
+
+        self.queries = []
+        event.listen(db.engine, 'before_cursor_execute',
+                     lambda conn, cursor, statement, *args:
+                     self.queries.append(statement))
+
+    def get(self, ident):
+        plan = self.Plan.query.get(ident)
+        self.db.session.remove()
+        return plan and plan.name
+
+    def test_get(self):
+        Plan, db = self.Plan, self.db
+        self.assertEqual(self.get(1), 'plan 1')
+        self.assertEqual(len(self.queries), 1)
+        self.assertEqual(self.get(1), 'plan 1')
+        self.assertEqual(Plan.query.get_or_404(1).name, 'plan 1')
+        self.assertEqual(len(self.queries), 1)
+
+        plan = Plan.query.get(1)
+        self.assertTrue(plan in db.session)
+        self.assertFalse(db.session.dirty)
+        plan.name = 'changed'
+        db.session.commit()
+        db.session.remove()
+        self.assertEqual(self.get(1), 'changed')
+        self.assertEqual(self.get(1), 'changed')
+
+        db.session.delete(Plan.query.get(1))
+        db.session.commit()
+        db.session.remove()
+        self.assertEqual(self.get(1), None)
+
+    def test_bypass(self):
+        Plan, db = self.Plan, self.db
+        self.get(1)
+        del self.queries[:]
+        self.assertEqual(Plan.query.populate_existing().get(1).name, 'plan 1')
+        db.session.remove()
+        self.assertEqual(db.session.query(Plan).get(1).name, 'plan 1')
+        self.assertEqual(len(self.queries), 2)
+        db.session.remove()
+
+        # not cached while the session changed it
+        plan = Plan.query.get(2)
+        plan.name = 'uncommitted'
+        db.session.flush()
+        db.session.expunge(plan)
+        self.assertEqual(Plan.query.get(2).name, 'uncommitted')
+        db.session.rollback()
+        db.session.remove()
+        self.assertEqual(self.get(2), 'plan 2')
+
+    def test_bulk_invalidation(self):
+        Plan, db = self.Plan, self.db
+        self.get(1)
+        Plan.query.filter(Plan.id < 3).update({'name': 'updated'})
+        db.session.commit()
+        db.session.remove()
+        self.assertEqual(self.get(1), 'updated')
+
+        db.bulk_upsert(Plan, [{'id': 1, 'name': 'upserted'}])
+        self.assertEqual(self.get(1), 'upserted')
+
+    def test_eviction(self):
+        self.Plan.__cache__ = {'ttl': 0}
+        self.get(1)
+        self.get(1)
+        self.assertEqual(len(self.queries), 2)
+
+        self.Plan.__cache__ = {'max_entries': 2}
+        for ident in 2, 3, 2, 4, 2, 3:
+            self.get(ident)
+        self.assertEqual(len(self.queries), 6)
+
+    def test_concurrent_invalidation(self):
+        state = self.app.extensions['sqlalchemy']
+        cache = state.get_identity_cache()
+        region = state.get_cache_region(self.Plan.__mapper__)
+
+        def invalidate(conn, cursor, statement, *args):
+            # another session commits a change while the plan is loaded
+            cache.delete(region, (1,))
+
+        event.listen(self.db.engine, 'before_cursor_execute', invalidate)
+        self.get(1)
+        event.remove(self.db.engine, 'before_cursor_execute', invalidate)
+        self.assertEqual(cache.get(region, (1,)), None)
+        self.get(1)
+        self.assertEqual(dict(cache.get(region, (1,))),
+                         {'id': 1, 'name': 'plan 1'})
+
+    def test_copies(self):
+        cache = sqlalchemy.MemoryIdentityCache()
+        cache.set('region', (1,), [('tags', ['a'])], 60, 10)
+        cache.get('region', (1,))[0][1].append('b')
+        self.assertEqual(cache.get('region', (1,)), [('tags', ['a'])])
+
+    def make_path(self):
+        import shutil
+        import tempfile
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        return os.path.join(path, 'cache')
+
+    def test_file_cache(self):
+        path = self.make_path()
+        self.app.config['SQLALCHEMY_IDENTITY_CACHE'] = 'file'
+        self.app.config['SQLALCHEMY_IDENTITY_CACHE_PATH'] = path
+        self.test_get()
+        self.assertEqual(os.stat(path).st_mode & 0o777, 0o700)
+
+        # another process sees the changes
+        cache = sqlalchemy.FileIdentityCache(path)
+        region = self.app.extensions['sqlalchemy'].get_cache_region(
+            self.Plan.__mapper__)
+        self.assertTrue(region.startswith(self.app.import_name + ':sqlite'))
+        self.get(2)
+        self.assertEqual(dict(cache.get(region, (2,))),
+                         {'id': 2, 'name': 'plan 2'})
+        plan = self.Plan.query.get(2)
+        plan.name = 'changed'
+        self.db.session.commit()
+        self.assertEqual(cache.get(region, (2,)), None)
+
+    def test_file_cache_invalidation(self):
+        self.app.config['SQLALCHEMY_IDENTITY_CACHE'] = 'file'
+        self.app.config['SQLALCHEMY_IDENTITY_CACHE_PATH'] = self.make_path()
+        self.test_concurrent_invalidation()
+
+    def test_file_cache_values(self):
+        import json
+        from decimal import Decimal
+        cache = sqlalchemy.FileIdentityCache(self.make_path())
+        values = [('at', datetime(2015, 1, 2, tzinfo=timezone(timedelta(0)))),
+                  ('price', Decimal('1.50')), ('data', b'\x00'),
+                  ('doc', {'a': [1]})]
+        cache.set('region', (1,), values, 60, 10)
+        self.assertEqual(cache.get('region', (1,)), values)
+        # stored as JSON, not as something that runs code when loaded
+        with open(cache._entry_path('region', (1,)), 'rb') as f:
+            json.loads(f.read().decode('utf-8'))
+
+        cache.set('region', (2,), [('value', object())], 60, 10)
+        self.assertEqual(cache.get('region', (2,)), None)
+
+    def test_file_cache_path(self):
+        self.assertRaises(TypeError, sqlalchemy.FileIdentityCache)
+        self.app.config['SQLALCHEMY_IDENTITY_CACHE'] = 'file'
+        self.assertRaises(AssertionError, self.db.make_identity_cache)
+
+        if not hasattr(os, 'getuid'):
+            return
+        path = self.make_path()
+        getuid = os.getuid
+        os.getuid = lambda: getuid() + 1
+        try:
+            self.assertRaises(ValueError, sqlalchemy.FileIdentityCache, path)
+        finally:
+            os.getuid = getuid
+
+
+class ResultCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.app, self.db, self.Todo = make_todo_app(
+            ['todo %d' % i for i in range(5)],
+            SQLALCHEMY_TRACK_MODIFICATIONS=True,
+            SQLALCHEMY_RESULT_CACHE_SIZE=3)
+
+        self.queries = []
+        event.listen(self.db.engine, 'before_cursor_execute',
+                     lambda conn, cursor, statement, *args:
+                     self.queries.append(statement))
+
+    def titles(self, query):
+        titles = [todo.title for todo in query().cache().all()]
+        self.db.session.remove()
+        return titles
+
+    def test_cache(self):
+        Todo, db = self.Todo, self.db
+        cache = db.get_result_cache()
+        def query():
+            return Todo.query.filter(Todo.id > 3).order_by(Todo.id)
+
+        self.assertEqual(self.titles(query), ['todo 3', 'todo 4'])
+        self.assertEqual(self.titles(query), ['todo 3', 'todo 4'])
+        self.assertEqual(len(self.queries), 1)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        self.assertEqual(cache.hit_ratio, 0.5)
+        self.assertTrue(cache.memory > 0)
+
+        # instances are added to the session, or reused from it
+        todo = Todo.query.get(4)
+        todos = query().cache().all()
+        self.assertTrue(todos[0] is todo)
+        self.assertTrue(todos[1] in db.session)
+        self.assertFalse(db.session.dirty)
+        self.assertEqual(todos[1].done, False)
+        db.session.remove()
+
+        rows = db.session.query(Todo.id, Todo.title).filter(Todo.id == 4) \
+            .cache().all()
+        self.assertEqual(rows, [(4, 'todo 3')])
+        rows = db.session.query(Todo.id, Todo.title).filter(Todo.id == 4) \
+            .cache().all()
+        self.assertEqual(rows[0].title, 'todo 3')
+        self.assertEqual(Todo.query.cache().count(), 5)
+        self.assertEqual(Todo.query.cache().count(), 5)
+        self.assertEqual(len(self.queries), 4)
+
+    def test_invalidation(self):
+        Todo, db = self.Todo, self.db
+        cache = db.get_result_cache()
+        def query():
+            return Todo.query.filter(Todo.id < 3).order_by(Todo.id)
+
+        self.titles(query)
+        Todo.query.get(1).title = 'changed'
+        # not cached while there are changes
+        self.assertEqual(self.titles(query)[0], 'changed')
+        self.assertEqual(len(self.queries), 4)
+        db.session.add(Todo('new', ''))
+        db.session.commit()
+        db.session.remove()
+        self.assertEqual(self.titles(query), ['todo 0', 'todo 1'])
+        self.assertEqual(len(cache), 1)
+
+        Todo.query.get(1).title = 'changed'
+        db.session.commit()
+        db.session.remove()
+        self.assertEqual(self.titles(query), ['changed', 'todo 1'])
+
+        Todo.query.cache(tags=['todos:first']).first()
+        self.assertEqual(len(cache), 2)
+        cache.invalidate('todos:first')
+        self.assertEqual(len(cache), 1)
+        cache.invalidate(Todo)
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.memory, 0)
+
+    def test_async_invalidation(self):
+        import threading
+        Todo, db = self.Todo, self.db
+        self.app.config['SQLALCHEMY_ASYNC_SIGNALS'] = True
+        release = threading.Event()
+
+        def committed(sender, changes):
+            release.wait()
+
+        def query():
+            return Todo.query.filter_by(id=1)
+
+        self.titles(query)
+        with sqlalchemy.models_committed.connected_to(committed,
+                                                      sender=self.app):
+            Todo.query.get(1).title = 'changed'
+            db.session.commit()
+            db.session.remove()
+            # invalidated by the commit, not by the delayed signal
+            self.assertEqual(self.titles(query), ['changed'])
+            release.set()
+            db.flush_signals()
+
+    def test_write_paths(self):
+        Todo, db = self.Todo, self.db
+        table = Todo.__table__
+
+        def query():
+            return Todo.query.filter_by(id=1)
+
+        def write(operation, title):
+            self.titles(query)
+            operation(title)
+            db.session.remove()
+            self.assertEqual(self.titles(query), [title])
+
+        def query_update(title):
+            Todo.query.filter_by(id=1).update({'title': title})
+            db.session.commit()
+
+        def core_update(title):
+            db.session.execute(table.update().where(table.c.todo_id == 1)
+                               .values(title=title))
+            db.session.commit()
+
+        def text_update(title):
+            db.session.execute('UPDATE todos SET title = :title '
+                               'WHERE todo_id = 1', {'title': title})
+            db.session.commit()
+
+        def unit_of_work(title):
+            Todo.query.get(1).title = title
+            db.session.commit()
+
+        write(query_update, 'query')
+        write(core_update, 'core')
+        write(text_update, 'text')
+        write(lambda title: db.bulk_upsert(
+            Todo, [{'id': 1, 'title': title, 'text': ''}]), 'upsert')
+        self.titles(lambda: Todo.query.order_by(Todo.id.desc()).limit(1))
+        db.bulk_insert(Todo, [{'title': 'inserted', 'text': ''}])
+        self.assertEqual(
+            self.titles(lambda: Todo.query.order_by(Todo.id.desc()).limit(1)),
+            ['inserted'])
+
+        # changes that aren't tracked invalidate the results as well
+        self.app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+        write(unit_of_work, 'untracked')
+        self.app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = True
+        self.app.config['SQLALCHEMY_TRACK_MODIFICATIONS_MODELS'] = []
+        write(unit_of_work, 'not opted in')
+
+        # a rollback keeps them
+        Todo.query.filter_by(id=1).update({'title': 'rolled back'})
+        db.session.rollback()
+        db.session.remove()
+        executed = len(self.queries)
+        self.assertEqual(self.titles(query), ['not opted in'])
+        self.assertEqual(len(self.queries), executed)
+
+    def test_eviction(self):
+        Todo = self.Todo
+        for ident in 1, 2, 3, 1, 4, 1, 2:
+            self.titles(lambda: Todo.query.filter_by(id=ident))
+        self.assertEqual(len(self.queries), 5)
+        self.assertEqual(len(self.db.get_result_cache()), 3)
+
+
+class BulkTestCase(unittest.TestCase):
+
+    def setUp(self):
+        app = flask.Flask(__name__)
+        app.config['SQLALCHEMY_BINDS'] = {'other': 'sqlite://'}
+        app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = True
+        self.db = db = sqlalchemy.SQLAlchemy(app)
+        self.Todo = make_todo_model(db)
+
+        class Tag(db.Model):
+            __bind_key__ = 'other'
+            name = db.Column(db.String(20), primary_key=True)
+            uses = db.Column(db.Integer, default=1)
+            color = db.Column(db.String(20))
+
+        self.Tag = Tag
+        db.create_all()
+        self.app = app
+
+    def test_bulk_insert(self):
+        Todo, Tag = self.Todo, self.Tag
+        rows = ({'title': str(i), 'text': 'x'} for i in range(25))
+        with self.app.app_context():
+            self.assertEqual(self.db.bulk_insert(Todo, rows, chunk_size=10), 25)
+            self.assertEqual(Todo.query.count(), 25)
+            self.assertEqual(self.db.bulk_insert(Todo, []), 0)
+
+            # instances, routed to the bind of the model
+            self.db.bulk_insert(Tag, [Tag(name='a'), Tag(name='b', uses=3)])
+            self.assertEqual(
+                sorted((t.name, t.uses) for t in Tag.query),
+                [('a', 1), ('b', 3)])
+            self.assertEqual(
+                self.db.get_engine(self.app, 'other').execute(
+                    'SELECT count(*) FROM tag').scalar(), 2)
+
+    def test_bulk_upsert(self):
+        import sqlite3
+        if sqlite3.sqlite_version_info < (3, 24):
+            return
+        Tag = self.Tag
+        with self.app.app_context():
+            self.db.bulk_insert(Tag, [{'name': 'a', 'uses': 1, 'color': 'red'},
+                                      {'name': 'b', 'uses': 1}])
+            self.db.bulk_upsert(Tag, [{'name': 'a', 'uses': 5},
+                                      {'name': 'c', 'uses': 2}])
+            self.assertEqual(
+                sorted((t.name, t.uses, t.color) for t in Tag.query),
+                [('a', 5, 'red'), ('b', 1, None), ('c', 2, None)])
+
+            # existing rows are left alone without columns to update
+            self.db.bulk_upsert(Tag, [{'name': 'b', 'uses': 9}], update=[])
+            self.assertEqual(Tag.query.get('b').uses, 1)
+
+            self.db.bulk_upsert(Tag, [{'name': 'a', 'uses': 7,
+                                       'color': 'blue'}],
+                                update=['color'])
+            tag = Tag.query.filter_by(name='a').one()
+            self.assertEqual((tag.uses, tag.color), (5, 'blue'))
+
+    def test_inheritance(self):
+        db = self.db
+
+        class Tagged(self.Tag):
+            __bind_key__ = 'other'
+            name = db.Column(db.String(20), db.ForeignKey('tag.name'),
+                             primary_key=True)
+            note = db.Column(db.String(20))
+
+        class Colored(self.Tag):
+            pass
+
+        db.create_all(bind='other')
+        with self.app.app_context():
+            self.assertRaises(ValueError, db.bulk_insert, Tagged,
+                              [{'name': 'a', 'uses': 2, 'note': 'x'}])
+            self.assertEqual(self.Tag.query.count(), 0)
+            # single table inheritance writes the same table
+            db.bulk_insert(Colored, [{'name': 'b', 'color': 'red'}])
+            self.assertEqual(self.Tag.query.get('b').color, 'red')
+
+    def test_upsert_statements(self):
+        from sqlalchemy.dialects import mysql, postgresql
+        Tag = self.Tag
+        table = Tag.__table__
+        statement = sqlalchemy._Upsert(table, [table.c.name],
+                                       [table.c.uses])
+        self.assertTrue(str(statement.compile(dialect=postgresql.dialect()))
+                        .endswith('ON CONFLICT (name) DO UPDATE SET '
+                                  'uses = excluded.uses'))
+        self.assertTrue(str(statement.compile(dialect=mysql.dialect()))
+                        .endswith('ON DUPLICATE KEY UPDATE '
+                                  'uses = VALUES(uses)'))
+
+    def test_signals(self):
+        Todo = self.Todo
+        received = []
+
+        def committed(sender, changes):
+            received.append((sender, changes))
+
+        with sqlalchemy.models_committed.connected_to(committed,
+                                                      sender=self.app):
+            self.db.bulk_insert(Todo, [{'title': 'a'}], app=self.app)
+            self.db.bulk_insert(Todo, [{'title': 'b'}], app=self.app,
+                                send_signals=True)
+        self.assertEqual(received, [(self.app, [(Todo, 'insert')])])
+
+    def test_signals_with_default_config(self):
+        app, db, Todo = make_todo_app()
+        received = []
+
+        def committed(sender, changes):
+            received.append(changes)
+
+        with sqlalchemy.models_committed.connected_to(committed, sender=app):
+            db.bulk_insert(Todo, [{'title': 'a'}], app=app, send_signals=True)
+            app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+            db.bulk_insert(Todo, [{'title': 'b'}], app=app, send_signals=True)
+        self.assertEqual(received, [[(Todo, 'insert')]])
+
 
 class BindsTestCase(unittest.TestCase):
 
@@ -456,6 +1791,514 @@ class BindsTestCase(unittest.TestCase):
             Baz.__table__: db.get_engine(app, None)
         })
 
+    def test_concurrent_ddl(self):
+        import shutil
+        import tempfile
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+
+        def make_app():
+            app = flask.Flask(__name__)
+            app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+            app.config['SQLALCHEMY_DDL_WORKERS'] = 2
+            app.config['SQLALCHEMY_BINDS'] = dict(
+                (key, 'sqlite:///' + os.path.join(path, key + '.db'))
+                for key in ('foo', 'bar', 'baz'))
+            app.config['SQLALCHEMY_BINDS']['broken'] = \
+                'sqlite:///' + os.path.join(path, 'missing', 'broken.db')
+            return app
+
+        app = make_app()
+        db = sqlalchemy.SQLAlchemy(app)
+
+        class Default(db.Model):
+            id = db.Column(db.Integer, primary_key=True)
+
+        for key in 'foo', 'bar', 'baz', 'broken':
+            parent = type(key.title(), (db.Model,), {
+                '__bind_key__': key,
+                'id': db.Column(db.Integer, primary_key=True)})
+            type(key.title() + 'Child', (db.Model,), {
+                '__bind_key__': key,
+                'id': db.Column(db.Integer, primary_key=True),
+                'parent_id': db.Column(db.ForeignKey(parent.id))})
+
+        # every bind is handled, the errors are raised together
+        with self.assertRaises(sqlalchemy.BindErrors) as cm:
+            db.create_all()
+        self.assertEqual(list(cm.exception.errors), ['broken'])
+        for key in None, 'foo', 'bar', 'baz':
+            tables = db.get_engine(app, key).table_names()
+            self.assertEqual(sorted(tables), sorted(
+                table.name for table in db.get_tables_for_bind(key)))
+
+        other = sqlalchemy.SQLAlchemy(make_app())
+        other.reflect(bind=['foo', 'bar', 'baz'])
+        self.assertEqual(sorted(other.metadata.tables), [
+            'bar', 'bar_child', 'baz', 'baz_child', 'foo', 'foo_child'])
+        self.assertEqual(
+            list(other.metadata.tables['foo_child'].c.parent_id
+                 .foreign_keys)[0].column.table.name, 'foo')
+
+        db.drop_all(bind=[None, 'foo', 'bar', 'baz'])
+        for key in None, 'foo', 'bar', 'baz':
+            self.assertEqual(db.get_engine(app, key).table_names(), [])
+
+    def test_binds_cache(self):
+        app = flask.Flask(__name__)
+        app.config['SQLALCHEMY_BINDS'] = {'foo': 'sqlite://'}
+        db = sqlalchemy.SQLAlchemy(app)
+        state = app.extensions['sqlalchemy']
+
+        class Foo(db.Model):
+            __bind_key__ = 'foo'
+            id = db.Column(db.Integer, primary_key=True)
+
+        binds = state.get_binds()
+        self.assertTrue(state.get_binds() is binds)
+        self.assertEqual(binds, db.get_binds(app))
+        self.assertEqual(state.get_binds(default=False),
+                         {Foo.__table__: db.get_engine(app, 'foo')})
+
+        # defining a new model invalidates the mapping
+        class Baz(db.Model):
+            id = db.Column(db.Integer, primary_key=True)
+
+        binds = state.get_binds()
+        self.assertTrue(Baz.__table__ in binds)
+        self.assertTrue(Baz.__table__ not in state.get_binds(default=False))
+
+        # so does swapping a table for another one with the same count
+        db.metadata.remove(Baz.__table__)
+        bar = db.Table('bar', db.Column('id', db.Integer), info={
+            'bind_key': 'foo'})
+        binds = state.get_binds()
+        self.assertTrue(Baz.__table__ not in binds)
+        self.assertEqual(binds[bar], db.get_engine(app, 'foo'))
+
+        # a change of the configured binds is picked up by reconfigure
+        app.config['SQLALCHEMY_BINDS'] = {'foo': 'sqlite://',
+                                          'bar': 'sqlite://'}
+        self.assertTrue(state.get_binds() is binds)
+        db.reconfigure()
+        self.assertFalse(state.get_binds() is binds)
+
+        # sessions route bound tables through the cached mapping
+        session = db.create_scoped_session()()
+        self.assertEqual(session.get_bind(clause=Foo.__table__.insert()),
+                         db.get_engine(app, 'foo'))
+        self.assertEqual(session.get_bind(clause=Baz.__table__.insert()),
+                         db.engine)
+
+    def test_mapper_binds(self):
+        app = flask.Flask(__name__)
+        app.config['SQLALCHEMY_BINDS'] = {'foo': 'sqlite://'}
+        db = sqlalchemy.SQLAlchemy(app)
+        state = app.extensions['sqlalchemy']
+
+        class Foo(db.Model):
+            __bind_key__ = 'foo'
+            id = db.Column(db.Integer, primary_key=True)
+
+        class Baz(db.Model):
+            id = db.Column(db.Integer, primary_key=True)
+
+        session = db.session()
+        self.assertEqual(session.get_bind(Foo.__mapper__),
+                         db.get_engine(app, 'foo'))
+        self.assertEqual(session.get_bind(Baz.__mapper__), db.engine)
+        self.assertEqual(state.mapper_binds, {
+            Foo.__mapper__: db.get_engine(app, 'foo'),
+            Baz.__mapper__: None,
+        })
+
+        db.reconfigure()
+        self.assertEqual(state.mapper_binds, {})
+
+    def test_reconfigure(self):
+        app = flask.Flask(__name__)
+        app.config['SQLALCHEMY_BINDS'] = {'foo': 'sqlite://'}
+        db = sqlalchemy.SQLAlchemy(app)
+        engine = db.engine
+        foo_engine = db.get_engine(app, 'foo')
+        disposed = []
+        for e in engine, foo_engine:
+            db.event.listen(e, 'engine_disposed', disposed.append)
+
+        # configuration changes are only picked up explicitly
+        app.config['SQLALCHEMY_ECHO'] = True
+        self.assertTrue(db.engine is engine)
+
+        db.reconfigure(bind='foo')
+        self.assertTrue(db.engine is engine)
+        self.assertFalse(db.get_engine(app, 'foo') is foo_engine)
+        self.assertTrue(db.get_engine(app, 'foo').echo)
+        # the replaced engine's pool is closed
+        self.assertEqual(disposed, [foo_engine])
+
+        db.reconfigure()
+        self.assertFalse(db.engine is engine)
+        self.assertTrue(db.engine.echo)
+
+        # unchanged configuration keeps the engines
+        engine = db.engine
+        db.reconfigure()
+        self.assertTrue(db.engine is engine)
+
+
+class _StubPool(object):
+
+    def __init__(self, checkedout):
+        self._checkedout = checkedout
+
+    def checkedout(self):
+        return self._checkedout
+
+
+class _StubEngine(object):
+
+    def __init__(self, checkedout=0):
+        self.pool = _StubPool(checkedout)
+
+
+class ReplicaBalancerTestCase(unittest.TestCase):
+
+    def make_app(self, balancer, weights=None):
+        app = flask.Flask(__name__)
+        app.config['SQLALCHEMY_DATABASE_SLAVE_URIS'] = ['sqlite://',
+                                                        'sqlite://']
+        app.config['SQLALCHEMY_DATABASE_SLAVE_WEIGHTS'] = weights
+        app.config['SQLALCHEMY_DATABASE_SLAVE_BALANCER'] = balancer
+        db = sqlalchemy.SQLAlchemy(app)
+        return app, db
+
+    def test_reads_use_replicas(self):
+        app, db = self.make_app('random')
+        Todo = make_todo_model(db)
+        state = app.extensions['sqlalchemy']
+        replicas = state.get_replicas()
+        self.assertEqual([r.bind for r in replicas], ['slaves_0', 'slaves_1'])
+        self.assertTrue(isinstance(state.balancer, sqlalchemy.RandomBalancer))
+
+        engines = [r.engine for r in replicas]
+        session = db.session()
+        bind = session.get_bind(clause=Todo.__table__.select())
+        self.assertTrue(bind in engines)
+        bind = session.get_bind(clause=Todo.__table__.insert())
+        self.assertTrue(bind is db.engine)
+
+    def test_balancer_class_and_instance(self):
+        app, db = self.make_app(sqlalchemy.LeastConnectionsBalancer)
+        state = app.extensions['sqlalchemy']
+        state.get_replicas()
+        self.assertTrue(isinstance(state.balancer,
+                                   sqlalchemy.LeastConnectionsBalancer))
+
+        balancer = sqlalchemy.RoundRobinBalancer()
+        app, db = self.make_app(balancer)
+        state = app.extensions['sqlalchemy']
+        state.get_replicas()
+        self.assertTrue(state.balancer is balancer)
+
+    def test_round_robin(self):
+        app, db = self.make_app('round_robin', weights=[1, 3])
+        state = app.extensions['sqlalchemy']
+        picks = [state.choose_replica().bind for _ in range(8)]
+        self.assertEqual(picks.count('slaves_0'), 2)
+        self.assertEqual(picks.count('slaves_1'), 6)
+        # picks are spread out instead of sent in bursts
+        self.assertEqual(picks[:4].count('slaves_0'), 1)
+
+    def test_least_connections(self):
+        balancer = sqlalchemy.LeastConnectionsBalancer()
+        idle = sqlalchemy.Replica('slaves_0', _StubEngine(1))
+        busy = sqlalchemy.Replica('slaves_1', _StubEngine(3))
+        self.assertTrue(balancer.choose([idle, busy]) is idle)
+
+        big = sqlalchemy.Replica('slaves_1', _StubEngine(3), weight=4)
+        self.assertTrue(balancer.choose([idle, big]) is big)
+
+    def test_power_of_two_choices(self):
+        app, db = self.make_app('power_of_two_choices')
+        state = app.extensions['sqlalchemy']
+        fast, slow = state.get_replicas()
+        balancer = state.balancer
+
+        balancer.observe(fast, 0.001)
+        balancer.observe(slow, 0.5)
+        for _ in range(10):
+            self.assertTrue(state.choose_replica() is fast)
+
+        # queries on the replica engines feed the average
+        with fast.engine.connect() as conn:
+            conn.execute('SELECT 1')
+        self.assertTrue(balancer.latency(fast) < 0.5)
+
+        # old measurements decay
+        self.assertAlmostEqual(
+            balancer.latency(slow), 0.5)
+        balancer.observe(slow, 0.0, now=_timer() + 1000)
+        self.assertTrue(balancer.latency(slow) < 0.001)
+
+
+class ReplicaHealthTestCase(unittest.TestCase):
+
+    def setUp(self):
+        import tempfile
+        self.directory = tempfile.mkdtemp()
+        self.paths = [os.path.join(self.directory, 'replica%d.db' % i)
+                      for i in range(2)]
+
+        self.app = app = flask.Flask(__name__)
+        app.config['SQLALCHEMY_DATABASE_SLAVE_URIS'] = [
+            'sqlite:///' + path for path in self.paths]
+        app.config['SQLALCHEMY_DATABASE_SLAVE_BALANCER'] = 'round_robin'
+        app.config['SQLALCHEMY_DATABASE_SLAVE_MAX_FAILURES'] = 2
+        app.config['SQLALCHEMY_DATABASE_SLAVE_EJECT_TIME'] = 0.05
+        self.db = sqlalchemy.SQLAlchemy(app)
+        self.Todo = make_todo_model(self.db)
+        self.db.create_all()
+        for replica in self.db.get_replicas():
+            self.db.metadata.create_all(bind=replica.engine)
+
+    def tearDown(self):
+        import shutil
+        sqlalchemy.get_state(self.app).invalidate_replicas()
+        shutil.rmtree(self.directory)
+
+    def break_replica(self, index):
+        os.remove(self.paths[index])
+        os.mkdir(self.paths[index])
+
+    def repair_replica(self, index):
+        os.rmdir(self.paths[index])
+        engine = self.db.get_replicas()[index].engine
+        self.db.metadata.create_all(bind=engine)
+
+    def read(self):
+        try:
+            self.Todo.query.all()
+            return True
+        except OperationalError:
+            return False
+        finally:
+            self.db.session.remove()
+
+    def test_circuit_breaker(self):
+        replica = sqlalchemy.Replica('slaves_0', None, max_failures=2,
+                                     eject_time=1, max_eject_time=3)
+        self.assertFalse(replica.record_failure(now=0))
+        self.assertTrue(replica.is_available())
+        self.assertTrue(replica.record_failure(now=0))
+        self.assertFalse(replica.is_available())
+        self.assertFalse(replica.claim_probe(now=0.5))
+        # errors of reads that were in flight don't extend the ejection
+        self.assertFalse(replica.record_failure(now=0.5))
+
+        # once the back-off is over a single read probes the replica
+        self.assertTrue(replica.claim_probe(now=1))
+        self.assertFalse(replica.claim_probe(now=1))
+        self.assertFalse(replica.is_available())
+        # a failed probe doubles the back-off ...
+        self.assertTrue(replica.record_failure(now=1.5))
+        self.assertFalse(replica.claim_probe(now=3))
+        self.assertTrue(replica.claim_probe(now=3.5))
+        # ... up to the maximum
+        self.assertTrue(replica.record_failure(now=3.5))
+        self.assertFalse(replica.claim_probe(now=6))
+        self.assertTrue(replica.claim_probe(now=6.5))
+        # a probe that never connects lets another read probe
+        self.assertFalse(replica.claim_probe(now=7))
+        self.assertTrue(replica.claim_probe(now=7.5))
+
+        self.assertTrue(replica.record_success())
+        self.assertTrue(replica.is_available())
+        self.assertFalse(replica.record_success())
+        self.assertEqual((replica.failures, replica.ejections), (0, 0))
+
+    def test_eject_and_restore(self):
+        ejected = []
+        restored = []
+
+        def on_ejected(sender, replica):
+            ejected.append(replica.bind)
+
+        def on_restored(sender, replica):
+            restored.append(replica.bind)
+
+        with sqlalchemy.replica_ejected.connected_to(on_ejected,
+                                                     sender=self.app), \
+                sqlalchemy.replica_restored.connected_to(on_restored,
+                                                         sender=self.app):
+            self.break_replica(0)
+            results = [self.read() for _ in range(6)]
+            self.assertEqual(results.count(False), 2)
+            self.assertEqual(ejected, ['slaves_0'])
+            status = [r.status for r in self.db.get_replicas()]
+            self.assertFalse(status[0]['available'])
+            self.assertEqual(status[0]['ejections'], 1)
+            self.assertTrue(status[1]['available'])
+
+            # with every replica out reads go to the master
+            self.break_replica(1)
+            self.assertFalse(self.read())
+            self.assertFalse(self.read())
+            self.assertEqual(ejected, ['slaves_0', 'slaves_1'])
+            self.assertTrue(self.read())
+            self.assertTrue(self.read())
+
+            # replicas come back once the back-off is over
+            self.repair_replica(0)
+            self.repair_replica(1)
+            time.sleep(0.06)
+            self.assertTrue(all([self.read() for _ in range(4)]))
+            self.assertEqual(sorted(restored), ['slaves_0', 'slaves_1'])
+
+    def test_single_probe(self):
+        state = sqlalchemy.get_state(self.app)
+        replicas = self.db.get_replicas()
+        self.break_replica(0)
+        for _ in range(6):
+            self.read()
+        self.assertFalse(replicas[0].is_available())
+        time.sleep(0.06)
+        # only the first read after the back-off goes to the replica
+        chosen = [state.choose_replica() for _ in range(4)]
+        self.assertEqual(chosen, [replicas[0]] + [replicas[1]] * 3)
+        self.assertFalse(replicas[0].is_available())
+
+    def test_background_ping(self):
+        self.app.config['SQLALCHEMY_DATABASE_SLAVE_PING_INTERVAL'] = 0.01
+        self.db.reconfigure()
+        replica = self.db.get_replicas()[0]
+
+        self.break_replica(0)
+        deadline = time.time() + 5
+        while replica.is_available() and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertFalse(replica.is_available())
+
+        self.repair_replica(0)
+        while not replica.is_available() and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertTrue(replica.is_available())
+        self.assertEqual(replica.ejections, 0)
+
+
+class _StubLagProbe(sqlalchemy.ReplicationLagProbe):
+
+    def __init__(self):
+        sqlalchemy.ReplicationLagProbe.__init__(self, interval=0)
+        self.lags = {}
+
+    def measure(self, replica):
+        return self.lags.get(replica.bind)
+
+
+class ReadYourWritesTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.app = app = flask.Flask(__name__)
+        app.config['SQLALCHEMY_DATABASE_SLAVE_URIS'] = ['sqlite://',
+                                                        'sqlite://']
+        app.config['SQLALCHEMY_DATABASE_SLAVE_STICKY_TIME'] = 0.1
+        self.db = sqlalchemy.SQLAlchemy(app)
+        self.Todo = make_todo_model(self.db)
+        self.db.create_all()
+        self.replica_engines = [r.engine for r in self.db.get_replicas()]
+
+    def read_bind(self):
+        return self.db.session.get_bind(
+            self.Todo.__mapper__, clause=self.Todo.__table__.select())
+
+    def assertReadsFromMaster(self):
+        self.assertTrue(self.read_bind() is self.db.engine)
+
+    def assertReadsFromReplica(self):
+        self.assertTrue(self.read_bind() in self.replica_engines)
+
+    def test_sticky_time(self):
+        self.assertReadsFromReplica()
+        self.db.session.add(self.Todo('Test', 'test'))
+        self.db.session.flush()
+        # uncommitted writes are only visible on the master
+        self.assertReadsFromMaster()
+        self.db.session.commit()
+        self.assertReadsFromMaster()
+        time.sleep(0.1)
+        self.assertReadsFromReplica()
+
+    def test_sticky_key(self):
+        client = ['alice']
+        self.app.config['SQLALCHEMY_DATABASE_SLAVE_STICKY_KEY'] = \
+            lambda: client[0]
+        self.db.reconfigure()
+        self.db.session.add(self.Todo('Test', 'test'))
+        self.db.session.commit()
+        self.db.session.remove()
+        # a later session of the same client still sees the write
+        self.assertReadsFromMaster()
+        client[0] = 'bob'
+        self.assertReadsFromReplica()
+        client[0] = None
+        self.assertReadsFromReplica()
+        client[0] = 'alice'
+        time.sleep(0.1)
+        self.assertReadsFromReplica()
+
+        # clients are forgotten after the sticky time
+        self.db.session.add(self.Todo('Test', 'test'))
+        self.db.session.commit()
+        client[0] = 'bob'
+        self.db.session.add(self.Todo('Test', 'test'))
+        self.db.session.commit()
+        last_writes = sqlalchemy.get_state(self.app)._last_writes
+        self.assertEqual(list(last_writes), ['alice', 'bob'])
+        time.sleep(0.1)
+        self.db.session.add(self.Todo('Test', 'test'))
+        self.db.session.commit()
+        self.assertEqual(list(last_writes), ['bob'])
+
+    def test_rollback(self):
+        self.db.session.add(self.Todo('Test', 'test'))
+        self.db.session.flush()
+        self.db.session.rollback()
+        self.assertReadsFromReplica()
+
+    def test_explicit_modes(self):
+        self.db.session.add(self.Todo('Test', 'test'))
+        self.db.session.commit()
+        with self.app.test_request_context():
+            with sqlalchemy.bind_slave.using():
+                self.assertReadsFromReplica()
+
+    def test_disabled(self):
+        self.app.config['SQLALCHEMY_DATABASE_SLAVE_STICKY_TIME'] = None
+        self.db.reconfigure()
+        self.db.session.add(self.Todo('Test', 'test'))
+        self.db.session.flush()
+        self.assertReadsFromReplica()
+
+    def test_lag_probe(self):
+        self.app.config['SQLALCHEMY_DATABASE_SLAVE_LAG_PROBE'] = _StubLagProbe
+        self.app.config['SQLALCHEMY_DATABASE_SLAVE_STICKY_TIME'] = 60
+        self.db.reconfigure()
+        self.db.get_replicas()
+        probe = sqlalchemy.get_state(self.app).lag_probe
+        self.assertTrue(isinstance(probe, _StubLagProbe))
+
+        self.db.session.add(self.Todo('Test', 'test'))
+        self.db.session.commit()
+        # unknown lag
+        self.assertReadsFromMaster()
+        # lagging replicas
+        probe.lags = {'slaves_0': 30, 'slaves_1': 30}
+        self.assertReadsFromMaster()
+        # one replica caught up
+        probe.lags = {'slaves_0': 30, 'slaves_1': 0}
+        for _ in range(5):
+            self.assertTrue(self.read_bind() is self.replica_engines[1])
+
 
 class DefaultQueryClassTestCase(unittest.TestCase):
 
@@ -563,6 +2406,24 @@ class SQLAlchemyIncludesTestCase(unittest.TestCase):
         from flask_sqlalchemy import BaseQuery
         self.assertTrue(db.Query == BaseQuery)
 
+    def test_lazy(self):
+        """The objects are looked up on first use."""
+        class CustomQuery(sqlalchemy.BaseQuery):
+            pass
+
+        db = sqlalchemy.SQLAlchemy(query_class=CustomQuery)
+        other = sqlalchemy.SQLAlchemy()
+        self.assertFalse('Column' in db.__dict__)
+        self.assertTrue('Column' in dir(db))
+        self.assertTrue(db.Column is other.Column)
+        self.assertTrue(db.and_ is other.and_)
+        self.assertTrue(db.event is event)
+        self.assertFalse(db.relationship is other.relationship)
+        self.assertEqual(db.relationship('Other').query_class, CustomQuery)
+        self.assertTrue(db.Table('lazy', db.Column('id', db.Integer))
+                        .metadata is db.metadata)
+        self.assertRaises(AttributeError, getattr, db, 'no_such_thing')
+
 
 class RegressionTestCase(unittest.TestCase):
 
@@ -753,11 +2614,20 @@ class StandardSessionTestCase(unittest.TestCase):
 def suite():
     suite = unittest.TestSuite()
     suite.addTest(unittest.makeSuite(BasicAppTestCase))
+    suite.addTest(unittest.makeSuite(QueryRecordingTestCase))
+    suite.addTest(unittest.makeSuite(MetricsTestCase))
     suite.addTest(unittest.makeSuite(MetaDataTestCase))
     suite.addTest(unittest.makeSuite(TestQueryProperty))
     suite.addTest(unittest.makeSuite(TablenameTestCase))
     suite.addTest(unittest.makeSuite(PaginationTestCase))
+    suite.addTest(unittest.makeSuite(StreamTestCase))
+    suite.addTest(unittest.makeSuite(IdentityCacheTestCase))
+    suite.addTest(unittest.makeSuite(ResultCacheTestCase))
+    suite.addTest(unittest.makeSuite(BulkTestCase))
     suite.addTest(unittest.makeSuite(BindsTestCase))
+    suite.addTest(unittest.makeSuite(ReplicaBalancerTestCase))
+    suite.addTest(unittest.makeSuite(ReplicaHealthTestCase))
+    suite.addTest(unittest.makeSuite(ReadYourWritesTestCase))
     suite.addTest(unittest.makeSuite(DefaultQueryClassTestCase))
     suite.addTest(unittest.makeSuite(SQLAlchemyIncludesTestCase))
     suite.addTest(unittest.makeSuite(RegressionTestCase))
@@ -765,6 +2635,7 @@ def suite():
     suite.addTest(unittest.makeSuite(CommitOnTeardownTestCase))
     if flask.signals_available:
         suite.addTest(unittest.makeSuite(SignallingTestCase))
+        suite.addTest(unittest.makeSuite(AsyncSignalsTestCase))
     suite.addTest(unittest.makeSuite(StandardSessionTestCase))
     return suite
 